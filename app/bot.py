@@ -1,25 +1,38 @@
 import asyncio
 import logging
+import signal
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
-from app.config import BOT_TOKEN
-from app.database import init_db
+from app import metrics
+from app.config import BOT_TOKEN, BOT_MODE, METRICS_HOST, METRICS_PORT, SHARDS, SHARD_NAME
+from app.database import init_db, close_db
+from app.services.state import backend
+from app.services.sender import outbox
+from app.services.payments import zarinpal
+from app.services import bans, coins, filtered_matcher, profiler, queue_sweeper, reports
+from app.services.fsm_storage import SQLiteStorage
+from app.services.bot_session import CachedMarkupSession
+from app.webhook_server import run_webhook
+from app.shard_server import run_shard
 
 # Routers
+from app.handlers.admin import router as admin_router
 from app.handlers.start import router as start_router
 from app.handlers.register import router as register_router
 from app.handlers.profile import router as profile_router
+from app.handlers.special_search import router as special_search_router
 from app.handlers.match import router as match_router
 from app.handlers.report import router as report_router
 from app.handlers.chat import router as chat_router
 from app.handlers.payments import router as payments_router
 
 # Middlewares
-from app.middlewares.auth import AuthMiddleware
-from app.middlewares.ban import BanMiddleware
+from app.middlewares.user import UserMiddleware
+from app.middlewares.metrics import MetricsMiddleware
+from app.middlewares.profiler import ProfilerMiddleware
 
 
 logging.basicConfig(
@@ -28,38 +41,98 @@ logging.basicConfig(
 )
 
 
-async def main():
-    bot = Bot(
+def create_bot(session=None) -> Bot:
+    return Bot(
         token=BOT_TOKEN,
+        session=session or CachedMarkupSession(),
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
 
-    dp = Dispatcher()
 
-    # Middlewares
-    dp.message.middleware(BanMiddleware())
-    dp.callback_query.middleware(BanMiddleware())
+def create_dispatcher() -> Dispatcher:
+    """ساخت Dispatcher با تمام middlewareها و routerها"""
+    dp = Dispatcher(storage=SQLiteStorage())
 
-    dp.message.middleware(AuthMiddleware())
-    dp.callback_query.middleware(AuthMiddleware())
+    # Middlewares (profiler and metrics first, so they see the time of the others)
+    profiler_middleware = ProfilerMiddleware()
+    dp.update.outer_middleware(profiler_middleware)
+    dp.message.middleware(profiler_middleware)
+    dp.callback_query.middleware(profiler_middleware)
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+    dp.message.middleware(UserMiddleware())
+    dp.callback_query.middleware(UserMiddleware())
 
     # Routers
+    dp.include_router(admin_router)
     dp.include_router(start_router)
     dp.include_router(register_router)
     dp.include_router(profile_router)
     dp.include_router(payments_router)
+    dp.include_router(special_search_router)
     dp.include_router(match_router)
     dp.include_router(report_router)
     dp.include_router(chat_router)
 
+    return dp
+
 
+async def start_services(bot: Bot):
+    """دیتابیس و سرویس‌های پس‌زمینه؛ قبل از اولین آپدیت"""
     await init_db()
+    await backend.start()
+    await filtered_matcher.start()
+    await coins.start()
+    await bans.start()
+    await reports.load()
+    await queue_sweeper.start(bot)
+
+
+async def stop_services(dp: Dispatcher):
+    await queue_sweeper.stop()
+    await outbox.close()
+    await zarinpal.close()
+    await filtered_matcher.stop()
+    await backend.close()
+    await coins.stop()
+    await bans.stop()
+    await dp.storage.close()
+    await close_db()
+
+
+async def main():
+    bot = create_bot()
+    dp = create_dispatcher()
+
+    await start_services(bot)
+
+    metrics_server = None
+    if METRICS_PORT:
+        metrics.collector(metrics.collect_chat_state)
+        metrics.collector(metrics.collect_pending_payments)
+        # Shards on one host each take the next port
+        port = METRICS_PORT + (SHARDS.index(SHARD_NAME) if SHARD_NAME in SHARDS else 0)
+        metrics_server = await metrics.start_server(METRICS_HOST, port)
+
+    # kill -USR1 <pid> profiles for PROFILE_DURATION seconds into PROFILE_DIR
+    if hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.start)
 
     print("✅ ربات با موفقیت راه‌اندازی شد!")
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        elif BOT_MODE == "shard":
+            await run_shard(bot, dp)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await stop_services(dp)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
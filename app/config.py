@@ -8,13 +8,129 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 BOT_USERNAME = os.getenv("BOT_USERNAME")
 
 DATABASE_URL = "database.db"
+DB_READERS = int(os.getenv("DB_READERS", 4))
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 50000))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))
+
+# Where the waiting queue and active chats live: "memory" or "redis"
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "chatbot:")
+
+# Seconds between write-behind flushes of chats / waiting queue to SQLite
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", 0.5))
+
+# Seconds a search stays in the waiting queue before it is dropped (0 = never),
+# between "still searching" messages (0 = off), and between expiry sweeps
+WAITING_TTL = int(os.getenv("WAITING_TTL", 600))
+WAITING_PING_INTERVAL = int(os.getenv("WAITING_PING_INTERVAL", 120))
+WAITING_SWEEP_INTERVAL = float(os.getenv("WAITING_SWEEP_INTERVAL", 5))
+# Seconds a pair may stay reserved before the sweeper undoes it; taking
+# the coins takes far less, so only a process that died leaves one behind
+PAIRING_TIMEOUT = int(os.getenv("PAIRING_TIMEOUT", 60))
+
+# Seconds before an unmatched special search widens its filters by one step
+SPECIAL_SEARCH_FALLBACK_SECONDS = int(os.getenv("SPECIAL_SEARCH_FALLBACK_SECONDS", 60))
+
+# Seconds between group commits of the coin ledger, and cached balances
+COIN_FLUSH_INTERVAL = float(os.getenv("COIN_FLUSH_INTERVAL", 0.2))
+COIN_CACHE_SIZE = int(os.getenv("COIN_CACHE_SIZE", 100000))
+
+# FSM (registration, profile edits) stored in SQLite
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 1))
+# Seconds a half-finished form is kept without any change
+FSM_TTL = int(os.getenv("FSM_TTL", 24 * 3600))
+FSM_SWEEP_INTERVAL = float(os.getenv("FSM_SWEEP_INTERVAL", 600))
+
+# Automatic bans: this many distinct reporters within REPORT_WINDOW seconds
+# bans a user; each further ban uses the next duration (seconds) in the list
+REPORT_WINDOW = int(os.getenv("REPORT_WINDOW", 24 * 3600))
+REPORT_BAN_THRESHOLD = int(os.getenv("REPORT_BAN_THRESHOLD", 3))
+REPORT_BAN_DURATIONS = [
+    int(s) for s in os.getenv("REPORT_BAN_DURATIONS", "3600,86400,604800,2592000").split(",")
+]
+# Seconds between reloads of the banned-user set (bans made by other processes)
+BAN_REFRESH_INTERVAL = float(os.getenv("BAN_REFRESH_INTERVAL", 30))
+
+# Prometheus metrics of the bot process on http://METRICS_HOST:METRICS_PORT/metrics
+# (0 turns the server off; the payment API serves /metrics on its own port)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
 
 ADMIN_ID = int(os.getenv("ADMIN_ID", 0))
 
+# On-demand sampling profiler (/profile from ADMIN_ID, or SIGUSR1)
+# Fraction of updates profiled, and seconds between stack samples
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.2))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+# Seconds a session runs before it turns itself off
+PROFILE_DURATION = float(os.getenv("PROFILE_DURATION", 30))
+PROFILE_MAX_DURATION = float(os.getenv("PROFILE_MAX_DURATION", 300))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Outbound send limits (Telegram allows ~30 msg/s overall, ~1 msg/s per chat)
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", 28))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", 1))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", 3))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", 32))
+
+# Seconds to collect the parts of an album before relaying it as one
+ALBUM_DELAY = float(os.getenv("ALBUM_DELAY", 0.6))
+
+# How updates arrive: "polling", "webhook" or "shard" (behind app.front_door)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "https://your-domain.com")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8081))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+# Seconds to wait for queue space before answering 503 to Telegram
+WEBHOOK_QUEUE_TIMEOUT = float(os.getenv("WEBHOOK_QUEUE_TIMEOUT", 2))
+
+# Sharded deployment: app.front_door takes the webhook and hands each
+# user's updates to one of SHARDS (worker names, consistent hashing on
+# the user id); each worker runs with SHARD_NAME and BOT_MODE=shard.
+# They talk over Unix sockets in SHARD_SOCKET_DIR.
+SHARDS = [name for name in os.getenv("SHARDS", "").split(",") if name]
+SHARD_NAME = os.getenv("SHARD_NAME", "")
+SHARD_SOCKET_DIR = os.getenv("SHARD_SOCKET_DIR", "/tmp/chatbot-shards")
+# Points per shard on the hash ring; more points, more even shares
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", 128))
+
 ###Zpal
 
-ZARINPAL_MERCHANT_ID = "XXXXXXXX-XXXX-XXXX-XXXX-XXXXXXXXXXXX"
-ZARINPAL_REQUEST_URL = "https://api.zarinpal.com/pg/v4/payment/request.json"
-ZARINPAL_VERIFY_URL = "https://api.zarinpal.com/pg/v4/payment/verify.json"
+ZARINPAL_MERCHANT_ID = os.getenv("ZARINPAL_MERCHANT_ID", "XXXXXXXX-XXXX-XXXX-XXXX-XXXXXXXXXXXX")
+ZARINPAL_REQUEST_URL = os.getenv("ZARINPAL_REQUEST_URL", "https://api.zarinpal.com/pg/v4/payment/request.json")
+ZARINPAL_VERIFY_URL = os.getenv("ZARINPAL_VERIFY_URL", "https://api.zarinpal.com/pg/v4/payment/verify.json")
+ZARINPAL_START_PAY_URL = os.getenv("ZARINPAL_START_PAY_URL", "https://www.zarinpal.com/pg/StartPay/")
+
+# Shared HTTP client for the gateway
+ZARINPAL_POOL_SIZE = int(os.getenv("ZARINPAL_POOL_SIZE", 20))
+ZARINPAL_CONNECT_TIMEOUT = float(os.getenv("ZARINPAL_CONNECT_TIMEOUT", 3))
+ZARINPAL_READ_TIMEOUT = float(os.getenv("ZARINPAL_READ_TIMEOUT", 10))
+ZARINPAL_VERIFY_RETRIES = int(os.getenv("ZARINPAL_VERIFY_RETRIES", 3))
+# Consecutive gateway failures before calls are refused for ZARINPAL_BREAKER_RESET seconds
+ZARINPAL_BREAKER_THRESHOLD = int(os.getenv("ZARINPAL_BREAKER_THRESHOLD", 5))
+ZARINPAL_BREAKER_RESET = float(os.getenv("ZARINPAL_BREAKER_RESET", 30))
+
+# Background re-verification of payments whose callback never arrived
+RECONCILE_ENABLED = os.getenv("RECONCILE_ENABLED", "1") == "1"
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", 300))
+# Only payments at least this old (seconds) are picked up
+RECONCILE_MIN_AGE = int(os.getenv("RECONCILE_MIN_AGE", 1800))
+# Payments still unresolved after this many seconds are marked expired
+RECONCILE_EXPIRE_AFTER = int(os.getenv("RECONCILE_EXPIRE_AFTER", 3 * 24 * 3600))
+# A claim ('verifying') older than this many seconds outlived every
+# gateway call, so its settlement died and the payment is picked up again
+RECONCILE_CLAIM_TIMEOUT = int(os.getenv("RECONCILE_CLAIM_TIMEOUT", 300))
+# Only the process holding this lock runs the loop (one of the uvicorn workers)
+RECONCILE_LOCK_FILE = os.getenv("RECONCILE_LOCK_FILE", f"{DATABASE_URL}.reconcile.lock")
+RECONCILE_BATCH = int(os.getenv("RECONCILE_BATCH", 200))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", 8))
 
-CALLBACK_URL = "https://your-domain.com/payment/callback"
\ No newline at end of file
+CALLBACK_URL = os.getenv("CALLBACK_URL", "https://your-domain.com/payment/callback")
@@ -1,73 +1,188 @@
+import asyncio
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+
 import aiosqlite
-from app.config import DATABASE_URL
+from aiosqlite.context import contextmanager
+
+from app import metrics
+from app.config import DATABASE_URL, DB_READERS
 
 
 # =========================
-# اتصال به دیتابیس
+# تنظیمات اتصال
 # =========================
-async def get_db():
-    db = await aiosqlite.connect(DATABASE_URL)
+# Applied once to every pooled connection when it is opened.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 67108864",
+)
+
+_writer: aiosqlite.Connection | None = None
+_readers: asyncio.Queue | None = None
+_all_readers: list[aiosqlite.Connection] = []
+
+_write_lock = asyncio.Lock()
+_open_lock = asyncio.Lock()
+
+
+class TimedConnection(aiosqlite.Connection):
+    """اتصال aiosqlite که زمان اجرای هر دستور را در متریک‌ها ثبت می‌کند"""
+
+    @contextmanager
+    async def execute(self, sql: str, parameters=None):
+        started = time.perf_counter()
+        try:
+            return await super().execute(sql, parameters)
+        finally:
+            metrics.db_query_seconds.observe(time.perf_counter() - started, metrics.statement_label(sql))
+
+    @contextmanager
+    async def executemany(self, sql: str, parameters):
+        started = time.perf_counter()
+        try:
+            return await super().executemany(sql, parameters)
+        finally:
+            metrics.db_query_seconds.observe(time.perf_counter() - started, metrics.statement_label(sql))
+
+
+async def _connect(readonly: bool = False) -> aiosqlite.Connection:
+    # Same as aiosqlite.connect(), with the timed connection class
+    if readonly:
+        db = await TimedConnection(
+            lambda: sqlite3.connect(f"file:{DATABASE_URL}?mode=ro", uri=True),
+            iter_chunk_size=64
+        )
+    else:
+        db = await TimedConnection(lambda: sqlite3.connect(DATABASE_URL), iter_chunk_size=64)
+
     db.row_factory = aiosqlite.Row
+
+    for pragma in PRAGMAS:
+        if readonly and "journal_mode" in pragma:
+            continue
+        await db.execute(pragma)
+
     return db
 
 
 # =========================
-# ساخت جداول دیتابیس
+# مدیریت استخر اتصال‌ها
 # =========================
-async def init_db():
-    async with aiosqlite.connect(DATABASE_URL) as db:
-        await db.executescript("""
-        -- =========================
-        -- کاربران
-        -- =========================
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE,
-            name TEXT,
-            gender TEXT,
-            province TEXT,
-            city TEXT,
-            age INTEGER,
-            profile_pic TEXT,
-            coins INTEGER DEFAULT 0,
-            referral_code TEXT UNIQUE,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            banned_until TIMESTAMP
-        );
-
-        -- =========================
-        -- سیستم دعوت
-        -- =========================
-        CREATE TABLE IF NOT EXISTS referrals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            inviter_telegram_id INTEGER,
-            invited_telegram_id INTEGER UNIQUE,
-            referral_code TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-
-        -- =========================
-        -- ریپورت کاربران
-        -- =========================
-        CREATE TABLE IF NOT EXISTS reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            reporter_id INTEGER,
-            reported_id INTEGER,
-            reason TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-
-        -- =========================
-        -- پرداخت‌ها و سکه
-        -- =========================
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            amount INTEGER,
-            coins INTEGER,
-            authority TEXT UNIQUE,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """)
-        await db.commit()
\ No newline at end of file
+async def open_db():
+    """باز کردن اتصال‌های دیتابیس (فقط یک بار در هر پروسه)"""
+    global _writer, _readers
+
+    if _writer is not None:
+        return
+
+    async with _open_lock:
+        if _writer is not None:
+            return
+
+        # The writer goes first: it creates the file and switches it to WAL,
+        # which the read-only connections cannot do themselves.
+        writer = await _connect()
+
+        readers = asyncio.Queue()
+        for _ in range(max(DB_READERS, 1)):
+            reader = await _connect(readonly=True)
+            _all_readers.append(reader)
+            readers.put_nowait(reader)
+
+        _readers = readers
+        _writer = writer
+
+
+async def close_db():
+    """بستن تمام اتصال‌ها هنگام خاموش شدن ربات"""
+    global _writer, _readers
+
+    async with _open_lock:
+        if _writer is None:
+            return
+
+        async with _write_lock:
+            await _writer.close()
+
+        for reader in _all_readers:
+            await reader.close()
+
+        _all_readers.clear()
+        _readers = None
+        _writer = None
+
+
+@asynccontextmanager
+async def read_db():
+    """
+    گرفتن یک اتصال فقط‌خواندنی از استخر
+
+        async with read_db() as db:
+            async with db.execute(...) as cursor:
+                ...
+    """
+    if _writer is None:
+        await open_db()
+
+    readers = _readers
+    db = await readers.get()
+    try:
+        yield db
+    finally:
+        readers.put_nowait(db)
+
+
+@asynccontextmanager
+async def write_db():
+    """
+    گرفتن اتصال نویسنده؛ در پایان بلوک commit و در صورت خطا rollback می‌شود
+    """
+    if _writer is None:
+        await open_db()
+
+    async with _write_lock:
+        try:
+            yield _writer
+        except BaseException:
+            await _writer.rollback()
+            raise
+        else:
+            await _writer.commit()
+
+
+# =========================
+# ساخت و به‌روزرسانی جداول
+# =========================
+async def init_db(target: int | None = None):
+    """
+    اجرای مایگریشن‌های باقی‌مانده (app.migrations)
+
+    Costs a single PRAGMA read when the schema is already current.
+    """
+    from app.migrations import MIGRATIONS, SCHEMA_VERSION, get_version, apply
+
+    await open_db()
+    target = SCHEMA_VERSION if target is None else target
+
+    async with read_db() as db:
+        if await get_version(db) >= target:
+            return
+
+    for version, name, steps in MIGRATIONS:
+        if version > target:
+            break
+
+        async with write_db() as db:
+            # Another process may have got here first
+            if await get_version(db) >= version:
+                continue
+            if not await apply(db, version, steps):
+                continue
+
+        print(f"🗄 مایگریشن {version} ({name}) اجرا شد.")
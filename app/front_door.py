@@ -0,0 +1,119 @@
+"""
+درِ ورودی وبهوک برای اجرای چند shard
+
+Takes Telegram's webhook and hands each update, still as raw JSON, to the
+shard that owns its user (app.services.sharding). A user's updates always
+reach the same shard, over one connection, in the order they arrived.
+
+    SHARDS=a,b,c python -m app.front_door
+    SHARDS=a,b,c SHARD_NAME=a BOT_MODE=shard STATE_BACKEND=redis python -m app.bot
+"""
+import asyncio
+import hmac
+import logging
+from collections import Counter
+
+from aiohttp import web
+from aiogram import Bot
+
+from app.config import (
+    BOT_TOKEN,
+    SHARDS,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT
+)
+from app.services import sharding
+
+logger = logging.getLogger(__name__)
+
+# shard -> counter of "accepted", "rejected_full", "unreachable"
+stats: dict[str, Counter] = {shard: Counter() for shard in SHARDS}
+rejected_unauthorized = 0
+
+
+def routing_key(data: dict) -> int:
+    """کلید تقسیم: شناسه‌ی کاربری که آپدیت را فرستاده"""
+    for key, event in data.items():
+        if not isinstance(event, dict):
+            continue
+        # "user" is used by poll answers and reactions
+        user = event.get("from") or event.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+    return data.get("update_id", 0)
+
+
+def create_app() -> web.Application:
+    async def handle_update(request: web.Request) -> web.Response:
+        global rejected_unauthorized
+
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if WEBHOOK_SECRET and not hmac.compare_digest(token, WEBHOOK_SECRET):
+            rejected_unauthorized += 1
+            return web.Response(status=401)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+
+        shard = sharding.ring.owner(routing_key(data))
+        try:
+            accepted = await sharding.peer(shard).request("update", {"update": data})
+        except (ConnectionError, sharding.ShardError) as e:
+            stats[shard]["unreachable"] += 1
+            logger.warning("Update %s not handed to shard %s: %s", data.get("update_id"), shard, e)
+            accepted = False
+        else:
+            stats[shard]["accepted" if accepted else "rejected_full"] += 1
+
+        # As in webhook mode, a non-2xx answer has Telegram retry later
+        return web.Response() if accepted else web.Response(status=503)
+
+    async def handle_stats(request: web.Request) -> web.Response:
+        return web.json_response({
+            "rejected_unauthorized": rejected_unauthorized,
+            "shards": {shard: dict(counts) for shard, counts in stats.items()},
+        })
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get(f"{WEBHOOK_PATH}/stats", handle_stats)
+    return app
+
+
+async def main():
+    if not SHARDS:
+        raise RuntimeError("SHARDS is empty; list the worker names, e.g. SHARDS=a,b,c")
+
+    # Only to know which update types the handlers use
+    from app.bot import create_dispatcher
+
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    bot = Bot(token=BOT_TOKEN)
+    try:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=create_dispatcher().resolve_used_update_types(),
+            drop_pending_updates=False
+        )
+        logger.info("Front door routing to shards: %s", ", ".join(SHARDS))
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await sharding.close()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
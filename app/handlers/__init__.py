@@ -3,6 +3,7 @@ from .start import router as start_router
 from .register import router as register_router
 from .profile import router as profile_router
 from .match import router as match_router
+from .special_search import router as special_search_router
 from .chat import router as chat_router
 from .report import router as report_router
 
@@ -11,6 +12,7 @@ __all__ = [
     'register_router',
     'profile_router',
     'match_router',
+    'special_search_router',
     'chat_router',
     'report_router'
 ]
\ No newline at end of file
@@ -0,0 +1,45 @@
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, FSInputFile
+
+from app.config import ADMIN_ID
+from app.services import profiler
+from app.services.sender import outbox
+
+router = Router()
+router.message.filter(F.from_user.id == ADMIN_ID)
+
+
+# ================== PROFILER ==================
+
+@router.message(Command("profile"))
+async def start_profile(message: Message, command: CommandObject):
+    """
+    روشن کردن پروفایلر: /profile [ثانیه] [کسر آپدیت‌ها]
+
+    For example "/profile 60 0.5" profiles half of the updates for a
+    minute; the collapsed stacks are sent back as a file.
+    """
+    try:
+        args = (command.args or "").split()
+        duration = float(args[0]) if args else None
+        fraction = float(args[1]) if len(args) > 1 else None
+    except ValueError:
+        outbox.send_message(message.bot, message.chat.id, "❌ فرمت: /profile [ثانیه] [کسر آپدیت‌ها]")
+        return
+
+    bot = message.bot
+    chat_id = message.chat.id
+
+    async def send_result(path: str, samples: int):
+        await bot.send_document(
+            chat_id,
+            FSInputFile(path),
+            caption=f"📊 پروفایل تمام شد ({samples} نمونه)"
+        )
+
+    if not profiler.start(duration, fraction, on_done=send_result):
+        outbox.send_message(bot, chat_id, "⏳ یک پروفایل در حال اجراست.")
+        return
+
+    outbox.send_message(bot, chat_id, "📊 پروفایلر روشن شد؛ نتیجه پس از پایان ارسال می‌شود.")
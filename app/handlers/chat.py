@@ -1,31 +1,18 @@
-from aiogram import Router, F
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
-import aiosqlite
+import asyncio
 
-from app.database import get_db
-from app.services.matcher import active_chats  # ✅ اصلاح شده
+from aiogram import Bot, Router, F
+from aiogram.methods import CopyMessage, CopyMessages, SendPhoto
+from aiogram.types import Message
 
-router = Router()
-
-# ================== KEYBOARDS ==================
-
-chat_keyboard = ReplyKeyboardMarkup(
-    keyboard=[
-        [KeyboardButton(text="👤 مشاهده پروفایل")],
-        [KeyboardButton(text="🚫 ریپورت"), KeyboardButton(text="❌ اتمام چت")]
-    ],
-    resize_keyboard=True
-)
+from app.config import ALBUM_DELAY
 
-main_keyboard = ReplyKeyboardMarkup(
-    keyboard=[
-        [KeyboardButton(text="🔍 اتصال ناشناس")],
-        [KeyboardButton(text="👤 پروفایل من"), KeyboardButton(text="🎯 جستجوی ویژه")],
-        [KeyboardButton(text="💰 خرید سکه"), KeyboardButton(text="🎁 دعوت دوستان")]
-    ],
-    resize_keyboard=True
-)
+from app.services.users import get_user
+from app.services.state import backend
+from app.services.sender import outbox, RELAY
+from app.keyboards.chat import chat_keyboard
+from app.keyboards.main import main_keyboard
 
+router = Router()
 
 # ================== END CHAT ==================
 
@@ -33,34 +20,32 @@ main_keyboard = ReplyKeyboardMarkup(
 async def end_chat(message: Message):
     """پایان دادن به چت فعال"""
     user_id = message.from_user.id
-    partner_id = active_chats.get(user_id)
+    partner_id = await backend.end_chat(user_id)
 
     if not partner_id:
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             "❌ چت فعالی وجود ندارد.",
             reply_markup=main_keyboard
         )
         return
 
 
-    active_chats.pop(user_id, None)
-    active_chats.pop(partner_id, None)
-
-
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "❌ چت با موفقیت پایان یافت.",
         reply_markup=main_keyboard
     )
 
 
-    try:
-        await message.bot.send_message(
-            chat_id=partner_id,
-            text="❌ مخاطب چت را پایان داد.",
-            reply_markup=main_keyboard
-        )
-    except Exception as e:
-        print(f"خطا در ارسال پیام به partner: {e}")
+    outbox.send_message(
+        message.bot,
+        partner_id,
+        "❌ مخاطب چت را پایان داد.",
+        reply_markup=main_keyboard
+    )
 
 
 # ================== VIEW PROFILE ==================
@@ -69,67 +54,56 @@ async def end_chat(message: Message):
 async def show_partner_profile(message: Message):
     """نمایش پروفایل مخاطب"""
     user_id = message.from_user.id
-    partner_id = active_chats.get(user_id)
+    partner_id = await backend.get_partner(user_id)
 
     if not partner_id:
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             "❌ مخاطبی برای نمایش پروفایل وجود ندارد.",
             reply_markup=chat_keyboard
         )
         return
 
     try:
-        db = await get_db()
-
-
-        db.row_factory = aiosqlite.Row
-
-        async with db.execute(
-                """
-                SELECT name, gender, age, province, city, profile_pic
-                FROM users
-                WHERE telegram_id = ?
-                """,
-                (partner_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-
-        await db.close()
+        partner = await get_user(partner_id)
 
-        if not row:
-            await message.answer(
+        if not partner:
+            outbox.send_message(
+                message.bot,
+                message.chat.id,
                 "❌ پروفایل مخاطب یافت نشد.",
                 reply_markup=chat_keyboard
             )
             return
 
 
-        user = dict(row)
-
-
-        gender_fa = "پسر" if user['gender'] == "پسر" else "دختر"
+        gender_fa = "پسر" if partner.gender == "پسر" else "دختر"
 
         text = (
             f"👤 <b>پروفایل مخاطب</b>\n\n"
-            f"🔹 نام: {user['name']}\n"
+            f"🔹 نام: {partner.name}\n"
             f"🔹 جنسیت: {gender_fa}\n"
-            f"🔹 سن: {user['age']} سال\n"
-            f"📍 {user['province']} - {user['city']}"
+            f"🔹 سن: {partner.age} سال\n"
+            f"📍 {partner.province} - {partner.city}"
         )
 
 
-        if user.get("profile_pic"):
-            await message.answer_photo(
-                photo=user["profile_pic"],
+        if partner.profile_pic:
+            outbox.send(message.bot, SendPhoto(
+                chat_id=message.chat.id,
+                photo=partner.profile_pic,
                 caption=text,
                 parse_mode="HTML"
-            )
+            ))
         else:
-            await message.answer(text, parse_mode="HTML")
+            outbox.send_message(message.bot, message.chat.id, text, parse_mode="HTML")
 
     except Exception as e:
         print(f"خطا در نمایش پروفایل: {e}")
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             "❌ خطا در دریافت اطلاعات پروفایل.",
             reply_markup=chat_keyboard
         )
@@ -137,25 +111,85 @@ async def show_partner_profile(message: Message):
 
 # ================== RELAY MESSAGE  ==================
 
-@router.message(F.text)
+# media_group_id -> [partner_id, from_chat_id, message_ids, timer]
+_albums: dict[str, list] = {}
+# from_chat_id -> media_group_id still being collected
+_open_albums: dict[int, str] = {}
+
+
+@router.message()
 async def relay_message(message: Message):
-    """ارسال پیام به مخاطب چت"""
+    """ارسال پیام (متن، عکس، ویس، استیکر، ویدیو، فایل...) به مخاطب چت"""
     user_id = message.from_user.id
+    partner_id = await backend.get_partner(user_id)
 
+    if not partner_id:
+        return
+
+    chat_id = message.chat.id
 
-    if user_id not in active_chats:
+    # Albums arrive as separate messages; collect them briefly and copy
+    # them together so the partner gets one album, not N single files
+    if message.media_group_id:
+        album = _albums.get(message.media_group_id)
+        if album is not None:
+            album[2].append(message.message_id)
+            return
+
+        _flush_album(message.bot, _open_albums.get(chat_id))
+        timer = asyncio.get_running_loop().call_later(
+            ALBUM_DELAY, _flush_album, message.bot, message.media_group_id
+        )
+        _albums[message.media_group_id] = [partner_id, chat_id, [message.message_id], timer]
+        _open_albums[chat_id] = message.media_group_id
         return
 
-    partner_id = active_chats.get(user_id)
+    # Anything sent after an album must not overtake it
+    _flush_album(message.bot, _open_albums.get(chat_id))
 
-    if not partner_id:
+    # copy_message only passes file_ids around: nothing is downloaded or
+    # re-uploaded here, and the copy carries no "forwarded from" header
+    sent = outbox.send(
+        message.bot,
+        CopyMessage(
+            chat_id=partner_id,
+            from_chat_id=chat_id,
+            message_id=message.message_id
+        ),
+        priority=RELAY
+    )
+    sent.add_done_callback(
+        lambda future: _relay_failed(message.bot, chat_id, future)
+    )
+
+
+def _flush_album(bot: Bot, media_group_id: str | None):
+    album = _albums.pop(media_group_id, None)
+    if album is None:
         return
 
-    try:
-        await message.bot.send_message(
+    partner_id, from_chat_id, message_ids, timer = album
+    timer.cancel()
+    if _open_albums.get(from_chat_id) == media_group_id:
+        del _open_albums[from_chat_id]
+
+    sent = outbox.send(
+        bot,
+        CopyMessages(
             chat_id=partner_id,
-            text=message.text
-        )
-    except Exception as e:
-        print(f"خطا در ارسال پیام: {e}")
-        await message.answer("❌ خطا در ارسال پیام.")
\ No newline at end of file
+            from_chat_id=from_chat_id,
+            message_ids=sorted(message_ids)
+        ),
+        priority=RELAY
+    )
+    sent.add_done_callback(
+        lambda future: _relay_failed(bot, from_chat_id, future)
+    )
+
+
+def _relay_failed(bot: Bot, chat_id: int, future):
+    if future.cancelled() or future.exception() is None:
+        return
+
+    print(f"خطا در ارسال پیام: {future.exception()}")
+    outbox.send_message(bot, chat_id, "❌ خطا در ارسال پیام.")
@@ -1,71 +1,127 @@
-from aiogram import Router
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
-
-from app.database import get_db
-from app.services.matcher import (
-    add_to_waiting, find_match, start_chat, is_in_chat
-)
+from aiogram import Bot, Router
+from aiogram.types import Message
+
+from app.services.state import backend
+from app.services.sender import outbox
+from app.services import queue_sweeper
+from app.services.filtered_matcher import leave_filtered_waiting
+from app.services.users import UserSnapshot
+from app.services.coins import get_balance, debit_many, refund_many
 from app.keyboards.chat import chat_keyboard
-from app.keyboards.main import main_keyboard
+from app.keyboards.main import main_keyboard, gender_keyboard, waiting_keyboard
 
 router = Router()
 
 
+CHAT_COST = 2
+
+
+async def pair_users(bot: Bot, user_id: int, partner_id: int, requeue_partner: bool = False) -> bool:
+    """
+    کسر سکه از هر دو طرف و شروع چت برای یک جفت رزروشده
+
+    Both users must have been reserved (match_or_wait or reserve). The
+    coins are taken from both or from neither before the chat starts.
+    Otherwise the reservation is released and whoever is short is told;
+    with ``requeue_partner`` a partner who can pay goes back to the head
+    of the waiting queue, else they are asked to search again. The
+    searcher is left to the caller. Returns whether the chat started.
+    """
+    await leave_filtered_waiting(user_id, partner_id)
+
+    ref = f"{user_id}:{partner_id}"
+    try:
+        paid = await debit_many((user_id, partner_id), CHAT_COST, "chat", ref)
+    except Exception:
+        await backend.release_pair(user_id, partner_id)
+        raise
+
+    if paid:
+        # The reservation was undone meanwhile: the sweeper releases one
+        # that took too long and deals with both users, so only the coins
+        # are left to give back
+        if not await backend.confirm_pair(user_id, partner_id):
+            await refund_many((user_id, partner_id), CHAT_COST, ref)
+            return False
+        for chat_id in (user_id, partner_id):
+            outbox.send_message(
+                bot,
+                chat_id,
+                "✅ مخاطب پیدا شد!\n\n"
+                "💬 می‌توانید شروع به چت کنید.",
+                reply_markup=chat_keyboard
+            )
+        return True
+
+    # Balances are cached by now, so this does not touch the database
+    short = [chat_id for chat_id in (user_id, partner_id) if await get_balance(chat_id) < CHAT_COST]
+    requeue = (partner_id,) if requeue_partner and partner_id not in short else ()
+    await backend.release_pair(user_id, partner_id, requeue)
+
+    for chat_id in short:
+        outbox.send_message(
+            bot,
+            chat_id,
+            "❌ سکه کافی نبود و چت شروع نشد.\n\n"
+            "💰 برای هر چت 2 سکه نیاز است.\n"
+            "از منوی اصلی می‌توانید سکه خریداری کنید.",
+            reply_markup=main_keyboard
+        )
+    if partner_id not in short and not requeue:
+        outbox.send_message(
+            bot,
+            partner_id,
+            "❌ مخاطب سکه کافی نداشت. لطفاً دوباره جستجو کنید.",
+            reply_markup=main_keyboard
+        )
+    return False
+
+
 @router.message(lambda m: m.text == "🔍 اتصال ناشناس")
 async def start_match(message: Message):
     """شروع فرآیند جستجوی مخاطب"""
     user_id = message.from_user.id
 
     # Check if the user is not currently in chat
-    if is_in_chat(user_id):
-        await message.answer(
+    if await backend.is_in_chat(user_id):
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             "❌ شما در حال حاضر در چت هستید.",
             reply_markup=chat_keyboard
         )
         return
 
     # Show gender selection keyboard
-    gender_keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="پسر"), KeyboardButton(text="دختر")]
-        ],
-        resize_keyboard=True
-    )
-
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "👫 میخوای به کی وصل شی ؟",
         reply_markup=gender_keyboard
     )
 
 
 @router.message(lambda m: m.text in ["پسر", "دختر"])
-async def select_target_gender(message: Message):
+async def select_target_gender(message: Message, user: UserSnapshot | None):
     """انتخاب جنسیت مورد نظر برای چت"""
     target_gender = message.text
     user_id = message.from_user.id
 
     try:
-        db = await get_db()
-
-        # Get user information
-        async with db.execute(
-                "SELECT gender, coins FROM users WHERE telegram_id = ?",
-                (user_id,)
-        ) as cursor:
-            user = await cursor.fetchone()
-
         if not user:
-            await db.close()
-            await message.answer(
+            outbox.send_message(
+                message.bot,
+                message.chat.id,
                 "❌ کاربر یافت نشد. لطفاً ابتدا ثبت‌نام کنید.",
                 reply_markup=main_keyboard
             )
             return
 
         # Check coin balance
-        if user[1] < 2:  # user[1] = coins
-            await db.close()
-            await message.answer(
+        if await get_balance(user_id) < CHAT_COST:
+            outbox.send_message(
+                message.bot,
+                message.chat.id,
                 "❌ سکه کافی ندارید.\n\n"
                 "💰 برای هر چت 2 سکه نیاز است.\n"
                 "از منوی اصلی می‌توانید سکه خریداری کنید.",
@@ -75,71 +131,68 @@ async def select_target_gender(message: Message):
 
         user_data = {
             "id": user_id,
-            "gender": user[0],  # user[0] = gender
+            "gender": user.gender,
             "target_gender": target_gender
         }
 
-        # Contact search
-        match = find_match(user_data)
-
-        if match:
-            # Deduct coins from both users
-            await db.execute(
-                "UPDATE users SET coins = coins - 2 WHERE telegram_id IN (?, ?)",
-                (user_id, match["id"])
-            )
-            await db.commit()
-
-            # Start chat
-            start_chat(user_id, match["id"])
-
-            # Notify both users
-            await message.answer(
-                "✅ مخاطب پیدا شد!\n\n"
-                "💬 می‌توانید شروع به چت کنید.",
-                reply_markup=chat_keyboard
-            )
-
-            try:
-                await message.bot.send_message(
-                    match["id"],
-                    "✅ مخاطب پیدا شد!\n\n"
-                    "💬 می‌توانید شروع به چت کنید.",
+        # Contact search (reserves a partner, or adds us to the waiting list)
+        match = await backend.match_or_wait(user_data)
+
+        # A partner who could not pay is dropped; keep looking while we can
+        while match and not await pair_users(message.bot, user_id, match["id"], requeue_partner=True):
+            if await get_balance(user_id) < CHAT_COST:
+                return
+            match = await backend.match_or_wait(user_data)
+
+        # Refused: already in a chat, or a pairing of ours is still going on
+        if match is False:
+            if await backend.is_in_chat(user_id):
+                outbox.send_message(
+                    message.bot,
+                    message.chat.id,
+                    "❌ شما در حال حاضر در چت هستید.",
                     reply_markup=chat_keyboard
                 )
-            except Exception as e:
-                print(f"خطا در ارسال پیام به مخاطب: {e}")
-        else:
-            # Add to waiting list
-            add_to_waiting(user_data)
-            await message.answer(
+            else:
+                outbox.send_message(
+                    message.bot,
+                    message.chat.id,
+                    "⏳ در حال وصل کردن شما به یک مخاطب هستیم.\n\n"
+                    "اگر تا چند لحظه دیگر وصل نشدید، دوباره جستجو کنید.",
+                    reply_markup=main_keyboard
+                )
+            return
+
+        if not match:
+            queue_sweeper.track(user_id)
+            outbox.send_message(
+                message.bot,
+                message.chat.id,
                 "⏳ در حال جستجوی مخاطب...\n\n"
                 "لطفاً صبر کنید تا مخاطبی پیدا شود.",
-                reply_markup=main_keyboard
+                reply_markup=waiting_keyboard
             )
 
-        await db.close()
-
     except Exception as e:
         print(f"خطا در فرآیند matching: {e}")
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             "❌ خطایی رخ داد. لطفاً دوباره تلاش کنید.",
             reply_markup=main_keyboard
         )
 
 
-# ==================== Special search ====================
-
-@router.message(lambda m: m.text == "🎯 جستجوی ویژه")
-async def special_search(message: Message):
-    """جستجوی ویژه با فیلترهای بیشتر"""
-    await message.answer(
-        "🎯 <b>جستجوی ویژه</b>\n\n"
-        "⚠️ این ویژگی به زودی فعال می‌شود!\n\n"
-        "با این ویژگی می‌توانید:\n"
-        "• جستجو بر اساس سن\n"
-        "• جستجو بر اساس شهر\n"
-        "• فیلترهای بیشتر",
-        parse_mode="HTML",
-        reply_markup=main_keyboard
-    )
\ No newline at end of file
+@router.message(lambda m: m.text == "❌ لغو جستجو")
+async def cancel_search(message: Message):
+    """لغو جستجوی مخاطب (معمولی یا ویژه)"""
+    user_id = message.from_user.id
+
+    cancelled = await backend.cancel_waiting(user_id)
+    cancelled = await leave_filtered_waiting(user_id) or cancelled
+
+    if cancelled:
+        text = "✅ جستجو لغو شد."
+    else:
+        text = "❌ شما در صف انتظار نیستید."
+    outbox.send_message(message.bot, message.chat.id, text, reply_markup=main_keyboard)
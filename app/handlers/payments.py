@@ -1,8 +1,9 @@
 from aiogram import Router, F
 from aiogram.types import Message
 
-from app.database import get_db
+from app.database import write_db
 from app.services.payments import create_payment
+from app.services.sender import outbox
 from app.keyboards.payments import coins_keyboard
 from app.keyboards.main import main_keyboard
 
@@ -19,7 +20,9 @@ PACKAGES = {
 @router.message(F.text == "💳 خرید سکه")
 async def show_coin_packages(message: Message):
     """نمایش پکیج‌های خرید سکه"""
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "💰 <b>خرید سکه</b>\n\n"
         "لطفاً یکی از پکیج‌های زیر را انتخاب کنید:",
         parse_mode="HTML",
@@ -31,7 +34,9 @@ async def show_coin_packages(message: Message):
 @router.message(F.text == "🔙 بازگشت")
 async def back_to_main_menu(message: Message):
     """بازگشت به منوی اصلی"""
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "🏠 منوی اصلی:",
         reply_markup=main_keyboard
     )
@@ -49,7 +54,9 @@ async def start_payment(message: Message):
     )
 
     if not authority:
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             "❌ خطا در اتصال به درگاه پرداخت.\n"
             "لطفاً دوباره تلاش کنید.",
             reply_markup=coins_keyboard
@@ -58,18 +65,18 @@ async def start_payment(message: Message):
 
     # Store payment information in the database
     try:
-        db = await get_db()
-        await db.execute(
-            """
-            INSERT INTO payments (user_id, amount, coins, authority)
-            VALUES (?, ?, ?, ?)
-            """,
-            (message.from_user.id, amount, coins, authority)
-        )
-        await db.commit()
-        await db.close()
+        async with write_db() as db:
+            await db.execute(
+                """
+                INSERT INTO payments (user_id, amount, coins, authority)
+                VALUES (?, ?, ?, ?)
+                """,
+                (message.from_user.id, amount, coins, authority)
+            )
 
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             f"💳 <b>اطلاعات پرداخت:</b>\n\n"
             f"💰 مبلغ: {amount:,} تومان\n"
             f"🎁 دریافت: {coins} سکه\n\n"
@@ -81,7 +88,9 @@ async def start_payment(message: Message):
         )
     except Exception as e:
         print(f"خطا در ذخیره اطلاعات پرداخت: {e}")
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             "❌ خطا در ثبت اطلاعات پرداخت.",
             reply_markup=coins_keyboard
         )
\ No newline at end of file
@@ -2,14 +2,17 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-import aiosqlite
+from aiogram.methods import SendPhoto
 
-from app.database import get_db
-from app.keyboards.profile import profile_kb
+from app.database import write_db
+from app.services.users import UserSnapshot, invalidate_user
+from app.services.coins import get_balance
+from app.services.sender import outbox
+from app.keyboards.profile import profile_keyboard
 from app.keyboards.main import main_keyboard
 from app.keyboards.province import province_keyboard
-from app.keyboards.city import city_keyboard
-from app.utils.iran_locations import IRAN_PROVINCES
+from app.keyboards.city import city_keyboard, turn_city_page
+from app.utils.iran_locations import find_province, find_city
 from app.config import BOT_USERNAME
 
 
@@ -26,63 +29,50 @@ class EditProfileState(StatesGroup):
 
 
 @router.message(F.text == "👤 پروفایل من")
-async def show_my_profile(message: Message):
+async def show_my_profile(message: Message, user: UserSnapshot | None):
     """نمایش پروفایل کاربر"""
-    user_id = message.from_user.id
-
     try:
-        db = await get_db()
-        db.row_factory = aiosqlite.Row
-
-        async with db.execute(
-                """
-                SELECT name, gender, age, province, city, profile_pic, coins
-                FROM users
-                WHERE telegram_id = ?
-                """,
-                (user_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-
-        await db.close()
-
-        if not row:
-            await message.answer(
+        if not user:
+            outbox.send_message(
+                message.bot,
+                message.chat.id,
                 "❌ پروفایل شما یافت نشد.\n"
                 "لطفاً دوباره ثبت‌نام کنید: /start"
             )
             return
 
-        user = dict(row)
-
-        gender_fa = "پسر" if user['gender'] == "پسر" else "دختر"
+        gender_fa = "پسر" if user.gender == "پسر" else "دختر"
+        coins = await get_balance(user.telegram_id)
 
         text = (
             f"👤 <b>پروفایل من</b>\n\n"
-            f"🔹 نام: {user['name']}\n"
+            f"🔹 نام: {user.name}\n"
             f"🔹 جنسیت: {gender_fa}\n"
-            f"🔹 سن: {user['age']} سال\n"
-            f"📍 {user['province']} - {user['city']}\n"
-            f"💰 سکه: {user['coins']}"
+            f"🔹 سن: {user.age} سال\n"
+            f"📍 {user.province} - {user.city}\n"
+            f"💰 سکه: {coins}"
         )
 
-        if user.get('profile_pic'):
-            await message.answer_photo(
-                photo=user['profile_pic'],
+        if user.profile_pic:
+            outbox.send(message.bot, SendPhoto(
+                chat_id=message.chat.id,
+                photo=user.profile_pic,
                 caption=text,
                 parse_mode="HTML",
-                reply_markup=profile_kb()
-            )
+                reply_markup=profile_keyboard
+            ))
         else:
-            await message.answer(
+            outbox.send_message(
+                message.bot,
+                message.chat.id,
                 text,
                 parse_mode="HTML",
-                reply_markup=profile_kb()
+                reply_markup=profile_keyboard
             )
 
     except Exception as e:
         print(f"خطا در نمایش پروفایل: {e}")
-        await message.answer("❌ خطا در دریافت اطلاعات پروفایل.")
+        outbox.send_message(message.bot, message.chat.id, "❌ خطا در دریافت اطلاعات پروفایل.")
 
 
 # ==================== Callback Handlers ====================
@@ -91,7 +81,7 @@ async def show_my_profile(message: Message):
 async def edit_name_callback(callback: CallbackQuery, state: FSMContext):
     """شروع ویرایش نام"""
     await state.set_state(EditProfileState.name)
-    await callback.message.answer("✏️ نام جدید خود را وارد کنید:")
+    outbox.send_message(callback.bot, callback.message.chat.id, "✏️ نام جدید خود را وارد کنید:")
     await callback.answer()
 
 
@@ -99,7 +89,9 @@ async def edit_name_callback(callback: CallbackQuery, state: FSMContext):
 async def edit_province_callback(callback: CallbackQuery, state: FSMContext):
     """شروع ویرایش استان"""
     await state.set_state(EditProfileState.province)
-    await callback.message.answer(
+    outbox.send_message(
+        callback.bot,
+        callback.message.chat.id,
         "📍 استان جدید خود را انتخاب کنید:",
         reply_markup=province_keyboard()
     )
@@ -107,32 +99,24 @@ async def edit_province_callback(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "edit_city")
-async def edit_city_callback(callback: CallbackQuery, state: FSMContext):
+async def edit_city_callback(callback: CallbackQuery, state: FSMContext, user: UserSnapshot | None):
     """شروع ویرایش شهر"""
-    user_id = callback.from_user.id
-
     try:
-        db = await get_db()
-        async with db.execute(
-                "SELECT province FROM users WHERE telegram_id = ?",
-                (user_id,)
-        ) as cursor:
-            result = await cursor.fetchone()
-        await db.close()
-
-        if result:
-            province = result[0]
-            await state.update_data(province=province)
+        if user and user.province:
+            province = user.province
+            await state.update_data(province=province, city_page=0)
             await state.set_state(EditProfileState.city)
-            await callback.message.answer(
+            outbox.send_message(
+                callback.bot,
+                callback.message.chat.id,
                 "🏙️ شهر جدید خود را انتخاب کنید:",
                 reply_markup=city_keyboard(province)
             )
         else:
-            await callback.message.answer("❌ ابتدا استان خود را تنظیم کنید.")
+            outbox.send_message(callback.bot, callback.message.chat.id, "❌ ابتدا استان خود را تنظیم کنید.")
     except Exception as e:
         print(f"خطا در edit_city: {e}")
-        await callback.message.answer("❌ خطایی رخ داد.")
+        outbox.send_message(callback.bot, callback.message.chat.id, "❌ خطایی رخ داد.")
 
     await callback.answer()
 
@@ -141,7 +125,7 @@ async def edit_city_callback(callback: CallbackQuery, state: FSMContext):
 async def edit_age_callback(callback: CallbackQuery, state: FSMContext):
     """شروع ویرایش سن"""
     await state.set_state(EditProfileState.age)
-    await callback.message.answer("🎂 سن جدید خود را وارد کنید (عدد):")
+    outbox.send_message(callback.bot, callback.message.chat.id, "🎂 سن جدید خود را وارد کنید (عدد):")
     await callback.answer()
 
 
@@ -149,7 +133,7 @@ async def edit_age_callback(callback: CallbackQuery, state: FSMContext):
 async def edit_photo_callback(callback: CallbackQuery, state: FSMContext):
     """شروع ویرایش عکس پروفایل"""
     await state.set_state(EditProfileState.photo)
-    await callback.message.answer("🖼️ عکس پروفایل جدید خود را ارسال کنید:")
+    outbox.send_message(callback.bot, callback.message.chat.id, "🖼️ عکس پروفایل جدید خود را ارسال کنید:")
     await callback.answer()
 
 
@@ -161,43 +145,48 @@ async def update_name(message: Message, state: FSMContext):
     name = message.text.strip()
 
     if len(name) < 2:
-        await message.answer("❌ نام معتبر وارد کنید.")
+        outbox.send_message(message.bot, message.chat.id, "❌ نام معتبر وارد کنید.")
         return
 
     try:
-        db = await get_db()
-        await db.execute(
-            "UPDATE users SET name = ? WHERE telegram_id = ?",
-            (name, message.from_user.id)
-        )
-        await db.commit()
-        await db.close()
+        async with write_db() as db:
+            await db.execute(
+                "UPDATE users SET name = ? WHERE telegram_id = ?",
+                (name, message.from_user.id)
+            )
+        invalidate_user(message.from_user.id)
 
         await state.clear()
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             f"✅ نام شما به '{name}' تغییر یافت.",
             reply_markup=main_keyboard
         )
     except Exception as e:
         print(f"خطا در update_name: {e}")
-        await message.answer("❌ خطا در بروزرسانی نام.")
+        outbox.send_message(message.bot, message.chat.id, "❌ خطا در بروزرسانی نام.")
 
 
 @router.message(EditProfileState.province)
 async def update_province(message: Message, state: FSMContext):
     """ذخیره استان جدید"""
-    province = message.text
+    province = find_province(message.text or "")
 
-    if province not in IRAN_PROVINCES:
-        await message.answer(
-            "❌ لطفاً استان را از کیبورد انتخاب کنید.",
+    if not province:
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ استان پیدا نشد؛ از کیبورد انتخاب کنید یا نامش را درست بنویسید.",
             reply_markup=province_keyboard()
         )
         return
 
-    await state.update_data(province=province)
+    await state.update_data(province=province, city_page=0)
     await state.set_state(EditProfileState.city)
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "🏙️ شهر خود را انتخاب کنید:",
         reply_markup=city_keyboard(province)
     )
@@ -206,34 +195,50 @@ async def update_province(message: Message, state: FSMContext):
 @router.message(EditProfileState.city)
 async def update_city(message: Message, state: FSMContext):
     """ذخیره شهر جدید"""
-    city = message.text
     data = await state.get_data()
     province = data.get("province")
+    page = data.get("city_page", 0)
+
+    new_page = turn_city_page(message.text, province, page)
+    if new_page is not None:
+        await state.update_data(city_page=new_page)
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "🏙️ شهر خود را انتخاب کنید:",
+            reply_markup=city_keyboard(province, new_page)
+        )
+        return
 
-    if city not in IRAN_PROVINCES.get(province, []):
-        await message.answer(
-            "❌ لطفاً شهر را از کیبورد انتخاب کنید.",
-            reply_markup=city_keyboard(province)
+    city = find_city(province, message.text or "")
+
+    if not city:
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ شهر پیدا نشد؛ از کیبورد انتخاب کنید یا نامش را درست بنویسید.",
+            reply_markup=city_keyboard(province, page)
         )
         return
 
     try:
-        db = await get_db()
-        await db.execute(
-            "UPDATE users SET province = ?, city = ? WHERE telegram_id = ?",
-            (province, city, message.from_user.id)
-        )
-        await db.commit()
-        await db.close()
+        async with write_db() as db:
+            await db.execute(
+                "UPDATE users SET province = ?, city = ? WHERE telegram_id = ?",
+                (province, city, message.from_user.id)
+            )
+        invalidate_user(message.from_user.id)
 
         await state.clear()
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             f"✅ موقعیت شما به '{province} - {city}' تغییر یافت.",
             reply_markup=main_keyboard
         )
     except Exception as e:
         print(f"خطا در update_city: {e}")
-        await message.answer("❌ خطا در بروزرسانی موقعیت.")
+        outbox.send_message(message.bot, message.chat.id, "❌ خطا در بروزرسانی موقعیت.")
 
 
 @router.message(EditProfileState.age)
@@ -242,83 +247,76 @@ async def update_age(message: Message, state: FSMContext):
     text = message.text.strip()
 
     if not text.isdigit():
-        await message.answer("❌ لطفاً فقط عدد وارد کنید.")
+        outbox.send_message(message.bot, message.chat.id, "❌ لطفاً فقط عدد وارد کنید.")
         return
 
     age = int(text)
 
     if age <= 14 or age > 100:
-        await message.answer("❌ سن باید بین 15 تا 100 باشد.")
+        outbox.send_message(message.bot, message.chat.id, "❌ سن باید بین 15 تا 100 باشد.")
         return
 
     try:
-        db = await get_db()
-        await db.execute(
-            "UPDATE users SET age = ? WHERE telegram_id = ?",
-            (age, message.from_user.id)
-        )
-        await db.commit()
-        await db.close()
+        async with write_db() as db:
+            await db.execute(
+                "UPDATE users SET age = ? WHERE telegram_id = ?",
+                (age, message.from_user.id)
+            )
+        invalidate_user(message.from_user.id)
 
         await state.clear()
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             f"✅ سن شما به {age} تغییر یافت.",
             reply_markup=main_keyboard
         )
     except Exception as e:
         print(f"خطا در update_age: {e}")
-        await message.answer("❌ خطا در بروزرسانی سن.")
+        outbox.send_message(message.bot, message.chat.id, "❌ خطا در بروزرسانی سن.")
 
 
 @router.message(EditProfileState.photo)
 async def update_photo(message: Message, state: FSMContext):
     """ذخیره عکس پروفایل جدید"""
     if not message.photo:
-        await message.answer("❌ لطفاً فقط عکس ارسال کنید.")
+        outbox.send_message(message.bot, message.chat.id, "❌ لطفاً فقط عکس ارسال کنید.")
         return
 
     photo_id = message.photo[-1].file_id
 
     try:
-        db = await get_db()
-        await db.execute(
-            "UPDATE users SET profile_pic = ? WHERE telegram_id = ?",
-            (photo_id, message.from_user.id)
-        )
-        await db.commit()
-        await db.close()
+        async with write_db() as db:
+            await db.execute(
+                "UPDATE users SET profile_pic = ? WHERE telegram_id = ?",
+                (photo_id, message.from_user.id)
+            )
+        invalidate_user(message.from_user.id)
 
         await state.clear()
-        await message.answer(
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             "✅ عکس پروفایل شما تغییر یافت.",
             reply_markup=main_keyboard
         )
     except Exception as e:
         print(f"خطا در update_photo: {e}")
-        await message.answer("❌ خطا در بروزرسانی عکس.")
+        outbox.send_message(message.bot, message.chat.id, "❌ خطا در بروزرسانی عکس.")
 
 
 @router.message(F.text == "🎁 دعوت دوستان")
-async def invite_friends(message: Message):
-    db = await get_db()
-
-    async with db.execute(
-        "SELECT id FROM users WHERE telegram_id = ?",
-        (message.from_user.id,)
-    ) as cursor:
-        user = await cursor.fetchone()
-
-    await db.close()
-
+async def invite_friends(message: Message, user: UserSnapshot | None):
     if not user:
-        await message.answer("❌ ابتدا باید ثبت‌نام کنید.")
+        outbox.send_message(message.bot, message.chat.id, "❌ ابتدا باید ثبت‌نام کنید.")
         return
 
-    user_id = user["id"]
-
-    invite_link = f"https://t.me/{BOT_USERNAME}?start=ref_{user_id}"
+    # handle_referral looks the inviter up by telegram_id
+    invite_link = f"https://t.me/{BOT_USERNAME}?start=ref_{user.telegram_id}"
 
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "🤝 <b>لینک دعوت اختصاصی شما:</b>\n\n"
         f"{invite_link}\n\n"
         "🎁 با هر ثبت‌نام موفق از طریق این لینک، ۱۵ سکه هدیه می‌گیرید!",
@@ -1,19 +1,24 @@
 from aiogram import Router,F
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import Message
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
-from app.database import get_db
-from app.keyboards.main import main_keyboard
+from app.database import write_db
+from app.keyboards.main import main_keyboard, gender_keyboard
 from app.keyboards.province import province_keyboard
-from app.keyboards.city import city_keyboard
-from app.utils.iran_locations import IRAN_PROVINCES
+from app.keyboards.city import city_keyboard, turn_city_page
+from app.utils.iran_locations import find_province, find_city
 from app.services.referral import handle_referral
+from app.services.users import invalidate_user
+from app.services.coins import LedgerWrite
+from app.services.sender import outbox
 from aiogram.types import ReplyKeyboardRemove
 
 
 router = Router()
 
+SIGNUP_COINS = 15
+
 
 # =======================
 # FSM States
@@ -30,7 +35,7 @@ class RegisterState(StatesGroup):
 async def start_register(message: Message, state: FSMContext):
     await state.clear()
     await state.set_state(RegisterState.name)
-    await message.answer("📝 لطفاً نام خود را وارد کنید:")
+    outbox.send_message(message.bot, message.chat.id, "📝 لطفاً نام خود را وارد کنید:")
     reply_markup = ReplyKeyboardRemove()
 # =======================
 # STEP 1: NAME
@@ -40,20 +45,15 @@ async def register_name(message: Message, state: FSMContext):
     name = message.text.strip()
 
     if len(name) < 2:
-        await message.answer("❌ نام معتبر وارد کنید.")
+        outbox.send_message(message.bot, message.chat.id, "❌ نام معتبر وارد کنید.")
         return
 
     await state.update_data(name=name)
     await state.set_state(RegisterState.gender)
 
-    gender_keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="پسر"), KeyboardButton(text="دختر")]
-        ],
-        resize_keyboard=True
-    )
-
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "🚻 جنسیت خود را انتخاب کنید:",
         reply_markup=gender_keyboard
     )
@@ -65,13 +65,15 @@ async def register_name(message: Message, state: FSMContext):
 @router.message(RegisterState.gender)
 async def register_gender(message: Message, state: FSMContext):
     if message.text not in ["پسر", "دختر"]:
-        await message.answer("❌ فقط از دکمه‌ها استفاده کنید.")
+        outbox.send_message(message.bot, message.chat.id, "❌ فقط از دکمه‌ها استفاده کنید.")
         return
 
     await state.update_data(gender=message.text)
     await state.set_state(RegisterState.province)
 
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "📍 استان خود را انتخاب کنید:",
         reply_markup=province_keyboard()
     )
@@ -82,19 +84,23 @@ async def register_gender(message: Message, state: FSMContext):
 # =======================
 @router.message(RegisterState.province)
 async def register_province(message: Message, state: FSMContext):
-    province = message.text
+    province = find_province(message.text or "")
 
-    if province not in IRAN_PROVINCES:
-        await message.answer(
-            "❌ استان را فقط از کیبورد انتخاب کنید.",
+    if not province:
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ استان پیدا نشد؛ از کیبورد انتخاب کنید یا نامش را درست بنویسید.",
             reply_markup=province_keyboard()
         )
         return
 
-    await state.update_data(province=province)
+    await state.update_data(province=province, city_page=0)
     await state.set_state(RegisterState.city)
 
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "🏙️ شهر خود را انتخاب کنید:",
         reply_markup=city_keyboard(province)
     )
@@ -105,21 +111,38 @@ async def register_province(message: Message, state: FSMContext):
 # =======================
 @router.message(RegisterState.city)
 async def register_city(message: Message, state: FSMContext):
-    city = message.text
     data = await state.get_data()
     province = data.get("province")
+    page = data.get("city_page", 0)
+
+    new_page = turn_city_page(message.text, province, page)
+    if new_page is not None:
+        await state.update_data(city_page=new_page)
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "🏙️ شهر خود را انتخاب کنید:",
+            reply_markup=city_keyboard(province, new_page)
+        )
+        return
 
-    if city not in IRAN_PROVINCES.get(province, []):
-        await message.answer(
-            "❌ شهر را فقط از کیبورد انتخاب کنید.",
-            reply_markup=city_keyboard(province)
+    city = find_city(province, message.text or "")
+
+    if not city:
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ شهر پیدا نشد؛ از کیبورد انتخاب کنید یا نامش را درست بنویسید.",
+            reply_markup=city_keyboard(province, page)
         )
         return
 
     await state.update_data(city=city)
     await state.set_state(RegisterState.age)
 
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "🎂 سن خود را وارد کنید:",
         reply_markup=ReplyKeyboardRemove()
     )
@@ -134,24 +157,26 @@ async def register_age(message: Message, state: FSMContext):
 
     # Checking for a number
     if not text.isdigit():
-        await message.answer("❌ لطفاً سن خود را فقط به صورت عدد وارد کنید.")
+        outbox.send_message(message.bot, message.chat.id, "❌ لطفاً سن خود را فقط به صورت عدد وارد کنید.")
         return
 
     age = int(text)
 
 
     if age <= 14:
-        await message.answer("❌ سن شما باید بالای ۱۴ سال باشد.")
+        outbox.send_message(message.bot, message.chat.id, "❌ سن شما باید بالای ۱۴ سال باشد.")
         return
 
     if age > 100:
-        await message.answer("❌ لطفاً سن معتبر وارد کنید.")
+        outbox.send_message(message.bot, message.chat.id, "❌ لطفاً سن معتبر وارد کنید.")
         return
 
     await state.update_data(age=age)
     await state.set_state(RegisterState.photo)
 
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "🖼️ لطفاً یک عکس پروفایل ارسال کنید:",
         reply_markup=None
     )
@@ -163,55 +188,51 @@ async def register_age(message: Message, state: FSMContext):
 @router.message(RegisterState.photo)
 async def register_photo(message: Message, state: FSMContext):
     if not message.photo:
-        await message.answer("❌ لطفاً فقط عکس ارسال کنید.")
+        outbox.send_message(message.bot, message.chat.id, "❌ لطفاً فقط عکس ارسال کنید.")
         return
 
     data = await state.get_data()
     photo_id = message.photo[-1].file_id
 
-    db = await get_db()
-
     # =========================
     # User registration
     # =========================
-    cursor = await db.execute(
-        """
-        INSERT INTO users 
-        (telegram_id, name, gender, province, city, age, profile_pic, coins)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            message.from_user.id,
-            data["name"],
-            data["gender"],
-            data["province"],
-            data["city"],
-            data["age"],
-            photo_id,
-            15  # FirstCoin
+    async with LedgerWrite() as ledger, write_db() as db:
+        await db.execute(
+            """
+            INSERT INTO users
+            (telegram_id, name, gender, province, city, age, profile_pic)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                message.from_user.id,
+                data["name"],
+                data["gender"],
+                data["province"],
+                data["city"],
+                data["age"],
+                photo_id
+            )
         )
-    )
-
-    await db.commit()
-
-    # New user id in db
-    user_id = cursor.lastrowid
+        await ledger.add(db, message.from_user.id, SIGNUP_COINS, "signup")
+    invalidate_user(message.from_user.id)
 
     # =========================
     # Referral
     # =========================
     ref_id = data.get("ref_id")
 
-    if ref_id and ref_id != user_id:
+    if ref_id and ref_id != message.from_user.id:
         await handle_referral(
-            inviter_id=ref_id,
-            invited_id=user_id
+            inviter_telegram_id=ref_id,
+            invited_telegram_id=message.from_user.id
         )
 
-    await db.close()
     await state.clear()
 
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "✅ ثبت‌نام شما با موفقیت انجام شد!\n\n🎁 ۱۵ سکه دریافت کردید.",
         reply_markup=main_keyboard
     )
\ No newline at end of file
@@ -1,8 +1,10 @@
 from aiogram import Router, F
 from aiogram.types import Message
 
-from app.database import get_db
-from app.services.matcher import active_chats  # ✅ اصلاح شده
+from app.services.state import backend
+from app.services.reports import add_report
+from app.services.sender import outbox
+from app.keyboards.main import main_keyboard
 
 router = Router()
 
@@ -11,28 +13,45 @@ router = Router()
 async def report_user(message: Message):
     """ریپورت کردن مخاطب فعلی"""
     reporter_id = message.from_user.id
-    reported_id = active_chats.get(reporter_id)
+    reported_id = await backend.get_partner(reporter_id)
 
     if not reported_id:
-        await message.answer("❌ کاربری برای ریپورت وجود ندارد.")
+        outbox.send_message(message.bot, message.chat.id, "❌ کاربری برای ریپورت وجود ندارد.")
         return
 
     try:
-        db = await get_db()
-
-        await db.execute(
-            """
-            INSERT INTO reports (reporter_id, reported_id)
-            VALUES (?, ?)
-            """,
-            (reporter_id, reported_id)
-        )
-
-        await db.commit()
-        await db.close()
-
-        await message.answer("✅ گزارش شما ثبت شد و بررسی خواهد شد.")
+        banned_until = await add_report(reporter_id, reported_id)
 
     except Exception as e:
         print(f"خطا در ثبت ریپورت: {e}")
-        await message.answer("❌ خطا در ثبت گزارش.")
\ No newline at end of file
+        outbox.send_message(message.bot, message.chat.id, "❌ خطا در ثبت گزارش.")
+        return
+
+    if not banned_until:
+        outbox.send_message(message.bot, message.chat.id, "✅ گزارش شما ثبت شد و بررسی خواهد شد.")
+        return
+
+    # Too many reports: the ban also ends the reported user's chat
+    partner_id = await backend.end_chat(reported_id)
+
+    outbox.send_message(
+        message.bot,
+        reported_id,
+        "⛔ به دلیل گزارش‌های متعدد، حساب شما به طور موقت مسدود شد.",
+        reply_markup=main_keyboard
+    )
+
+    if partner_id and partner_id != reporter_id:
+        outbox.send_message(
+            message.bot,
+            partner_id,
+            "❌ چت به دلیل مسدود شدن مخاطب پایان یافت.",
+            reply_markup=main_keyboard
+        )
+
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
+        "✅ گزارش شما ثبت شد و چت پایان یافت.",
+        reply_markup=main_keyboard
+    )
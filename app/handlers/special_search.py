@@ -0,0 +1,278 @@
+import asyncio
+
+from aiogram import Bot, Router, F
+from aiogram.types import Message
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+from app.config import SPECIAL_SEARCH_FALLBACK_SECONDS
+from app.handlers.match import pair_users, CHAT_COST
+from app.services import queue_sweeper, sharding
+from app.services.state import backend
+from app.services.sender import outbox
+from app.services.filtered_matcher import (
+    SearchFilter, widen, add_to_filtered_waiting, find_filtered_match,
+    rematch_filtered, is_filtered_waiting, put_back_filtered
+)
+from app.services.users import UserSnapshot
+from app.services.coins import get_balance
+from app.keyboards.chat import chat_keyboard
+from app.keyboards.main import main_keyboard, waiting_keyboard
+from app.keyboards.special_search import (
+    AGE_RANGES, SCOPES, special_gender_keyboard, age_range_keyboard, scope_keyboard
+)
+
+router = Router()
+
+# user_id -> task that widens the search while the user is waiting
+_fallback_tasks: dict[int, asyncio.Task] = {}
+
+
+class SpecialSearchState(StatesGroup):
+    gender = State()
+    age = State()
+    scope = State()
+
+
+@router.message(F.text == "🎯 جستجوی ویژه")
+async def special_search(message: Message, state: FSMContext):
+    """جستجوی ویژه با فیلترهای بیشتر"""
+    if await backend.is_in_chat(message.from_user.id):
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ شما در حال حاضر در چت هستید.",
+            reply_markup=chat_keyboard
+        )
+        return
+
+    await state.set_state(SpecialSearchState.gender)
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
+        "🎯 <b>جستجوی ویژه</b>\n\n"
+        "👫 میخوای به کی وصل شی ؟",
+        parse_mode="HTML",
+        reply_markup=special_gender_keyboard
+    )
+
+
+@router.message(StateFilter(SpecialSearchState), F.text == "❌ لغو")
+async def special_search_cancel(message: Message, state: FSMContext):
+    """خروج از فرم جستجوی ویژه"""
+    await state.clear()
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
+        "✅ جستجوی ویژه لغو شد.",
+        reply_markup=main_keyboard
+    )
+
+
+@router.message(SpecialSearchState.gender)
+async def special_search_gender(message: Message, state: FSMContext):
+    if message.text not in ["پسر", "دختر"]:
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ فقط از دکمه‌ها استفاده کنید.",
+            reply_markup=special_gender_keyboard
+        )
+        return
+
+    await state.update_data(target_gender=message.text)
+    await state.set_state(SpecialSearchState.age)
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
+        "🎂 محدوده سنی مخاطب را انتخاب کنید:",
+        reply_markup=age_range_keyboard
+    )
+
+
+@router.message(SpecialSearchState.age)
+async def special_search_age(message: Message, state: FSMContext):
+    if message.text not in AGE_RANGES:
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ فقط از دکمه‌ها استفاده کنید.",
+            reply_markup=age_range_keyboard
+        )
+        return
+
+    min_age, max_age = AGE_RANGES[message.text]
+    await state.update_data(min_age=min_age, max_age=max_age)
+    await state.set_state(SpecialSearchState.scope)
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
+        "📍 مخاطب از کجا باشد؟",
+        reply_markup=scope_keyboard
+    )
+
+
+@router.message(SpecialSearchState.scope)
+async def special_search_scope(message: Message, state: FSMContext, user: UserSnapshot | None):
+    if message.text not in SCOPES:
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ فقط از دکمه‌ها استفاده کنید.",
+            reply_markup=scope_keyboard
+        )
+        return
+
+    data = await state.get_data()
+    await state.clear()
+
+    if not user:
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ کاربر یافت نشد. لطفاً ابتدا ثبت‌نام کنید.",
+            reply_markup=main_keyboard
+        )
+        return
+
+    if await get_balance(user.telegram_id) < CHAT_COST:
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ سکه کافی ندارید.\n\n"
+            "💰 برای هر چت 2 سکه نیاز است.\n"
+            "از منوی اصلی می‌توانید سکه خریداری کنید.",
+            reply_markup=main_keyboard
+        )
+        return
+
+    search_filter = SearchFilter(
+        target_gender=data["target_gender"],
+        min_age=data["min_age"],
+        max_age=data["max_age"],
+        scope=SCOPES[message.text]
+    )
+    user_data = {
+        "id": user.telegram_id,
+        "gender": user.gender,
+        "age": user.age,
+        "province": user.province,
+        "city": user.city
+    }
+
+    try:
+        if sharding.forwards_special_search():
+            await sharding.peer(sharding.SPECIAL_SEARCH_SHARD).request("special_search", {
+                "user": user_data,
+                "filter": search_filter._asdict(),
+            })
+        else:
+            await search(message.bot, user_data, search_filter)
+
+    except Exception as e:
+        print(f"خطا در جستجوی ویژه: {e}")
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
+            "❌ خطایی رخ داد. لطفاً دوباره تلاش کنید.",
+            reply_markup=main_keyboard
+        )
+
+
+async def search(bot: Bot, user_data: dict, search_filter: SearchFilter):
+    """
+    جفت کردن با کسی از صف ویژه، یا ورود به آن
+
+    Runs on the shard that holds the pool (sharding.SPECIAL_SEARCH_SHARD);
+    its messages reach the user through the outbox like any other.
+    """
+    user_id = user_data["id"]
+
+    # Someone in a chat, or being paired right now, must neither take
+    # a partner out of the pool nor wait in it
+    if await backend.is_busy(user_id):
+        outbox.send_message(
+            bot,
+            user_id,
+            "❌ شما در حال حاضر در چت هستید.",
+            reply_markup=chat_keyboard
+        )
+        return
+
+    match = find_filtered_match(user_data, search_filter)
+
+    if match is not None:
+        partner_id = match.user_data["id"]
+        if await backend.reserve(user_id, partner_id):
+            if await pair_users(bot, user_id, partner_id):
+                return
+            # The partner could not pay; wait for the next one if we still can
+            if await get_balance(user_id) < CHAT_COST:
+                return
+        else:
+            # One of the two got into a chat meanwhile; a partner who
+            # is still free keeps their place in the pool
+            if not await backend.is_busy(partner_id):
+                put_back_filtered(match)
+            if await backend.is_busy(user_id):
+                return
+
+    add_to_filtered_waiting(user_data, search_filter)
+    queue_sweeper.track(user_id)
+
+    text = (
+        "⏳ در حال جستجوی مخاطب با فیلترهای شما...\n\n"
+        "لطفاً صبر کنید تا مخاطبی پیدا شود."
+    )
+    if widen(search_filter) is not None and SPECIAL_SEARCH_FALLBACK_SECONDS > 0:
+        text += "\n\nاگر مخاطبی پیدا نشود، فیلترها کم‌کم بازتر می‌شوند."
+        _start_fallback(bot, user_id, search_filter)
+
+    outbox.send_message(bot, user_id, text, reply_markup=waiting_keyboard)
+
+
+def _start_fallback(bot: Bot, user_id: int, search_filter: SearchFilter):
+    task = _fallback_tasks.pop(user_id, None)
+    if task:
+        task.cancel()
+
+    task = asyncio.create_task(_widen_search(bot, user_id, search_filter))
+    _fallback_tasks[user_id] = task
+    task.add_done_callback(
+        lambda t: _fallback_tasks.pop(user_id, None) if _fallback_tasks.get(user_id) is t else None
+    )
+
+
+async def _widen_search(bot: Bot, user_id: int, search_filter: SearchFilter):
+    """بعد از هر بازه انتظار، با فیلتر بازتر دوباره جستجو کن"""
+    while (search_filter := widen(search_filter)) is not None:
+        await asyncio.sleep(SPECIAL_SEARCH_FALLBACK_SECONDS)
+
+        if not is_filtered_waiting(user_id):
+            return
+
+        match = rematch_filtered(user_id)
+        if match:
+            entry, partner = match
+            partner_id = partner.user_data["id"]
+            try:
+                # Not reserved means one of them is in a chat by now; whoever
+                # is still free goes back to the pool, and if that is us the
+                # search goes on
+                if not await backend.reserve(user_id, partner_id):
+                    free = [e for e in match if not await backend.is_busy(e.user_data["id"])]
+                    put_back_filtered(*free)
+                    if entry in free:
+                        continue
+                    return
+                if await pair_users(bot, user_id, partner_id):
+                    return
+                # The partner could not pay; keep our place while we still can
+                if await get_balance(user_id) < CHAT_COST:
+                    return
+                put_back_filtered(entry)
+                continue
+            except Exception as e:
+                print(f"خطا در جستجوی ویژه: {e}")
+            return
@@ -3,7 +3,8 @@ from aiogram.types import Message
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 
-from app.database import get_db
+from app.services.users import UserSnapshot
+from app.services.sender import outbox
 from app.keyboards.main import main_keyboard
 from app.handlers.register import RegisterState
 
@@ -11,25 +12,19 @@ router = Router()
 
 
 @router.message(CommandStart())
-async def start_handler(message: Message, state: FSMContext):
-    db = await get_db()
-
-    # User registration check
-    async with db.execute(
-        "SELECT id FROM users WHERE telegram_id = ?",
-        (message.from_user.id,)
-    ) as cursor:
-        user = await cursor.fetchone()
-
+async def start_handler(message: Message, state: FSMContext, user: UserSnapshot | None):
     # =========================
     # If the user has already registered
     # =========================
     if user:
-        await message.answer(
+        # Also the way out of any half-filled form
+        await state.clear()
+        outbox.send_message(
+            message.bot,
+            message.chat.id,
             "👋 خوش آمدید!",
             reply_markup=main_keyboard
         )
-        await db.close()
         return
 
     # =========================
@@ -50,8 +45,8 @@ async def start_handler(message: Message, state: FSMContext):
 
     await state.set_state(RegisterState.name)
 
-    await message.answer(
+    outbox.send_message(
+        message.bot,
+        message.chat.id,
         "👤 نام خود را وارد کنید:"
     )
-
-    await db.close()
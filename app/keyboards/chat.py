@@ -1,9 +1,11 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
-chat_keyboard = ReplyKeyboardMarkup(
+from app.keyboards.registry import register
+
+chat_keyboard = register(ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="👤 مشاهده پروفایل")],
         [KeyboardButton(text="🚫 ریپورت"), KeyboardButton(text="❌ اتمام چت")]
     ],
     resize_keyboard=True
-)
\ No newline at end of file
+))
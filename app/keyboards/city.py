@@ -1,23 +1,46 @@
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from app.utils.iran_locations import IRAN_PROVINCES
+from functools import lru_cache
 
+from app.keyboards.registry import register, grid
+from app.utils.iran_locations import province_cities
 
-def city_keyboard(province: str):
-    cities = IRAN_PROVINCES.get(province, [])
+CITY_PAGE_SIZE = 24
+CITY_COLUMNS = 3
 
-    buttons = []
-    row = []
+PREV_PAGE = "◀️ قبلی"
+NEXT_PAGE = "▶️ بعدی"
 
-    for city in cities:
-        row.append(KeyboardButton(text=city))
-        if len(row) == 2:
-            buttons.append(row)
-            row = []
 
-    if row:
-        buttons.append(row)
+def city_pages(province: str) -> int:
+    return max(1, -(-len(province_cities(province)) // CITY_PAGE_SIZE))
 
-    return ReplyKeyboardMarkup(
-        keyboard=buttons,
-        resize_keyboard=True
-    )
+
+def city_keyboard(province: str, page: int = 0):
+    """کیبورد شهرهای یک استان؛ استان‌های بزرگ صفحه‌بندی می‌شوند"""
+    pages = city_pages(province)
+    return _city_keyboard(province, min(max(page, 0), pages - 1), pages)
+
+
+@lru_cache(maxsize=256)
+def _city_keyboard(province: str, page: int, pages: int):
+    cities = province_cities(province)
+
+    nav = []
+    if page > 0:
+        nav.append(PREV_PAGE)
+    if page < pages - 1:
+        nav.append(NEXT_PAGE)
+
+    return register(grid(
+        cities[page * CITY_PAGE_SIZE:(page + 1) * CITY_PAGE_SIZE],
+        columns=CITY_COLUMNS,
+        footer=nav
+    ))
+
+
+def turn_city_page(text: str | None, province: str, page: int) -> int | None:
+    """اگر متن یکی از دکمه‌های قبلی/بعدی باشد شماره صفحه جدید را برمی‌گرداند"""
+    if text == NEXT_PAGE:
+        return min(page + 1, city_pages(province) - 1)
+    if text == PREV_PAGE:
+        return max(page - 1, 0)
+    return None
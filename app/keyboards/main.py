@@ -1,10 +1,26 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
-main_keyboard = ReplyKeyboardMarkup(
+from app.keyboards.registry import register
+
+main_keyboard = register(ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="🔍 اتصال ناشناس")],
         [KeyboardButton(text="👤 پروفایل من"), KeyboardButton(text="🎯 جستجوی ویژه")],
         [KeyboardButton(text="💳 خرید سکه"), KeyboardButton(text="🎁 دعوت دوستان")]
     ],
     resize_keyboard=True
-)
+))
+
+gender_keyboard = register(ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="پسر"), KeyboardButton(text="دختر")]
+    ],
+    resize_keyboard=True
+))
+
+waiting_keyboard = register(ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="❌ لغو جستجو")]
+    ],
+    resize_keyboard=True
+))
@@ -1,6 +1,8 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
-coins_keyboard = ReplyKeyboardMarkup(
+from app.keyboards.registry import register
+
+coins_keyboard = register(ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="💰 50 سکه - 25,000 تومان")],
         [KeyboardButton(text="💰 120 سکه - 50,000 تومان")],
@@ -8,4 +10,4 @@ coins_keyboard = ReplyKeyboardMarkup(
         [KeyboardButton(text="🔙 بازگشت")]
     ],
     resize_keyboard=True
-)
+))
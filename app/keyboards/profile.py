@@ -1,11 +1,11 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from app.keyboards.registry import register
 
-def profile_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✏️ ویرایش نام", callback_data="edit_name")],
-        [InlineKeyboardButton(text="📍 ویرایش استان", callback_data="edit_province")],
-        [InlineKeyboardButton(text="🏙 ویرایش شهر", callback_data="edit_city")],
-        [InlineKeyboardButton(text="🎂 ویرایش سن", callback_data="edit_age")],
-        [InlineKeyboardButton(text="🖼 ویرایش عکس", callback_data="edit_photo")]
-    ])
+profile_keyboard = register(InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✏️ ویرایش نام", callback_data="edit_name")],
+    [InlineKeyboardButton(text="📍 ویرایش استان", callback_data="edit_province")],
+    [InlineKeyboardButton(text="🏙 ویرایش شهر", callback_data="edit_city")],
+    [InlineKeyboardButton(text="🎂 ویرایش سن", callback_data="edit_age")],
+    [InlineKeyboardButton(text="🖼 ویرایش عکس", callback_data="edit_photo")]
+]))
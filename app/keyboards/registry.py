@@ -0,0 +1,40 @@
+import json
+
+from aiogram.types import (
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup
+)
+
+# id(markup) -> serialized JSON, for markups that never change after import
+_json: dict[int, str] = {}
+
+
+def register(markup):
+    """
+    ثبت یک کیبورد ثابت و ذخیره JSON آن
+
+    The markup must not be modified afterwards: the cached JSON is what
+    gets sent (see app.services.bot_session).
+    """
+    data = markup.model_dump(exclude_none=True)
+    _json[id(markup)] = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return markup
+
+
+def cached_json(markup: ReplyKeyboardMarkup | InlineKeyboardMarkup | None) -> str | None:
+    if markup is None:
+        return None
+    return _json.get(id(markup))
+
+
+def grid(labels, columns: int = 2, footer=()) -> ReplyKeyboardMarkup:
+    """کیبورد با دکمه‌های چیده شده در چند ستون (+ یک ردیف پایانی اختیاری)"""
+    labels = list(labels)
+    rows = [
+        [KeyboardButton(text=label) for label in labels[i:i + columns]]
+        for i in range(0, len(labels), columns)
+    ]
+    if footer:
+        rows.append([KeyboardButton(text=label) for label in footer])
+    return ReplyKeyboardMarkup(keyboard=rows, resize_keyboard=True)
@@ -0,0 +1,48 @@
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+
+from app.keyboards.registry import register
+
+# متن دکمه -> (حداقل سن، حداکثر سن)
+AGE_RANGES = {
+    "15 تا 20": (15, 20),
+    "21 تا 25": (21, 25),
+    "26 تا 30": (26, 30),
+    "31 تا 40": (31, 40),
+    "بالای 40": (41, 100),
+    "🔸 سن فرقی نمی‌کنه": (None, None),
+}
+
+# متن دکمه -> محدوده مکانی
+SCOPES = {
+    "🏙 هم‌شهری": "city",
+    "📍 هم‌استانی": "province",
+    "🌍 فرقی نمی‌کنه": "any",
+}
+
+# Every step has a way out of the form
+special_gender_keyboard = register(ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="پسر"), KeyboardButton(text="دختر")],
+        [KeyboardButton(text="❌ لغو")]
+    ],
+    resize_keyboard=True
+))
+
+age_range_keyboard = register(ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="15 تا 20"), KeyboardButton(text="21 تا 25")],
+        [KeyboardButton(text="26 تا 30"), KeyboardButton(text="31 تا 40")],
+        [KeyboardButton(text="بالای 40"), KeyboardButton(text="🔸 سن فرقی نمی‌کنه")],
+        [KeyboardButton(text="❌ لغو")]
+    ],
+    resize_keyboard=True
+))
+
+scope_keyboard = register(ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="🏙 هم‌شهری"), KeyboardButton(text="📍 هم‌استانی")],
+        [KeyboardButton(text="🌍 فرقی نمی‌کنه")],
+        [KeyboardButton(text="❌ لغو")]
+    ],
+    resize_keyboard=True
+))
@@ -0,0 +1,29 @@
+import time
+
+from aiogram import BaseMiddleware
+
+from app import metrics
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    زمان اجرای هر هندلر (به تفکیک router و هندلر)
+
+    Registered as an inner middleware, so only updates that reached a
+    handler are measured, and the handler is known.
+    """
+
+    async def __call__(self, handler, event, data):
+        callback = data["handler"].callback
+        # Routers live one per module in app.handlers
+        router = callback.__module__.rpartition(".")[2]
+        name = callback.__name__
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.handler_errors.inc(router, name)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - started, router, name)
@@ -0,0 +1,30 @@
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from app.services import profiler
+
+
+class ProfilerMiddleware(BaseMiddleware):
+    """
+    انتخاب آپدیت‌هایی که پروفایل می‌شوند (فقط وقتی پروفایلر روشن است)
+
+    Registered twice: as an outer middleware on updates, where it decides
+    whether to profile the update (so aiogram's filters are included),
+    and as an inner middleware on messages and callbacks, where it notes
+    which handler the update reached.
+    """
+
+    async def __call__(self, handler, event, data):
+        if isinstance(event, Update):
+            if not profiler.should_sample():
+                return await handler(event, data)
+
+            probe = {"handler": "(unhandled)", "stacks": []}
+            data["profile_probe"] = probe
+            return await profiler.run_profiled(handler, event, data, probe)
+
+        probe = data.get("profile_probe")
+        if probe is not None:
+            callback = data["handler"].callback
+            probe["handler"] = f"{callback.__module__.rpartition('.')[2]}.{callback.__name__}"
+        return await handler(event, data)
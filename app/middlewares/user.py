@@ -0,0 +1,82 @@
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.fsm.context import FSMContext
+
+from app.services.users import get_user
+from app.services.bans import banned_until
+from app.services.sender import outbox
+from app.keyboards.registry import register
+
+
+register_keyboard = register(ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="ثبت نام")]
+    ],
+    resize_keyboard=True
+))
+
+
+class UserMiddleware(BaseMiddleware):
+    """
+    بارگذاری اطلاعات کاربر (یک بار برای هر آپدیت) + بررسی بن و ثبت‌نام
+
+    The snapshot is passed to handlers as ``user``.
+    """
+
+    async def __call__(self, handler, event, data):
+        from_user = data.get("event_from_user")
+
+        if not from_user:
+            return await handler(event, data)
+
+        # =========================
+        # Ban check (in memory, before any I/O)
+        # =========================
+        until = banned_until(from_user.id)
+        if until is not None:
+            remaining = int(until - time.time())
+            days, rest = divmod(remaining, 86400)
+            hours = rest // 3600
+
+            text = (
+                f"⛔ حساب شما مسدود شده است.\n\n"
+                f"⏳ زمان باقی‌مانده:\n"
+                f"{days} روز و {hours} ساعت"
+            )
+
+            if isinstance(event, CallbackQuery):
+                await event.answer(text, show_alert=True)
+            elif isinstance(event, Message):
+                outbox.send_message(event.bot, event.chat.id, text)
+            return
+
+        user = await get_user(from_user.id)
+        data["user"] = user
+
+        # =========================
+        # Registration check
+        # =========================
+        if user or not isinstance(event, Message):
+            return await handler(event, data)
+
+        state: FSMContext | None = data.get("state")
+
+        # اگر کاربر داخل FSM است، مزاحم نشو
+        if state:
+            current_state = await state.get_state()
+            if current_state is not None:
+                return await handler(event, data)
+
+        # اجازه بده /start یا "ثبت نام" عبور کند
+        if event.text and (event.text.startswith("/start") or event.text == "ثبت نام"):
+            return await handler(event, data)
+
+        outbox.send_message(
+            event.bot,
+            event.chat.id,
+            "👋 خوش آمدید\nبرای استفاده از ربات ابتدا باید ثبت‌نام کنید.",
+            reply_markup=register_keyboard
+        )
+        return
@@ -0,0 +1,213 @@
+"""
+مایگریشن‌های دیتابیس
+
+The schema version lives in ``PRAGMA user_version``. Each migration runs
+once, in order, inside its own transaction together with the version
+bump, so a crash half way leaves the database at the previous version.
+Never edit a migration that has shipped; append a new one instead.
+"""
+
+
+# =========================
+# 1: جداول پایه
+# =========================
+async def _opening_balances(db):
+    # Balances from before the ledger existed become opening entries,
+    # so SUM(delta) per user always equals users.coins
+    async with db.execute("SELECT 1 FROM coin_ledger LIMIT 1") as cursor:
+        has_ledger = await cursor.fetchone()
+
+    if not has_ledger:
+        await db.execute(
+            """
+            INSERT INTO coin_ledger (telegram_id, delta, reason, source, created_at)
+            SELECT telegram_id, coins, 'opening', 'migration', strftime('%s', 'now')
+            FROM users WHERE coins != 0
+            """
+        )
+
+
+# IF NOT EXISTS: databases created before migrations existed already
+# have these tables and start from version 0 like a fresh file.
+_BASELINE = [
+    # کاربران
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER UNIQUE,
+        name TEXT,
+        gender TEXT,
+        province TEXT,
+        city TEXT,
+        age INTEGER,
+        profile_pic TEXT,
+        coins INTEGER DEFAULT 0,
+        referral_code TEXT UNIQUE,
+        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        banned_until TIMESTAMP
+    )
+    """,
+    # سیستم دعوت
+    """
+    CREATE TABLE IF NOT EXISTS referrals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        inviter_telegram_id INTEGER,
+        invited_telegram_id INTEGER UNIQUE,
+        referral_code TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # ریپورت کاربران
+    """
+    CREATE TABLE IF NOT EXISTS reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reporter_id INTEGER,
+        reported_id INTEGER,
+        reason TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # پرداخت‌ها
+    """
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        amount INTEGER,
+        coins INTEGER,
+        authority TEXT UNIQUE,
+        status TEXT DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # دفتر سکه (فقط اضافه می‌شود)
+    """
+    CREATE TABLE IF NOT EXISTS coin_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        ref TEXT,
+        source TEXT,
+        created_at REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_coin_ledger_user ON coin_ledger (telegram_id)",
+    _opening_balances,
+    # وضعیت FSM کاربران
+    """
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        updated_at REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)",
+    # چت‌های فعال و صف انتظار (برای ری‌استارت)
+    """
+    CREATE TABLE IF NOT EXISTS chat_sessions (
+        user_id INTEGER PRIMARY KEY,
+        partner_id INTEGER NOT NULL,
+        started_at REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS waiting_queue (
+        user_id INTEGER PRIMARY KEY,
+        gender TEXT,
+        target_gender TEXT,
+        seq INTEGER,
+        enqueued_at REAL
+    )
+    """,
+]
+
+
+# =========================
+# 2: ایندکس‌های مسیرهای پرتکرار
+# =========================
+_HOT_PATH_INDEXES = [
+    # reports against one user (auto-ban threshold, admin review)
+    "CREATE INDEX IF NOT EXISTS idx_reports_reported ON reports (reported_id, created_at)",
+    # a user's payments by status
+    "CREATE INDEX IF NOT EXISTS idx_payments_user_status ON payments (user_id, status)",
+    # pending payments for reconciliation, walked in id order
+    "CREATE INDEX IF NOT EXISTS idx_payments_status ON payments (status, id)",
+    # who did a user invite
+    "CREATE INDEX IF NOT EXISTS idx_referrals_inviter ON referrals (inviter_telegram_id)",
+    # currently banned users
+    "CREATE INDEX IF NOT EXISTS idx_users_banned_until ON users (banned_until) WHERE banned_until IS NOT NULL",
+    "ANALYZE",
+]
+
+
+# =========================
+# 3: بن خودکار
+# =========================
+_AUTO_BANS = [
+    # how many times a user was banned (for escalation), and when the
+    # last ban started so reports before it are not counted again
+    "ALTER TABLE users ADD COLUMN ban_count INTEGER DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN banned_at TIMESTAMP",
+    # recent reports, read once at startup to rebuild the report window
+    "CREATE INDEX IF NOT EXISTS idx_reports_created ON reports (created_at)",
+]
+
+
+# =========================
+# 4: زمان رزرو پرداخت
+# =========================
+_PAYMENT_CLAIMS = [
+    # when a settlement claimed the row ('verifying'), so only claims
+    # that outlived any gateway call are handed back to reconciliation
+    "ALTER TABLE payments ADD COLUMN claimed_at TIMESTAMP",
+    "UPDATE payments SET claimed_at = CURRENT_TIMESTAMP WHERE status = 'verifying'",
+]
+
+
+# =========================
+# 5: صف جستجوی ویژه (برای ری‌استارت)
+# =========================
+_SPECIAL_WAITING = [
+    """
+    CREATE TABLE IF NOT EXISTS special_waiting (
+        user_id INTEGER PRIMARY KEY,
+        user_data TEXT NOT NULL,
+        search_filter TEXT NOT NULL,
+        enqueued_at REAL
+    )
+    """,
+]
+
+
+MIGRATIONS = [
+    (1, "baseline schema", _BASELINE),
+    (2, "hot-path indexes", _HOT_PATH_INDEXES),
+    (3, "automatic bans", _AUTO_BANS),
+    (4, "payment claim time", _PAYMENT_CLAIMS),
+    (5, "special search journal", _SPECIAL_WAITING),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_version(db) -> int:
+    async with db.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def apply(db, version: int, steps) -> bool:
+    """اجرای یک مایگریشن؛ باید داخل write_db صدا زده شود. اگر قبلاً اجرا شده باشد False"""
+    # DDL does not open a transaction implicitly in sqlite3, so start one
+    # to make the steps and the version bump commit together
+    await db.execute("BEGIN IMMEDIATE")
+    # Checked again under the lock: shards starting together race here
+    if await get_version(db) >= version:
+        return False
+    for step in steps:
+        if callable(step):
+            await step(db)
+        else:
+            await db.execute(step)
+    await db.execute(f"PRAGMA user_version = {int(version)}")
+    return True
@@ -1,16 +1,24 @@
+"""
+مدل‌های SQLAlchemy
+
+Reference description of the tables; the schema itself is created and
+upgraded by app.migrations and this file has to follow it.
+"""
 from sqlalchemy import (
     Column, Integer, String, BigInteger,
-    Boolean, DateTime, ForeignKey
+    DateTime, Float, Index, Text
 )
+from sqlalchemy.orm import declarative_base
 from datetime import datetime
-from app.database import Base
+
+Base = declarative_base()
 
 
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(BigInteger, unique=True, index=True)
+    telegram_id = Column(BigInteger, unique=True)
     name = Column(String)
     gender = Column(String)
     province = Column(String)
@@ -18,16 +26,110 @@ class User(Base):
     age = Column(Integer)
     profile_pic = Column(String)
     coins = Column(Integer, default=0)
-    is_online = Column(Boolean, default=False)
-    current_chat_id = Column(Integer, nullable=True)
+    referral_code = Column(String, unique=True)
     registered_at = Column(DateTime, default=datetime.utcnow)
     banned_until = Column(DateTime, nullable=True)
+    banned_at = Column(DateTime, nullable=True)
+    ban_count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index(
+            "idx_users_banned_until", "banned_until",
+            sqlite_where=banned_until.isnot(None)
+        ),
+    )
 
 
 class Referral(Base):
     __tablename__ = "referrals"
 
     id = Column(Integer, primary_key=True)
-    inviter_id = Column(Integer, ForeignKey("users.id"))
-    invited_id = Column(Integer, ForeignKey("users.id"), unique=True)
+    inviter_telegram_id = Column(BigInteger)
+    invited_telegram_id = Column(BigInteger, unique=True)
+    referral_code = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_referrals_inviter", "inviter_telegram_id"),
+    )
+
+
+class Report(Base):
+    __tablename__ = "reports"
+
+    id = Column(Integer, primary_key=True)
+    reporter_id = Column(BigInteger)
+    reported_id = Column(BigInteger)
+    reason = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_reports_reported", "reported_id", "created_at"),
+        Index("idx_reports_created", "created_at"),
+    )
+
+
+class Payment(Base):
+    __tablename__ = "payments"
+
+    id = Column(Integer, primary_key=True)
+    # telegram_id of the buyer
+    user_id = Column(BigInteger)
+    amount = Column(Integer)
+    coins = Column(Integer)
+    authority = Column(String, unique=True)
+    # pending -> verifying -> success | failed | expired
+    status = Column(String, default="pending")
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_payments_user_status", "user_id", "status"),
+        Index("idx_payments_status", "status", "id"),
+    )
+
+
+class CoinLedger(Base):
+    __tablename__ = "coin_ledger"
+
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(BigInteger, nullable=False)
+    delta = Column(Integer, nullable=False)
+    reason = Column(String, nullable=False)
+    ref = Column(String)
+    source = Column(String)
+    created_at = Column(Float)
+
+    __table_args__ = (
+        Index("idx_coin_ledger_user", "telegram_id"),
+    )
+
+
+class FSMState(Base):
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)
+    state = Column(String)
+    data = Column(Text)
+    updated_at = Column(Float)
+
+    __table_args__ = (
+        Index("idx_fsm_states_updated", "updated_at"),
+    )
+
+
+class ChatSession(Base):
+    __tablename__ = "chat_sessions"
+
+    user_id = Column(BigInteger, primary_key=True)
+    partner_id = Column(BigInteger, nullable=False)
+    started_at = Column(Float)
+
+
+class WaitingEntry(Base):
+    __tablename__ = "waiting_queue"
+
+    user_id = Column(BigInteger, primary_key=True)
+    gender = Column(String)
+    target_gender = Column(String)
+    seq = Column(Integer)
+    enqueued_at = Column(Float)
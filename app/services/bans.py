@@ -0,0 +1,125 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from app.config import REPORT_BAN_DURATIONS, BAN_REFRESH_INTERVAL
+from app.database import read_db, write_db
+from app.services.users import invalidate_user
+
+# telegram_id -> ban end (unix time); only users banned right now, which
+# is a tiny fraction, so the ban check is one dict lookup
+_banned: dict[int, float] = {}
+
+_refresh_task: asyncio.Task | None = None
+
+
+# =========================
+# بررسی بن (از حافظه)
+# =========================
+def banned_until(telegram_id: int) -> float | None:
+    """زمان پایان بن (unix time) یا None اگر کاربر بن نیست"""
+    until = _banned.get(telegram_id)
+    if until is None:
+        return None
+    if until <= time.time():
+        _banned.pop(telegram_id, None)
+        return None
+    return until
+
+
+def _remember(telegram_id: int, until: datetime):
+    # banned_until is stored as naive local time, so timestamp() applies
+    # the local offset the same way the value was written
+    _banned[telegram_id] = until.timestamp()
+
+
+async def refresh():
+    """خواندن بن‌های فعال از دیتابیس (شامل بن‌های پروسه‌های دیگر)"""
+    now = datetime.now()
+
+    async with read_db() as db:
+        # Served by the partial index on banned_until
+        async with db.execute(
+            """
+            SELECT telegram_id, banned_until FROM users
+            WHERE banned_until IS NOT NULL AND banned_until > ?
+            """,
+            (now.isoformat(sep=" ", timespec="seconds"),)
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+    for telegram_id, until in rows:
+        try:
+            _remember(telegram_id, datetime.fromisoformat(until))
+        except ValueError:
+            # A broken date is not a ban
+            continue
+
+    expired = [tid for tid, until in _banned.items() if until <= now.timestamp()]
+    for telegram_id in expired:
+        del _banned[telegram_id]
+
+
+# =========================
+# بن کردن
+# =========================
+async def ban_user(telegram_id: int) -> datetime | None:
+    """
+    بن موقت کاربر؛ هر بن بعدی از مدت بعدی REPORT_BAN_DURATIONS استفاده می‌کند
+
+    Returns when the ban ends, or None if the user is not registered.
+    """
+    async with write_db() as db:
+        async with db.execute(
+            "SELECT ban_count FROM users WHERE telegram_id = ?",
+            (telegram_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if not row:
+            return None
+
+        step = min(row[0] or 0, len(REPORT_BAN_DURATIONS) - 1)
+        # Local time, like the ban check in UserMiddleware
+        banned_until = datetime.now() + timedelta(seconds=REPORT_BAN_DURATIONS[step])
+
+        await db.execute(
+            """
+            UPDATE users
+            SET banned_until = ?, banned_at = CURRENT_TIMESTAMP,
+                ban_count = IFNULL(ban_count, 0) + 1
+            WHERE telegram_id = ?
+            """,
+            (banned_until.isoformat(sep=" ", timespec="seconds"), telegram_id)
+        )
+
+    _remember(telegram_id, banned_until)
+    invalidate_user(telegram_id)
+    return banned_until
+
+
+async def _refresh_loop():
+    while True:
+        await asyncio.sleep(BAN_REFRESH_INTERVAL)
+        try:
+            await refresh()
+        except Exception as e:
+            print(f"خطا در بروزرسانی لیست بن: {e}")
+
+
+async def start():
+    global _refresh_task
+    await refresh()
+    if _refresh_task is None:
+        _refresh_task = asyncio.create_task(_refresh_loop())
+
+
+async def stop():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
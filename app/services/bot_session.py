@@ -0,0 +1,54 @@
+import time
+from typing import Dict
+
+from aiohttp import FormData
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import InputFile
+
+from app import metrics
+from app.keyboards.registry import cached_json
+
+
+class CachedMarkupSession(AiohttpSession):
+    """
+    سشن ربات که JSON کیبوردهای ثابت را از قبل آماده دارد
+
+    Registered keyboards (app.keyboards.registry) are sent as their
+    pre-serialized JSON instead of being dumped and re-encoded on every
+    request; everything else is built exactly like AiohttpSession does.
+    Every request's latency and failures go to app.metrics.
+    """
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout=None):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await super().make_request(bot, method, timeout)
+        except Exception as e:
+            metrics.bot_api_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            metrics.bot_api_seconds.observe(time.perf_counter() - started, name)
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        markup = cached_json(getattr(method, "reply_markup", None))
+        if markup is None:
+            return super().build_form_data(bot, method)
+
+        form = FormData(quote_fields=False)
+        files: Dict[str, InputFile] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", markup)
+        for key, value in files.items():
+            form.add_field(
+                key,
+                value.read(bot),
+                filename=value.filename or key,
+            )
+        return form
@@ -1,22 +1,323 @@
-from app.database import get_db
-
-
-async def add_coins(telegram_id: int, coins: int):
-    db = await get_db()
-    await db.execute(
-        "UPDATE users SET coins = coins + ? WHERE telegram_id = ?",
-        (coins, telegram_id)
-    )
-    await db.commit()
-    await db.close()
-
-
-async def get_user_coins(telegram_id: int) -> int:
-    db = await get_db()
-    async with db.execute(
-        "SELECT coins FROM users WHERE telegram_id = ?",
-        (telegram_id,)
-    ) as cursor:
-        row = await cursor.fetchone()
-    await db.close()
-    return row[0] if row else 0
+import asyncio
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict
+
+from app.config import COIN_FLUSH_INTERVAL, COIN_CACHE_SIZE
+from app.database import read_db, write_db
+from app.services import sharding
+from app.services.users import invalidate_user
+
+# Written into every ledger row from this process, so rows written by
+# other processes (payment API, other bot workers) can be told apart.
+SOURCE = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# telegram_id -> [balance, ledger id the balance was loaded at]
+_balances: OrderedDict[int, list] = OrderedDict()
+
+# Entries applied in memory but not yet written to coin_ledger
+_pending: list[tuple[int, int, str, str | None]] = []
+# telegram_id -> sum of those entries (also covers a batch being flushed)
+_unflushed: dict[int, int] = {}
+
+# A balance read from disk is only trusted if no write to users.coins
+# started or finished while it was being read.
+_writing = 0
+_version = 0
+
+# Highest ledger id from another source already applied to the cache
+_tail_id = 0
+
+_flush_task: asyncio.Task | None = None
+
+
+# =========================
+# موجودی (از حافظه)
+# =========================
+async def _load(telegram_id: int) -> list:
+    while True:
+        if _writing:
+            await asyncio.sleep(0.005)
+            continue
+
+        version = _version
+        async with read_db() as db:
+            # One statement, so both values come from the same snapshot
+            async with db.execute(
+                """
+                SELECT coins, (SELECT IFNULL(MAX(id), 0) FROM coin_ledger)
+                FROM users WHERE telegram_id = ?
+                """,
+                (telegram_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+
+        if version == _version and not _writing:
+            break
+
+    entry = _balances.get(telegram_id)
+    if entry is None:
+        coins, loaded_at = row if row else (0, 0)
+        entry = [coins + _unflushed.get(telegram_id, 0), loaded_at]
+        _balances[telegram_id] = entry
+        while len(_balances) > COIN_CACHE_SIZE:
+            _balances.popitem(last=False)
+    return entry
+
+
+async def _entry(telegram_id: int) -> list:
+    entry = _balances.get(telegram_id)
+    if entry is None:
+        return await _load(telegram_id)
+    _balances.move_to_end(telegram_id)
+    return entry
+
+
+async def get_balance(telegram_id: int) -> int:
+    """موجودی سکه کاربر؛ بعد از اولین بار بدون خواندن دیتابیس"""
+    return (await _entry(telegram_id))[0]
+
+
+# =========================
+# تغییر موجودی
+# =========================
+def _apply(entry: list, telegram_id: int, delta: int, reason: str, ref: str | None):
+    entry[0] += delta
+    _pending.append((telegram_id, delta, reason, ref))
+    _unflushed[telegram_id] = _unflushed.get(telegram_id, 0) + delta
+
+
+async def debit(telegram_id: int, amount: int, reason: str, ref: str | None = None) -> bool:
+    """
+    کسر سکه؛ اگر موجودی کافی نباشد هیچ تغییری نمی‌دهد و False برمی‌گرداند
+
+    The check and the change happen with no await in between, so two
+    debits can never both spend the same coins.
+    """
+    entry = await _entry(telegram_id)
+    if entry[0] < amount:
+        return False
+    _apply(entry, telegram_id, -amount, reason, ref)
+    return True
+
+
+async def debit_many(
+    telegram_ids: tuple[int, ...],
+    amount: int,
+    reason: str,
+    ref: str | None = None,
+    forward: bool = True
+) -> bool:
+    """
+    کسر از چند کاربر با هم: یا از همه یا از هیچ‌کدام
+
+    When running as a shard, only the shard that owns a user holds their
+    up-to-date balance, so users owned elsewhere are debited there. If
+    one of them cannot pay, whoever was already debited is refunded.
+    """
+    owners: dict[str, list[int]] = {}
+    if forward:
+        for telegram_id in telegram_ids:
+            if sharding.forwards(telegram_id):
+                owners.setdefault(sharding.ring.owner(telegram_id), []).append(telegram_id)
+    remote = {telegram_id for group in owners.values() for telegram_id in group}
+    local = tuple(telegram_id for telegram_id in telegram_ids if telegram_id not in remote)
+
+    entries = [await _entry(telegram_id) for telegram_id in local]
+    if any(entry[0] < amount for entry in entries):
+        return False
+    for telegram_id, entry in zip(local, entries):
+        _apply(entry, telegram_id, -amount, reason, ref)
+
+    paid = list(local)
+    for group in owners.values():
+        try:
+            ok = await sharding.forward(group[0], "debit", {
+                "telegram_ids": group,
+                "amount": amount,
+                "reason": reason,
+                "ref": ref,
+            })
+        except BaseException:
+            await refund_many(tuple(paid), amount, ref)
+            raise
+        if not ok:
+            await refund_many(tuple(paid), amount, ref)
+            return False
+        paid += group
+    return True
+
+
+async def refund_many(telegram_ids: tuple[int, ...], amount: int, ref: str | None = None, forward: bool = True):
+    """برگرداندن سکه‌ی کسرشده با debit_many (مثلاً وقتی چت شروع نشد)"""
+    for telegram_id in telegram_ids:
+        if forward and sharding.forwards(telegram_id):
+            try:
+                await sharding.forward(telegram_id, "refund", {
+                    "telegram_ids": [telegram_id],
+                    "amount": amount,
+                    "ref": ref,
+                })
+            except Exception as e:
+                print(f"خطا در برگرداندن سکه کاربر {telegram_id}: {e}")
+            continue
+        _apply(await _entry(telegram_id), telegram_id, amount, "refund", ref)
+
+
+# =========================
+# نوشتن در دفتر (داخل تراکنش دیگران)
+# =========================
+class LedgerWrite:
+    """
+    ثبت تراکنش سکه داخل یک تراکنش دیتابیس دیگر
+
+        async with LedgerWrite() as ledger, write_db() as db:
+            await ledger.add(db, telegram_id, 50, "payment", authority)
+
+    For credits that must commit together with other rows (a payment
+    marked paid, a new user, a referral). LedgerWrite has to be the outer
+    context so the cache is only touched after write_db has committed.
+    """
+
+    def __init__(self):
+        self.entries: list[tuple[int, int]] = []
+
+    async def __aenter__(self):
+        global _writing
+        _writing += 1
+        return self
+
+    async def add(self, db, telegram_id: int, delta: int, reason: str, ref: str | None = None):
+        await db.execute(
+            """
+            INSERT INTO coin_ledger (telegram_id, delta, reason, ref, source, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (telegram_id, delta, reason, ref, SOURCE, time.time())
+        )
+        await db.execute(
+            "UPDATE users SET coins = coins + ? WHERE telegram_id = ?",
+            (delta, telegram_id)
+        )
+        self.entries.append((telegram_id, delta))
+
+    async def __aexit__(self, exc_type, exc, tb):
+        global _writing, _version
+        if exc_type is None:
+            for telegram_id, delta in self.entries:
+                entry = _balances.get(telegram_id)
+                if entry is not None:
+                    entry[0] += delta
+            invalidate_user(*(telegram_id for telegram_id, _ in self.entries))
+        _version += 1
+        _writing -= 1
+        return False
+
+
+# =========================
+# نوشتن دسته‌ای (group commit)
+# =========================
+async def flush():
+    global _pending, _writing, _version
+
+    if not _pending:
+        return
+
+    batch = _pending
+    _pending = []
+    now = time.time()
+
+    totals: dict[int, int] = {}
+    for telegram_id, delta, _, _ in batch:
+        totals[telegram_id] = totals.get(telegram_id, 0) + delta
+
+    _writing += 1
+    try:
+        async with write_db() as db:
+            await db.executemany(
+                """
+                INSERT INTO coin_ledger (telegram_id, delta, reason, ref, source, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(telegram_id, delta, reason, ref, SOURCE, now) for telegram_id, delta, reason, ref in batch]
+            )
+            await db.executemany(
+                "UPDATE users SET coins = coins + ? WHERE telegram_id = ?",
+                [(delta, telegram_id) for telegram_id, delta in totals.items() if delta]
+            )
+    except Exception:
+        # Retry with the next batch, keeping the original order
+        _pending = batch + _pending
+        raise
+    else:
+        for telegram_id, delta in totals.items():
+            left = _unflushed.get(telegram_id, 0) - delta
+            if left:
+                _unflushed[telegram_id] = left
+            else:
+                _unflushed.pop(telegram_id, None)
+        invalidate_user(*totals)
+    finally:
+        _version += 1
+        _writing -= 1
+
+
+async def tail():
+    """اعمال ردیف‌هایی که پروسه‌های دیگر در دفتر نوشته‌اند روی کش"""
+    global _tail_id
+
+    async with read_db() as db:
+        async with db.execute(
+            """
+            SELECT id, telegram_id, delta FROM coin_ledger
+            WHERE id > ? AND source != ?
+            ORDER BY id
+            """,
+            (_tail_id, SOURCE)
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+    for row_id, telegram_id, delta in rows:
+        entry = _balances.get(telegram_id)
+        # Rows up to entry[1] were already in users.coins when it was loaded
+        if entry is not None and row_id > entry[1]:
+            entry[0] += delta
+        _tail_id = row_id
+
+    if rows:
+        invalidate_user(*{row[1] for row in rows})
+
+
+async def _sync_loop():
+    while True:
+        await asyncio.sleep(COIN_FLUSH_INTERVAL)
+        try:
+            await flush()
+            await tail()
+        except Exception as e:
+            print(f"خطا در ذخیره سکه‌ها: {e}")
+
+
+async def start():
+    global _flush_task, _tail_id
+
+    async with read_db() as db:
+        async with db.execute("SELECT IFNULL(MAX(id), 0) FROM coin_ledger") as cursor:
+            _tail_id = (await cursor.fetchone())[0]
+
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_sync_loop())
+
+
+async def stop():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    await flush()
@@ -0,0 +1,337 @@
+import heapq
+import logging
+import time
+from bisect import bisect_left, bisect_right, insort
+from itertools import count
+from typing import NamedTuple
+
+from app.config import SPECIAL_SEARCH_FALLBACK_SECONDS
+from app.services import session_journal, sharding
+from app.services.state import backend
+
+logger = logging.getLogger(__name__)
+
+SCOPE_CITY = "city"
+SCOPE_PROVINCE = "province"
+SCOPE_ANY = "any"
+
+# Upper bound on candidates inspected per query inside the age window
+MAX_SCAN = 256
+
+
+class SearchFilter(NamedTuple):
+    target_gender: str
+    min_age: int | None = None
+    max_age: int | None = None
+    scope: str = SCOPE_ANY
+
+
+def widen(search_filter: SearchFilter) -> SearchFilter | None:
+    """یک مرحله بازتر کردن فیلتر: شهر ← استان ← همه‌جا ← بدون محدودیت سن"""
+    if search_filter.scope == SCOPE_CITY:
+        return search_filter._replace(scope=SCOPE_PROVINCE)
+    if search_filter.scope == SCOPE_PROVINCE:
+        return search_filter._replace(scope=SCOPE_ANY)
+    if search_filter.min_age is not None or search_filter.max_age is not None:
+        return search_filter._replace(min_age=None, max_age=None)
+    return None
+
+
+def effective_filter(search_filter: SearchFilter, waited: float) -> SearchFilter:
+    """فیلتر فعلی با توجه به مدت انتظار"""
+    if SPECIAL_SEARCH_FALLBACK_SECONDS <= 0:
+        return search_filter
+
+    steps = int(waited // SPECIAL_SEARCH_FALLBACK_SECONDS)
+    while steps > 0:
+        wider = widen(search_filter)
+        if wider is None:
+            break
+        search_filter = wider
+        steps -= 1
+    return search_filter
+
+
+class _Entry:
+    __slots__ = ("seq", "user_data", "search_filter", "enqueued_at")
+
+    def __init__(self, seq: int, user_data: dict, search_filter: SearchFilter, enqueued_at: float | None = None):
+        self.seq = seq
+        self.user_data = user_data
+        self.search_filter = search_filter
+        self.enqueued_at = time.monotonic() if enqueued_at is None else enqueued_at
+
+
+def _accepts(search_filter: SearchFilter, user_data: dict) -> bool:
+    if user_data["gender"] != search_filter.target_gender:
+        return False
+    if search_filter.min_age is not None and user_data["age"] < search_filter.min_age:
+        return False
+    if search_filter.max_age is not None and user_data["age"] > search_filter.max_age:
+        return False
+    return True
+
+
+def _same_place(scope: str, a: dict, b: dict) -> bool:
+    if scope == SCOPE_CITY:
+        return a["province"] == b["province"] and a["city"] == b["city"]
+    if scope == SCOPE_PROVINCE:
+        return a["province"] == b["province"]
+    return True
+
+
+class FilteredPool:
+    """
+    صف انتظار جستجوی ویژه با ایندکس‌های ثانویه
+
+    Waiting users are indexed by their own attributes in three levels
+    (gender, gender+province, gender+province+city). Each index is a list
+    of (age, seq) kept sorted, so a query picks the narrowest index the
+    searcher's scope allows and bisects straight to the age window.
+    A (enqueued_at, seq) min-heap serves expiry without a full scan.
+    """
+
+    def __init__(self):
+        self._seq = count()
+        self._expiry: list[tuple[float, int]] = []
+        self._entries: dict[int, _Entry] = {}
+        self._index: dict[int, _Entry] = {}
+        self._by_gender: dict[str, list] = {}
+        self._by_province: dict[tuple, list] = {}
+        self._by_city: dict[tuple, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._index
+
+    def _lists_for(self, user_data: dict):
+        gender = user_data["gender"]
+        province = user_data["province"]
+        return (
+            (self._by_gender, gender),
+            (self._by_province, (gender, province)),
+            (self._by_city, (gender, province, user_data["city"])),
+        )
+
+    def _insert(self, entry: _Entry):
+        key = (entry.user_data["age"], entry.seq)
+
+        for index, index_key in self._lists_for(entry.user_data):
+            insort(index.setdefault(index_key, []), key)
+
+        self._entries[entry.seq] = entry
+        self._index[entry.user_data["id"]] = entry
+
+    def _remove(self, entry: _Entry):
+        del self._index[entry.user_data["id"]]
+        del self._entries[entry.seq]
+        key = (entry.user_data["age"], entry.seq)
+
+        for index, index_key in self._lists_for(entry.user_data):
+            ages = index[index_key]
+            del ages[bisect_left(ages, key)]
+            if not ages:
+                del index[index_key]
+
+    def add(self, user_data: dict, search_filter: SearchFilter, enqueued_at: float | None = None) -> _Entry:
+        self.cancel(user_data["id"])
+        entry = _Entry(next(self._seq), user_data, search_filter, enqueued_at)
+        self._insert(entry)
+
+        # rematch() re-inserts the same entry, so its heap item stays valid
+        heapq.heappush(self._expiry, (entry.enqueued_at, entry.seq))
+        if len(self._expiry) > 2 * len(self._entries) + 64:
+            self._expiry = [(e.enqueued_at, e.seq) for e in self._entries.values()]
+            heapq.heapify(self._expiry)
+        return entry
+
+    def expire(self, before: float) -> list[dict]:
+        """حذف کاربرانی که قبل از ``before`` (time.monotonic) وارد صف شده‌اند"""
+        expired = []
+        while self._expiry and self._expiry[0][0] < before:
+            entry = self._entries.get(heapq.heappop(self._expiry)[1])
+            if entry is not None:
+                self._remove(entry)
+                expired.append(entry.user_data)
+        return expired
+
+    def cancel(self, user_id: int) -> bool:
+        entry = self._index.get(user_id)
+        if entry is None:
+            return False
+        self._remove(entry)
+        return True
+
+    def put_back(self, entry: _Entry) -> bool:
+        """برگرداندن ورودی‌ای که برداشته شده بود، با همان جایگاه و زمان ورود"""
+        if entry.user_data["id"] in self._index:
+            return False
+        self._insert(entry)
+        # Its heap item may have been dropped by expire() in the meantime
+        heapq.heappush(self._expiry, (entry.enqueued_at, entry.seq))
+        return True
+
+    def rematch(self, user_id: int) -> tuple[_Entry, _Entry] | None:
+        """
+        جستجوی دوباره برای کاربری که در صف است، با فیلتر بازترشده‌ی فعلی
+
+        On a match both entries, the user's and the partner's, are taken
+        out of the pool and returned so that put_back() can restore them.
+        The entry keeps its place and enqueue time if nothing is found.
+        """
+        entry = self._index.get(user_id)
+        if entry is None:
+            return None
+
+        search_filter = effective_filter(entry.search_filter, time.monotonic() - entry.enqueued_at)
+
+        self._remove(entry)
+        match = self.pop_entry(entry.user_data, search_filter)
+        if match is None:
+            self._insert(entry)
+            return None
+        return entry, match
+
+    def pop_match(self, user_data: dict, search_filter: SearchFilter) -> dict | None:
+        entry = self.pop_entry(user_data, search_filter)
+        return entry.user_data if entry else None
+
+    def pop_entry(self, user_data: dict, search_filter: SearchFilter) -> _Entry | None:
+        self.cancel(user_data["id"])
+
+        gender = search_filter.target_gender
+        if search_filter.scope == SCOPE_CITY:
+            ages = self._by_city.get((gender, user_data["province"], user_data["city"]))
+        elif search_filter.scope == SCOPE_PROVINCE:
+            ages = self._by_province.get((gender, user_data["province"]))
+        else:
+            ages = self._by_gender.get(gender)
+
+        if not ages:
+            return None
+
+        low = 0
+        high = len(ages)
+        if search_filter.min_age is not None:
+            low = bisect_left(ages, (search_filter.min_age,))
+        if search_filter.max_age is not None:
+            high = bisect_right(ages, (search_filter.max_age, float("inf")))
+
+        now = time.monotonic()
+        for i in range(low, min(high, low + MAX_SCAN)):
+            entry = self._entries[ages[i][1]]
+            other = entry.user_data
+
+            # The waiting user has to accept us too, with their current
+            # (possibly widened) filter
+            theirs = effective_filter(entry.search_filter, now - entry.enqueued_at)
+            if not _accepts(theirs, user_data):
+                continue
+            if not _same_place(theirs.scope, other, user_data):
+                continue
+
+            self._remove(entry)
+            return entry
+
+        return None
+
+
+filtered_pool = FilteredPool()
+
+
+# The pool is written to session_journal as it changes, like the waiting
+# queue: entries taken out for a pairing stay written down as waiting
+# until they are put back or the pairing ends (leave_filtered_waiting).
+def _record_waiting(entry: _Entry):
+    # The journal keeps wall-clock time; the pool runs on time.monotonic()
+    enqueued_at = time.time() - (time.monotonic() - entry.enqueued_at)
+    session_journal.record_special_waiting(entry.user_data, entry.search_filter._asdict(), enqueued_at)
+
+
+def is_filtered_waiting(user_id: int) -> bool:
+    return user_id in filtered_pool
+
+
+def filtered_waiting_status(user_id: int) -> tuple[int, bool] | None:
+    """(تعداد کاربران صف ویژه، بازتر شدن فیلتر) برای کاربری که در صف است"""
+    entry = filtered_pool._index.get(user_id)
+    if entry is None:
+        return None
+    search_filter = effective_filter(entry.search_filter, time.monotonic() - entry.enqueued_at)
+    return len(filtered_pool), search_filter != entry.search_filter
+
+
+def add_to_filtered_waiting(user_data: dict, search_filter: SearchFilter):
+    _record_waiting(filtered_pool.add(user_data, search_filter))
+
+
+def find_filtered_match(user_data: dict, search_filter: SearchFilter):
+    return filtered_pool.pop_entry(user_data, search_filter)
+
+
+def rematch_filtered(user_id: int):
+    return filtered_pool.rematch(user_id)
+
+
+def put_back_filtered(*entries: _Entry):
+    for entry in entries:
+        if filtered_pool.put_back(entry):
+            _record_waiting(entry)
+
+
+def cancel_filtered_waiting(user_id: int) -> bool:
+    session_journal.record_special_gone(user_id)
+    return filtered_pool.cancel(user_id)
+
+
+async def leave_filtered_waiting(*user_ids: int) -> bool:
+    """
+    خروج از صف جستجوی ویژه، از هر shardی
+
+    The pool is only on sharding.SPECIAL_SEARCH_SHARD, so the other shards
+    ask it. If it cannot be reached the entries stay behind; they are
+    dropped when someone matches them, since their users are busy by then.
+    """
+    if not sharding.forwards_special_search():
+        return any([cancel_filtered_waiting(user_id) for user_id in user_ids])
+
+    try:
+        return await sharding.peer(sharding.SPECIAL_SEARCH_SHARD).request("special_cancel", {
+            "user_ids": list(user_ids),
+        })
+    except (ConnectionError, sharding.ShardError) as e:
+        logger.warning("Special search cancel for %s not handed over: %s", user_ids, e)
+        return False
+
+
+def expire_filtered_waiting(before: float) -> list[dict]:
+    expired = filtered_pool.expire(before)
+    if expired:
+        session_journal.record_special_gone(*(user_data["id"] for user_data in expired))
+    return expired
+
+
+async def start():
+    """بازیابی صف جستجوی ویژه بعد از ری‌استارت، روی shardی که صف را نگه می‌دارد"""
+    if sharding.forwards_special_search():
+        return
+
+    restored = 0
+    for user_data, search_filter, enqueued_at in await session_journal.load_special():
+        # Someone who got into a chat meanwhile (through the other queue)
+        if await backend.is_busy(user_data["id"]):
+            session_journal.record_special_gone(user_data["id"])
+            continue
+        # The original enqueue time is kept, so downtime counts towards expiry
+        waited = time.time() - enqueued_at
+        filtered_pool.add(user_data, SearchFilter(**search_filter), time.monotonic() - waited)
+        restored += 1
+
+    print(f"♻️ {restored} کاربر در صف جستجوی ویژه بازیابی شد.")
+    await session_journal.start()
+
+
+async def stop():
+    await session_journal.stop()
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from app.config import (
+    FSM_CACHE_SIZE,
+    FSM_FLUSH_INTERVAL,
+    FSM_TTL,
+    FSM_SWEEP_INTERVAL
+)
+from app.database import read_db, write_db
+
+
+def _key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+def _dump(data: Dict[str, Any]) -> str | None:
+    if not data:
+        return None
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class _Entry:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: str | None, data: Dict[str, Any], touched: float):
+        self.state = state
+        self.data = data
+        self.touched = touched
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    ذخیره وضعیت FSM (ثبت‌نام، ویرایش پروفایل، ...) در همان فایل SQLite
+
+    - recently used states stay in a bounded LRU cache
+    - changes are written in batches every FSM_FLUSH_INTERVAL seconds
+    - states idle for longer than FSM_TTL are deleted by a sweeper, so
+      abandoned registrations do not pile up in memory or on disk
+    """
+
+    def __init__(self):
+        self._cache: OrderedDict[str, _Entry] = OrderedDict()
+        # Changed since the last flush / being written right now
+        self._dirty: dict[str, _Entry] = {}
+        self._flushing: dict[str, _Entry] = {}
+        self._task: asyncio.Task | None = None
+        self._last_sweep = time.monotonic()
+
+    # =========================
+    # کش
+    # =========================
+    async def _get(self, key: StorageKey) -> _Entry | None:
+        k = _key(key)
+
+        entry = self._dirty.get(k) or self._flushing.get(k) or self._cache.get(k)
+        if entry is not None:
+            if k in self._cache:
+                self._cache.move_to_end(k)
+            return None if entry.empty else entry
+
+        async with read_db() as db:
+            async with db.execute(
+                "SELECT state, data, updated_at FROM fsm_states WHERE key = ?",
+                (k,)
+            ) as cursor:
+                row = await cursor.fetchone()
+
+        # A write may have landed while we were reading
+        entry = self._dirty.get(k) or self._flushing.get(k) or self._cache.get(k)
+        if entry is None:
+            if row is None or row["updated_at"] < time.time() - FSM_TTL:
+                entry = _Entry(None, {}, time.time())
+            else:
+                entry = _Entry(
+                    row["state"],
+                    json.loads(row["data"]) if row["data"] else {},
+                    row["updated_at"]
+                )
+            self._remember(k, entry)
+
+        return None if entry.empty else entry
+
+    def _remember(self, k: str, entry: _Entry):
+        self._cache[k] = entry
+        self._cache.move_to_end(k)
+        while len(self._cache) > FSM_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def _put(self, key: StorageKey, state: str | None, data: Dict[str, Any]):
+        k = _key(key)
+        entry = _Entry(state, data, time.time())
+        self._remember(k, entry)
+        self._dirty[k] = entry
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    # =========================
+    # BaseStorage
+    # =========================
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._get(key)
+        if isinstance(state, State):
+            state = state.state
+        self._put(key, state, entry.data if entry else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._get(key)
+        return entry.state if entry else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._get(key)
+        self._put(key, entry.state if entry else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._get(key)
+        return entry.data.copy() if entry else {}
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # =========================
+    # نوشتن دسته‌ای و پاکسازی
+    # =========================
+    async def flush(self):
+        if not self._dirty:
+            return
+
+        self._flushing = self._dirty
+        self._dirty = {}
+
+        try:
+            async with write_db() as db:
+                await db.executemany(
+                    "DELETE FROM fsm_states WHERE key = ?",
+                    [(k,) for k, entry in self._flushing.items() if entry.empty]
+                )
+                await db.executemany(
+                    """
+                    INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    [
+                        (k, entry.state, _dump(entry.data), entry.touched)
+                        for k, entry in self._flushing.items() if not entry.empty
+                    ]
+                )
+        except Exception:
+            # Newer changes win over the batch that failed
+            for k, entry in self._flushing.items():
+                self._dirty.setdefault(k, entry)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def sweep(self):
+        """حذف وضعیت‌هایی که بیشتر از FSM_TTL بدون تغییر مانده‌اند"""
+        cutoff = time.time() - FSM_TTL
+
+        for k in [k for k, entry in self._cache.items() if entry.touched < cutoff]:
+            if k not in self._dirty:
+                del self._cache[k]
+
+        async with write_db() as db:
+            await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FSM_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+
+                if time.monotonic() - self._last_sweep > FSM_SWEEP_INTERVAL:
+                    self._last_sweep = time.monotonic()
+                    await self.sweep()
+            except Exception as e:
+                print(f"خطا در ذخیره وضعیت FSM: {e}")
@@ -1,25 +1,269 @@
-waiting_users = []
+import heapq
+import time
+from collections import deque
+from itertools import count
+
+
+class _Entry:
+    __slots__ = ("user_data", "key", "active", "enqueued_at", "n")
+
+    def __init__(self, user_data: dict, enqueued_at: float, n: int):
+        self.user_data = user_data
+        self.key = (user_data["gender"], user_data["target_gender"])
+        self.active = True
+        self.enqueued_at = enqueued_at
+        # Position of the entry in its bucket, counting every entry ever added
+        self.n = n
+
+
+class WaitingQueue:
+    """
+    صف انتظار، دسته‌بندی شده بر اساس (gender, target_gender)
+
+    Every bucket is a FIFO deque. Cancelled entries are only flagged and
+    get skipped when they reach the head of their bucket, so enqueue,
+    match, cancel and membership checks are all O(1) (amortised).
+
+    Entries are also kept in a min-heap on their enqueue time. Expiring
+    old entries pops from the heap, which costs O(log n) for each popped
+    entry, whether it expired or had already left the queue.
+    """
+
+    def __init__(self):
+        self._buckets: dict[tuple[str, str], deque[_Entry]] = {}
+        self._live: dict[tuple[str, str], int] = {}
+        self._index: dict[int, _Entry] = {}
+        # Per bucket: ordinal of the next entry, and of the current head
+        self._pushed: dict[tuple[str, str], int] = {}
+        self._head: dict[tuple[str, str], int] = {}
+        # (enqueued_at, tie-breaker, entry)
+        self._expiry: list[tuple[float, int, _Entry]] = []
+        self._ties = count()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._index
+
+    def add(self, user_data: dict, enqueued_at: float | None = None):
+        # A user is only ever waiting once, with their latest preference
+        self.cancel(user_data["id"])
+
+        key = (user_data["gender"], user_data["target_gender"])
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = deque()
+            self._live[key] = 0
+            self._pushed[key] = 0
+            self._head[key] = 0
+
+        entry = _Entry(user_data, enqueued_at or time.time(), self._pushed[key])
+        self._pushed[key] += 1
+
+        bucket.append(entry)
+        self._live[key] += 1
+        self._index[user_data["id"]] = entry
+        heapq.heappush(self._expiry, (entry.enqueued_at, next(self._ties), entry))
+
+        # Drop cancelled entries once they outnumber the live ones
+        if len(bucket) > 2 * self._live[key] + 64:
+            self._buckets[key] = deque(e for e in bucket if e.active)
+        if len(self._expiry) > 2 * len(self._index) + 64:
+            self._expiry = [item for item in self._expiry if item[2].active]
+            heapq.heapify(self._expiry)
+
+    def pop_entry(self, user_data: dict) -> _Entry | None:
+        # The searcher is re-queued by the caller if nothing is found, so
+        # drop any older entry of theirs first (and never match them with it)
+        self.cancel(user_data["id"])
+
+        # The complementary bucket: they are what we want, we are what they want
+        bucket = self._buckets.get((user_data["target_gender"], user_data["gender"]))
+
+        while bucket:
+            entry = bucket.popleft()
+            self._head[entry.key] = entry.n + 1
+            if entry.active:
+                entry.active = False
+                del self._index[entry.user_data["id"]]
+                self._live[entry.key] -= 1
+                return entry
+
+        return None
+
+    def pop_match(self, user_data: dict) -> dict | None:
+        entry = self.pop_entry(user_data)
+        return entry.user_data if entry else None
+
+    def push_front(self, entry: _Entry):
+        """برگرداندن یک ورودی برداشته‌شده به سر صف، با همان زمان ورود"""
+        user_id = entry.user_data["id"]
+        # They queued again meanwhile; the newer entry wins
+        if user_id in self._index:
+            return
+
+        key = entry.key
+        entry.active = True
+        self._buckets[key].appendleft(entry)
+        self._live[key] += 1
+        self._head[key] = min(self._head[key], entry.n)
+        self._index[user_id] = entry
+        heapq.heappush(self._expiry, (entry.enqueued_at, next(self._ties), entry))
+
+    def cancel(self, user_id: int) -> bool:
+        entry = self._index.pop(user_id, None)
+        if entry is None:
+            return False
+        entry.active = False
+        self._live[entry.key] -= 1
+        return True
+
+    def expire(self, before: float) -> list[dict]:
+        """حذف کاربرانی که قبل از ``before`` وارد صف شده‌اند"""
+        expired = []
+        while self._expiry and self._expiry[0][0] < before:
+            entry = heapq.heappop(self._expiry)[2]
+            if entry.active:
+                self.cancel(entry.user_data["id"])
+                expired.append(entry.user_data)
+        return expired
+
+    def position(self, user_id: int) -> int | None:
+        """
+        جایگاه تقریبی کاربر در صف (۱ یعنی نفر اول)
+
+        Counts the entries between the head of the bucket and the user,
+        including cancelled ones that have not reached the head yet, so it
+        can be too high but never exceeds the live size of the bucket.
+        """
+        entry = self._index.get(user_id)
+        if entry is None:
+            return None
+        return min(entry.n - self._head[entry.key] + 1, self._live[entry.key])
+
+    def bucket_sizes(self) -> dict[tuple[str, str], int]:
+        return dict(self._live)
+
+
+waiting_users = WaitingQueue()
 active_chats = {}
 
+# user_id -> partner_id while the coins for a new chat are being taken
+pairing = {}
+# user_id -> when their pairing was reserved
+_paired_at: dict[int, float] = {}
+# user_id -> their queue entry, for a partner taken from the queue into
+# a pairing; it goes back to the head of the queue if the pairing fails
+_held: dict[int, _Entry] = {}
+
 
 def is_in_chat(user_id: int) -> bool:
     return user_id in active_chats
 
 
+def is_busy(user_id: int) -> bool:
+    return user_id in active_chats or user_id in pairing
+
+
+def is_waiting(user_id: int) -> bool:
+    return user_id in waiting_users
+
+
 def add_to_waiting(user_data: dict):
-    waiting_users.append(user_data)
+    waiting_users.add(user_data)
+
+
+def expire_waiting(before: float) -> list[dict]:
+    return waiting_users.expire(before)
+
+
+def waiting_position(user_id: int) -> int | None:
+    return waiting_users.position(user_id)
 
 
 def find_match(user_data: dict):
-    for other in waiting_users:
-        if other["gender"] == user_data["target_gender"] and \
-           user_data["gender"] == other["target_gender"]:
-            waiting_users.remove(other)
-            return other
-    return None
+    return waiting_users.pop_match(user_data)
+
+
+def cancel_waiting(user_id: int) -> bool:
+    return waiting_users.cancel(user_id)
+
+
+def reserve(user1_id: int, user2_id: int) -> bool:
+    """رزرو دو کاربر برای یک چت جدید؛ اگر یکی مشغول باشد False"""
+    if user1_id == user2_id or is_busy(user1_id) or is_busy(user2_id):
+        return False
+    waiting_users.cancel(user1_id)
+    waiting_users.cancel(user2_id)
+    pairing[user1_id] = user2_id
+    pairing[user2_id] = user1_id
+    _paired_at[user1_id] = _paired_at[user2_id] = time.time()
+    return True
+
+
+def reserve_match(user_data: dict) -> dict | None:
+    """برداشتن مخاطب از صف و رزرو هر دو نفر"""
+    if is_busy(user_data["id"]):
+        return None
+
+    entry = waiting_users.pop_entry(user_data)
+    if entry is None:
+        return None
+
+    partner_id = entry.user_data["id"]
+    if not reserve(user_data["id"], partner_id):
+        # The partner is busy with another pairing; they keep their place
+        waiting_users.push_front(entry)
+        return None
+    _held[partner_id] = entry
+    return entry.user_data
+
+
+def confirm_pair(user1_id: int, user2_id: int) -> bool:
+    if pairing.get(user1_id) != user2_id:
+        return False
+    for user_id in (user1_id, user2_id):
+        del pairing[user_id]
+        del _paired_at[user_id]
+        _held.pop(user_id, None)
+    start_chat(user1_id, user2_id)
+    return True
+
+
+def release_pair(user1_id: int, user2_id: int, requeue: tuple = ()) -> bool:
+    if pairing.get(user1_id) != user2_id:
+        return False
+    for user_id in (user1_id, user2_id):
+        del pairing[user_id]
+        del _paired_at[user_id]
+        entry = _held.pop(user_id, None)
+        if entry is not None and user_id in requeue:
+            waiting_users.push_front(entry)
+    return True
+
+
+def release_stale_pairs(before: float) -> list[int]:
+    """
+    لغو رزروهایی که قبل از ``before`` انجام شده و هنوز تمام نشده‌اند
+
+    Users taken from the queue go back to its head; the ids of the
+    others are returned. Only pairings in progress are looked at.
+    """
+    stale = [user_id for user_id, since in _paired_at.items() if since < before]
+    released = []
+    for user_id in stale:
+        partner_id = pairing.get(user_id)
+        if partner_id is None:
+            continue
+        release_pair(user_id, partner_id, (user_id, partner_id))
+        released += [u for u in (user_id, partner_id) if u not in waiting_users]
+    return released
 
 
 def start_chat(user1_id: int, user2_id: int):
+    waiting_users.cancel(user1_id)
+    waiting_users.cancel(user2_id)
     active_chats[user1_id] = user2_id
     active_chats[user2_id] = user1_id
 
@@ -1,44 +1,216 @@
+import asyncio
+import logging
+import random
+import time
+
 import aiohttp
 from app.config import (
     ZARINPAL_MERCHANT_ID,
     ZARINPAL_REQUEST_URL,
     ZARINPAL_VERIFY_URL,
+    ZARINPAL_START_PAY_URL,
+    ZARINPAL_POOL_SIZE,
+    ZARINPAL_CONNECT_TIMEOUT,
+    ZARINPAL_READ_TIMEOUT,
+    ZARINPAL_VERIFY_RETRIES,
+    ZARINPAL_BREAKER_THRESHOLD,
+    ZARINPAL_BREAKER_RESET,
     CALLBACK_URL
 )
+from app import metrics
 
+logger = logging.getLogger(__name__)
+
+# Zarinpal result codes: 100 = paid, 101 = already verified before
+CODE_OK = 100
+CODE_ALREADY_VERIFIED = 101
+
+
+class GatewayError(Exception):
+    """درگاه در دسترس نیست یا پاسخ معتبری نداد (نتیجه پرداخت نامعلوم است)"""
+
+
+class CircuitBreaker:
+    """
+    قطع موقت تماس با درگاه بعد از چند خطای پشت‌سرهم
+
+    While open, calls fail immediately instead of each handler waiting out
+    its own timeout. After ``reset_timeout`` one trial call is let through;
+    its result closes the breaker again or keeps it open.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """فراخوانی بدون نتیجه (مثلاً لغوشده)؛ فراخوانی بعدی آزمایش را انجام دهد"""
+        self._trial = False
 
-async def create_payment(amount: int, description: str):
-    data = {
-        "merchant_id": ZARINPAL_MERCHANT_ID,
-        "amount": amount,
-        "description": description,
-        "callback_url": CALLBACK_URL
-    }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(ZARINPAL_REQUEST_URL, json=data) as resp:
-            result = await resp.json()
+class ZarinpalClient:
+    """
+    کلاینت مشترک درگاه زرین‌پال
 
-    if result.get("data") and result["data"]["code"] == 100:
-        authority = result["data"]["authority"]
-        pay_url = f"https://www.zarinpal.com/pg/StartPay/{authority}"
-        return authority, pay_url
+    One aiohttp session (pooled keep-alive connections) for the whole
+    process; open it lazily and close it on shutdown with ``close()``.
+    """
 
-    return None, None
+    def __init__(
+        self,
+        request_url: str = ZARINPAL_REQUEST_URL,
+        verify_url: str = ZARINPAL_VERIFY_URL,
+        merchant_id: str = ZARINPAL_MERCHANT_ID,
+        verify_retries: int = ZARINPAL_VERIFY_RETRIES
+    ):
+        self.request_url = request_url
+        self.verify_url = verify_url
+        self.merchant_id = merchant_id
+        self.verify_retries = verify_retries
+        self.breaker = CircuitBreaker(ZARINPAL_BREAKER_THRESHOLD, ZARINPAL_BREAKER_RESET)
+        self._session: aiohttp.ClientSession | None = None
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=ZARINPAL_POOL_SIZE,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=30
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=ZARINPAL_CONNECT_TIMEOUT + ZARINPAL_READ_TIMEOUT,
+                    connect=ZARINPAL_CONNECT_TIMEOUT,
+                    sock_read=ZARINPAL_READ_TIMEOUT
+                )
+            )
+        return self._session
 
-async def verify_payment(authority: str, amount: int):
-    data = {
-        "merchant_id": ZARINPAL_MERCHANT_ID,
-        "authority": authority,
-        "amount": amount
-    }
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(ZARINPAL_VERIFY_URL, json=data) as resp:
-            result = await resp.json()
+    async def _post(self, url: str, data: dict) -> dict:
+        if not self.breaker.allow():
+            raise GatewayError("circuit open")
+
+        started = time.perf_counter()
+        try:
+            async with self._get_session().post(url, json=data) as resp:
+                if resp.status >= 500:
+                    raise GatewayError(f"HTTP {resp.status}")
+                # Errors come back as 4xx with a JSON body, which still
+                # counts as a working gateway
+                result = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.breaker.failure()
+            raise GatewayError(str(e) or type(e).__name__) from e
+        except GatewayError:
+            self.breaker.failure()
+            raise
+        except BaseException:
+            # Cancelled, or a bug on our side: says nothing about the
+            # gateway, but must not leave the half-open trial taken
+            self.breaker.abandon()
+            raise
+        finally:
+            metrics.gateway_seconds.observe(
+                time.perf_counter() - started,
+                "verify" if url == self.verify_url else "request"
+            )
+
+        self.breaker.success()
+        return result if isinstance(result, dict) else {}
+
+    # =========================
+    # API
+    # =========================
+    async def create_payment(self, amount: int, description: str):
+        # Not retried: a second request would open a second payment
+        try:
+            result = await self._post(self.request_url, {
+                "merchant_id": self.merchant_id,
+                "amount": amount,
+                "description": description,
+                "callback_url": CALLBACK_URL
+            })
+        except GatewayError as e:
+            logger.warning("Zarinpal request failed: %s", e)
+            return None, None
+
+        data = result.get("data")
+        if data and data.get("code") == CODE_OK:
+            authority = data["authority"]
+            return authority, f"{ZARINPAL_START_PAY_URL}{authority}"
+
+        return None, None
+
+    async def verify_payment(self, authority: str, amount: int) -> bool:
+        """
+        تایید پرداخت؛ True/False برای پاسخ قطعی درگاه
+
+        Verify is idempotent, so transport failures are retried with
+        jittered back-off. If no definite answer is received GatewayError
+        is raised and the payment must stay pending.
+        """
+        payload = {
+            "merchant_id": self.merchant_id,
+            "authority": authority,
+            "amount": amount
+        }
+
+        attempts = max(self.verify_retries, 1)
+        for attempt in range(attempts):
+            try:
+                result = await self._post(self.verify_url, payload)
+                break
+            except GatewayError:
+                if attempt + 1 >= attempts or self.breaker.state == "open":
+                    raise
+                await asyncio.sleep(random.uniform(0, 0.5 * 2 ** attempt))
+
+        data = result.get("data")
+        return bool(data) and data.get("code") in (CODE_OK, CODE_ALREADY_VERIFIED)
+
+
+zarinpal = ZarinpalClient()
+
+
+async def create_payment(amount: int, description: str):
+    return await zarinpal.create_payment(amount, description)
 
-    if result.get("data") and result["data"]["code"] == 100:
-        return True
 
-    return False
+async def verify_payment(authority: str, amount: int) -> bool:
+    return await zarinpal.verify_payment(authority, amount)
@@ -0,0 +1,198 @@
+"""
+پروفایلر نمونه‌برداری برای پروسه‌ی در حال اجرا
+
+While a session is running, a SIGPROF timer fires every PROFILE_INTERVAL
+seconds of CPU time. Its handler runs on the main thread, which is the
+event loop thread, so it sees exactly the frame that was executing. A
+sampling thread would mostly land while the loop sits in select(),
+because that is when the loop releases the GIL.
+
+- Loop samples taken inside a profiled update are kept and grouped under
+  that update's handler. Only a PROFILE_SAMPLE_RATE fraction of updates
+  is profiled.
+- Those samples include time spent in aiogram's filters before the
+  handler was chosen.
+- aiosqlite worker threads are sampled by a helper thread every
+  PROFILE_INTERVAL seconds of wall-clock time. Samples taken while a
+  worker is running a statement are recorded under their own label.
+
+The output is in collapsed-stack format, one "label;frame;...;frame count"
+line per stack, which flamegraph.pl and speedscope read directly.
+"""
+import asyncio
+import linecache
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from app.config import (
+    PROFILE_SAMPLE_RATE,
+    PROFILE_INTERVAL,
+    PROFILE_DURATION,
+    PROFILE_MAX_DURATION,
+    PROFILE_DIR
+)
+
+logger = logging.getLogger(__name__)
+
+# Frame of a running profiled update -> its probe ({"handler": ..., "stacks": [...]})
+_probes: dict = {}
+
+# label -> collapsed stack -> samples
+_stacks: dict[str, Counter] = {}
+
+_until = 0.0
+_fraction = 0.0
+_session: asyncio.Task | None = None
+
+# Where a task's own frames start on the loop thread's stack
+_TASK_STEP = "asyncio.events:_run"
+
+
+def should_sample() -> bool:
+    """آیا این آپدیت پروفایل شود؛ وقتی پروفایلر خاموش است فقط یک مقایسه"""
+    return _until > time.monotonic() and random.random() < _fraction
+
+
+async def run_profiled(handler, event, data: dict, probe: dict):
+    # The sampler recognises this frame on the loop thread's stack
+    frame = sys._getframe()
+    _probes[frame] = probe
+    try:
+        return await handler(event, data)
+    finally:
+        del _probes[frame]
+        stacks = _stacks.setdefault(probe["handler"], Counter())
+        for stack in probe["stacks"]:
+            stacks[stack] += 1
+
+
+# =========================
+# نمونه‌برداری
+# =========================
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{code.co_name}"
+
+
+def _idle(frame) -> bool:
+    # A worker thread blocked in a C call (queue get, lock wait) shows the
+    # line that made the call as its innermost frame
+    line = linecache.getline(frame.f_code.co_filename, frame.f_lineno)
+    return ".get(" in line or ".wait(" in line
+
+
+def _on_signal(signum, frame):
+    names = []
+    probe = None
+    while frame is not None:
+        if probe is None:
+            probe = _probes.get(frame)
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+
+    if probe is not None:
+        names.reverse()
+        # Drop the event loop's own frames above the running task
+        if _TASK_STEP in names:
+            del names[:len(names) - names[::-1].index(_TASK_STEP)]
+        probe["stacks"].append(";".join(names))
+
+
+def _sample_threads(skip: tuple):
+    for thread_id, frame in sys._current_frames().items():
+        if thread_id in skip or "aiosqlite" not in frame.f_globals.get("__name__", ""):
+            continue
+        if _idle(frame):
+            continue
+
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        stacks = _stacks.setdefault("(aiosqlite)", Counter())
+        stacks[";".join(reversed(names))] += 1
+
+
+def _sampler(loop_thread: int, stop: threading.Event):
+    # sqlite3 releases the GIL while a statement runs, so a plain thread
+    # can catch the workers busy; wall-clock time, unlike the loop samples
+    skip = (loop_thread, threading.get_ident())
+    while not stop.wait(PROFILE_INTERVAL):
+        try:
+            _sample_threads(skip)
+        except Exception as e:
+            logger.debug("Profiler sample failed: %s", e)
+
+
+def _dump() -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+    with open(path, "w", encoding="utf-8") as f:
+        for label, stacks in sorted(_stacks.items()):
+            for stack, count in stacks.most_common():
+                f.write(f"{label};{stack} {count}\n")
+    return path
+
+
+async def _run(duration: float, on_done):
+    global _until
+    previous = signal.signal(signal.SIGPROF, _on_signal)
+    signal.setitimer(signal.ITIMER_PROF, PROFILE_INTERVAL, PROFILE_INTERVAL)
+
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_sampler, args=(threading.get_ident(), stop),
+        name="profiler", daemon=True
+    )
+    thread.start()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        _until = 0.0
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+        stop.set()
+        await asyncio.to_thread(thread.join)
+
+        path = _dump()
+        samples = sum(sum(stacks.values()) for stacks in _stacks.values())
+        logger.info("Profile written to %s (%s samples)", path, samples)
+
+    if on_done is not None:
+        try:
+            await on_done(path, samples)
+        except Exception as e:
+            logger.warning("Profile callback failed: %s", e)
+
+
+def start(duration: float | None = None, fraction: float | None = None, on_done=None) -> bool:
+    """
+    شروع یک دوره‌ی پروفایل؛ اگر دوره‌ای در جریان باشد False
+
+    Profiling turns itself off after ``duration`` seconds (capped at
+    PROFILE_MAX_DURATION) and writes the stacks to PROFILE_DIR;
+    ``on_done(path, samples)`` is awaited afterwards.
+    """
+    global _until, _fraction, _session
+
+    if _session is not None and not _session.done():
+        return False
+
+    # The handler must run on the loop thread, which is the main thread
+    if not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        logger.warning("Profiler needs SIGPROF on the main thread; not started")
+        return False
+
+    duration = min(duration or PROFILE_DURATION, PROFILE_MAX_DURATION)
+    _fraction = PROFILE_SAMPLE_RATE if fraction is None else min(max(fraction, 0.0), 1.0)
+    _stacks.clear()
+    _until = time.monotonic() + duration
+    _session = asyncio.create_task(_run(duration, on_done))
+    return True
@@ -0,0 +1,144 @@
+import asyncio
+import heapq
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+from app.config import WAITING_TTL, WAITING_PING_INTERVAL, WAITING_SWEEP_INTERVAL, PAIRING_TIMEOUT
+from app.services.state import backend
+from app.services.sender import outbox
+from app.services.filtered_matcher import (
+    expire_filtered_waiting, leave_filtered_waiting, filtered_waiting_status
+)
+from app.keyboards.main import main_keyboard
+
+# user_id -> when the next "still searching" message is due. The heap
+# holds (due, user_id); items whose due no longer matches are skipped.
+# Pings are sent by the process that queued the user, with any backend.
+_pings: dict[int, float] = {}
+_due: list[tuple[float, int]] = []
+
+_bot: Bot | None = None
+_sweep_task: asyncio.Task | None = None
+# Queue cancellations started from send callbacks, kept until they finish
+_cancels: set[asyncio.Task] = set()
+
+
+def track(user_id: int):
+    """برنامه‌ریزی پیام «هنوز در حال جستجو» برای کاربری که تازه وارد صف شده"""
+    if WAITING_PING_INTERVAL <= 0:
+        return
+    due = time.time() + WAITING_PING_INTERVAL
+    _pings[user_id] = due
+    heapq.heappush(_due, (due, user_id))
+
+
+async def _cancel(user_id: int):
+    await leave_filtered_waiting(user_id)
+    try:
+        await backend.cancel_waiting(user_id)
+    except Exception as e:
+        print(f"خطا در لغو جستجوی کاربر {user_id}: {e}")
+
+
+def _on_sent(user_id: int):
+    def done(future: asyncio.Future):
+        # A user who blocked the bot will never see a match either
+        if not future.cancelled() and isinstance(future.exception(), TelegramForbiddenError):
+            _pings.pop(user_id, None)
+            task = asyncio.create_task(_cancel(user_id))
+            _cancels.add(task)
+            task.add_done_callback(_cancels.discard)
+    return done
+
+
+# =========================
+# انقضا و پیام‌ها
+# =========================
+async def sweep():
+    now = time.time()
+
+    if PAIRING_TIMEOUT > 0:
+        for user_id in await backend.release_stale_pairs(now - PAIRING_TIMEOUT):
+            outbox.send_message(
+                _bot,
+                user_id,
+                "❌ اتصال به مخاطب کامل نشد.\n\n"
+                "لطفاً دوباره جستجو کنید.",
+                reply_markup=main_keyboard
+            )
+
+    if WAITING_TTL > 0:
+        expired = await backend.expire_waiting(now - WAITING_TTL)
+        expired += [
+            user_data["id"]
+            for user_data in expire_filtered_waiting(time.monotonic() - WAITING_TTL)
+        ]
+        for user_id in expired:
+            _pings.pop(user_id, None)
+            outbox.send_message(
+                _bot,
+                user_id,
+                "⌛ مخاطبی پیدا نشد و جستجو متوقف شد.\n\n"
+                "می‌توانید دوباره جستجو کنید.",
+                reply_markup=main_keyboard
+            )
+
+    while _due and _due[0][0] <= now:
+        due, user_id = heapq.heappop(_due)
+        if _pings.get(user_id) != due:
+            continue
+
+        position = await backend.waiting_position(user_id)
+        if position is not None:
+            text = (
+                "⏳ هنوز در حال جستجوی مخاطب هستیم...\n\n"
+                f"👥 جایگاه شما در صف: {position}"
+            )
+        elif (status := filtered_waiting_status(user_id)) is not None:
+            # The special-search pool has no order, so its size is reported
+            waiting, widened = status
+            text = (
+                "⏳ هنوز در حال جستجوی مخاطب با فیلترهای شما هستیم...\n\n"
+                f"👥 کاربران در صف جستجوی ویژه: {waiting}"
+            )
+            if widened:
+                text += "\n🔓 فیلترهای شما بازتر شده‌اند."
+        else:
+            del _pings[user_id]
+            continue
+
+        _pings[user_id] = due + WAITING_PING_INTERVAL
+        heapq.heappush(_due, (due + WAITING_PING_INTERVAL, user_id))
+        outbox.send_message(_bot, user_id, text).add_done_callback(_on_sent(user_id))
+
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(WAITING_SWEEP_INTERVAL)
+        try:
+            await sweep()
+        except Exception as e:
+            print(f"خطا در بررسی صف انتظار: {e}")
+
+
+async def start(bot: Bot):
+    global _bot, _sweep_task
+    _bot = bot
+    if _sweep_task is None:
+        _sweep_task = asyncio.create_task(_sweep_loop())
+
+
+async def stop():
+    global _sweep_task
+    if _sweep_task is not None:
+        _sweep_task.cancel()
+        try:
+            await _sweep_task
+        except asyncio.CancelledError:
+            pass
+        _sweep_task = None
+
+    if _cancels:
+        await asyncio.gather(*_cancels, return_exceptions=True)
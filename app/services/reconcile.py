@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import fcntl
+import logging
+import time
+
+from app.config import (
+    RECONCILE_INTERVAL,
+    RECONCILE_MIN_AGE,
+    RECONCILE_EXPIRE_AFTER,
+    RECONCILE_CLAIM_TIMEOUT,
+    RECONCILE_LOCK_FILE,
+    RECONCILE_BATCH,
+    RECONCILE_CONCURRENCY
+)
+from app.database import read_db, write_db
+from app.services.settlement import (
+    settle_payment,
+    SETTLED,
+    REJECTED,
+    UNKNOWN
+)
+
+logger = logging.getLogger(__name__)
+
+stats = {
+    "runs": 0,
+    "scanned": 0,
+    "settled": 0,
+    "rejected": 0,
+    "handled": 0,
+    "unknown": 0,
+    "expired": 0,
+    "errors": 0,
+    "last_run_at": 0.0,
+    "last_run_seconds": 0.0,
+    "last_run_per_second": 0.0,
+}
+
+_task: asyncio.Task | None = None
+_lock_file = None
+
+
+# =========================
+# خواندن دسته‌ای پرداخت‌های معلق
+# =========================
+async def _release_stuck_claims():
+    # A claim older than any gateway call (with its retries) belongs to a
+    # settlement that died before finishing; a live one is never touched,
+    # so only one caller at a time talks to the gateway about a payment.
+    async with write_db() as db:
+        await db.execute(
+            """
+            UPDATE payments SET status = 'pending'
+            WHERE status = 'verifying'
+              AND claimed_at < datetime('now', ?)
+            """,
+            (f"-{RECONCILE_CLAIM_TIMEOUT} seconds",)
+        )
+
+
+async def _stale_batches(batch_size: int):
+    """پرداخت‌های pending قدیمی، به ترتیب id و صفحه به صفحه (keyset)"""
+    last_id = 0
+    while True:
+        async with read_db() as db:
+            async with db.execute(
+                """
+                SELECT id, authority, created_at < datetime('now', ?) AS hopeless
+                FROM payments
+                WHERE status = 'pending'
+                  AND id > ?
+                  AND created_at < datetime('now', ?)
+                ORDER BY id
+                LIMIT ?
+                """,
+                (
+                    f"-{RECONCILE_EXPIRE_AFTER} seconds",
+                    last_id,
+                    f"-{RECONCILE_MIN_AGE} seconds",
+                    batch_size
+                )
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+        if not rows:
+            return
+
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+async def _expire(authority: str):
+    async with write_db() as db:
+        cursor = await db.execute(
+            "UPDATE payments SET status = 'expired' WHERE authority = ? AND status = 'pending'",
+            (authority,)
+        )
+    if cursor.rowcount == 1:
+        stats["expired"] += 1
+
+
+async def _reconcile_one(authority: str, hopeless: bool):
+    try:
+        result = await settle_payment(authority)
+        if result == SETTLED:
+            stats["settled"] += 1
+        elif result == REJECTED:
+            stats["rejected"] += 1
+        elif result == UNKNOWN:
+            stats["unknown"] += 1
+        else:
+            stats["handled"] += 1
+
+        if result == UNKNOWN and hopeless:
+            await _expire(authority)
+    except Exception as e:
+        stats["errors"] += 1
+        logger.warning("Reconciling %s failed: %s", authority, e)
+
+
+# =========================
+# اجرای یک دور
+# =========================
+async def reconcile_once(
+    batch_size: int = RECONCILE_BATCH,
+    concurrency: int = RECONCILE_CONCURRENCY
+) -> int:
+    """
+    بررسی دوباره تمام پرداخت‌های معلق قدیمی
+
+    Rows are streamed page by page while at most ``concurrency`` gateway
+    calls are in flight; each one goes through settle_payment, the same
+    path the callback uses. Returns the number of payments looked at.
+    """
+    started = time.monotonic()
+    slots = asyncio.Semaphore(concurrency)
+    running: set[asyncio.Task] = set()
+    scanned = 0
+
+    async def run(authority: str, hopeless: bool):
+        try:
+            await _reconcile_one(authority, hopeless)
+        finally:
+            slots.release()
+
+    await _release_stuck_claims()
+
+    async for rows in _stale_batches(batch_size):
+        for row in rows:
+            await slots.acquire()
+            task = asyncio.create_task(run(row["authority"], bool(row["hopeless"])))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            scanned += 1
+            stats["scanned"] += 1
+
+    if running:
+        await asyncio.gather(*running)
+
+    elapsed = time.monotonic() - started
+    stats["runs"] += 1
+    stats["last_run_at"] = time.time()
+    stats["last_run_seconds"] = elapsed
+    stats["last_run_per_second"] = scanned / elapsed if elapsed else 0.0
+    return scanned
+
+
+def _take_lock() -> bool:
+    """
+    قفل اجرای حلقه، بین تمام پروسه‌ها
+
+    Every uvicorn worker of the payment API starts the loop, but only the
+    one holding the lock runs it. The others keep trying, so one of them
+    takes over when the holder exits; the OS drops the lock of a process
+    that died.
+    """
+    global _lock_file
+    if _lock_file is not None:
+        return True
+
+    lock_file = open(RECONCILE_LOCK_FILE, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+
+def _release_lock():
+    global _lock_file
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
+
+
+async def _loop(interval: float):
+    while True:
+        if not _take_lock():
+            await asyncio.sleep(interval)
+            continue
+        try:
+            scanned = await reconcile_once()
+            if scanned:
+                logger.info("Reconciled %s pending payments", scanned)
+        except Exception as e:
+            logger.exception("Reconciliation run failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+def start(interval: float = RECONCILE_INTERVAL):
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_loop(interval))
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    _release_lock()
+
+
+# =========================
+# اجرای مستقل
+# =========================
+async def _main(once: bool):
+    from app.database import open_db, close_db
+    from app.services.payments import zarinpal
+
+    await open_db()
+    try:
+        if once:
+            await reconcile_once()
+        else:
+            await _loop(RECONCILE_INTERVAL)
+    finally:
+        _release_lock()
+        await zarinpal.close()
+        await close_db()
+        print(stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="تایید دوباره پرداخت‌های معلق")
+    parser.add_argument("--once", action="store_true", help="یک دور اجرا و خروج")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args.once))
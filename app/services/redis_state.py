@@ -0,0 +1,419 @@
+import json
+import time
+import uuid
+
+from app.config import REDIS_URL, REDIS_PREFIX
+from app.services.state import StateBackend
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:  # pragma: no cover - only needed with STATE_BACKEND=redis
+    aioredis = None
+
+
+# =========================
+# Lua scripts
+# =========================
+# Every script runs atomically on the server, which is what keeps several
+# bot processes from pairing the same user twice.
+#
+# Layout (all keys under REDIS_PREFIX):
+#   waiting          hash  user_id -> entry json (with a random token)
+#   waiting_count    hash  "gender:target_gender" -> live entries
+#   wait:<g>:<t>     list  "user_id:token", FIFO per bucket
+#   waiting:<g>:<t>  zset  user_id scored by enqueue time, per bucket
+#   chats            hash  user_id -> partner_id
+#   pairing          hash  user_id -> partner_id, while coins are taken
+#   pairing_since    zset  user_id scored by when the pair was reserved
+#   held             hash  user_id -> {entry, since} of a partner taken
+#                          from the queue into a pairing
+#
+# Every way out of the queue (cancel, expiry, a reservation) removes the
+# entry from its list too, so the lists only hold live entries and a
+# match never pops through a backlog of dead ones. An entry whose token
+# no longer matches the one in ``waiting`` is still skipped when popped.
+# The sorted sets give the queue position and let expiry read only the
+# entries that are old enough. Bucket list and sorted set names are
+# derived from the ``waiting`` key inside the scripts, which is fine on
+# a single server but not on a Redis Cluster.
+
+# ``popped``: the caller has already taken the item off its list
+_DROP = """
+local function drop(waiting, counts, uid, popped)
+    local old = redis.call('HGET', waiting, uid)
+    if not old then
+        return 0
+    end
+    local e = cjson.decode(old)
+    local field = e.gender .. ':' .. e.target_gender
+    redis.call('HDEL', waiting, uid)
+    redis.call('HINCRBY', counts, field, -1)
+    redis.call('ZREM', waiting .. ':' .. field, uid)
+    if not popped then
+        local prefix = string.sub(waiting, 1, -string.len('waiting') - 1)
+        redis.call('LREM', prefix .. 'wait:' .. field, 1, uid .. ':' .. e.token)
+    end
+    return 1
+end
+"""
+
+# Back to the head of their bucket, unless they queued again meanwhile;
+# returns 1 if the user is in the queue afterwards
+_UNHOLD = """
+local function unhold(held, waiting, counts, prefix, uid, requeue)
+    local h = redis.call('HGET', held, uid)
+    redis.call('HDEL', held, uid)
+    if redis.call('HEXISTS', waiting, uid) == 1 then
+        return 1
+    end
+    if not (h and requeue) then
+        return 0
+    end
+    h = cjson.decode(h)
+    local e = cjson.decode(h.entry)
+    local field = e.gender .. ':' .. e.target_gender
+    redis.call('LPUSH', prefix .. field, uid .. ':' .. e.token)
+    redis.call('HSET', waiting, uid, h.entry)
+    redis.call('HINCRBY', counts, field, 1)
+    redis.call('ZADD', waiting .. ':' .. field, h.since, uid)
+    return 1
+end
+"""
+
+# KEYS: own bucket, waiting, counts
+# ARGV: user_id, entry, token, bucket field, enqueue time
+_ADD = _DROP + """
+drop(KEYS[2], KEYS[3], ARGV[1])
+redis.call('RPUSH', KEYS[1], ARGV[1] .. ':' .. ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('HINCRBY', KEYS[3], ARGV[4], 1)
+redis.call('ZADD', KEYS[2] .. ':' .. ARGV[4], ARGV[5], ARGV[1])
+return 1
+"""
+
+# KEYS: waiting, counts    ARGV: user_id
+_CANCEL = _DROP + """
+return drop(KEYS[1], KEYS[2], ARGV[1])
+"""
+
+# KEYS: their bucket, own bucket, waiting, counts, chats, pairing, held,
+#       pairing_since
+# ARGV: user_id, entry, token, own bucket field, enqueue time
+# Returns the partner's entry, false once queued, or 0 if the user is busy
+_MATCH_OR_WAIT = _DROP + """
+if redis.call('HEXISTS', KEYS[5], ARGV[1]) == 1 or redis.call('HEXISTS', KEYS[6], ARGV[1]) == 1 then
+    return 0
+end
+
+drop(KEYS[3], KEYS[4], ARGV[1])
+
+while true do
+    local item = redis.call('LPOP', KEYS[1])
+    if not item then
+        break
+    end
+    local sep = string.find(item, ':', 1, true)
+    local other = string.sub(item, 1, sep - 1)
+    local entry = redis.call('HGET', KEYS[3], other)
+    local e = entry and cjson.decode(entry)
+    if e and e.token == string.sub(item, sep + 1) then
+        local field = e.gender .. ':' .. e.target_gender
+        local since = redis.call('ZSCORE', KEYS[3] .. ':' .. field, other) or ARGV[5]
+        drop(KEYS[3], KEYS[4], other, true)
+        redis.call('HSET', KEYS[6], ARGV[1], other, other, ARGV[1])
+        redis.call('ZADD', KEYS[8], ARGV[5], ARGV[1], ARGV[5], other)
+        redis.call('HSET', KEYS[7], other, cjson.encode({entry = entry, since = since}))
+        return entry
+    end
+end
+
+redis.call('RPUSH', KEYS[2], ARGV[1] .. ':' .. ARGV[3])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[2])
+redis.call('HINCRBY', KEYS[4], ARGV[4], 1)
+redis.call('ZADD', KEYS[3] .. ':' .. ARGV[4], ARGV[5], ARGV[1])
+return false
+"""
+
+# KEYS: waiting, counts    ARGV: enqueued before, max entries per bucket
+_EXPIRE = _DROP + """
+local expired = {}
+for _, field in ipairs(redis.call('HKEYS', KEYS[2])) do
+    local since = KEYS[1] .. ':' .. field
+    local old = redis.call('ZRANGEBYSCORE', since, '-inf', '(' .. ARGV[1], 'LIMIT', 0, ARGV[2])
+    for _, uid in ipairs(old) do
+        drop(KEYS[1], KEYS[2], uid)
+        redis.call('ZREM', since, uid)
+        table.insert(expired, uid)
+    end
+end
+return expired
+"""
+
+# KEYS: waiting    ARGV: user_id
+_POSITION = """
+local entry = redis.call('HGET', KEYS[1], ARGV[1])
+if not entry then
+    return false
+end
+local e = cjson.decode(entry)
+local since = KEYS[1] .. ':' .. e.gender .. ':' .. e.target_gender
+local score = redis.call('ZSCORE', since, ARGV[1])
+if not score then
+    return false
+end
+return redis.call('ZCOUNT', since, '-inf', score)
+"""
+
+# KEYS: waiting, counts, chats, pairing, pairing_since
+# ARGV: user1_id, user2_id, now
+_RESERVE = _DROP + """
+if ARGV[1] == ARGV[2] then
+    return 0
+end
+for i = 1, 2 do
+    if redis.call('HEXISTS', KEYS[3], ARGV[i]) == 1 or redis.call('HEXISTS', KEYS[4], ARGV[i]) == 1 then
+        return 0
+    end
+end
+drop(KEYS[1], KEYS[2], ARGV[1])
+drop(KEYS[1], KEYS[2], ARGV[2])
+redis.call('HSET', KEYS[4], ARGV[1], ARGV[2], ARGV[2], ARGV[1])
+redis.call('ZADD', KEYS[5], ARGV[3], ARGV[1], ARGV[3], ARGV[2])
+return 1
+"""
+
+# KEYS: pairing, held, chats, pairing_since    ARGV: user1_id, user2_id
+_CONFIRM = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HDEL', KEYS[2], ARGV[1], ARGV[2])
+redis.call('ZREM', KEYS[4], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[2], ARGV[2], ARGV[1])
+return 1
+"""
+
+# KEYS: pairing, held, waiting, counts, pairing_since
+# ARGV: bucket key prefix, user1_id, requeue user1 (0/1), user2_id, requeue user2
+_RELEASE = _UNHOLD + """
+if redis.call('HGET', KEYS[1], ARGV[2]) ~= ARGV[4] then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[2], ARGV[4])
+redis.call('ZREM', KEYS[5], ARGV[2], ARGV[4])
+
+for i = 2, 4, 2 do
+    unhold(KEYS[2], KEYS[3], KEYS[4], ARGV[1], ARGV[i], ARGV[i + 1] == '1')
+end
+return 1
+"""
+
+# KEYS: pairing, held, waiting, counts, pairing_since
+# ARGV: bucket key prefix, reserved before, max entries
+# Users taken from the queue go back to it; the others are returned
+_RELEASE_STALE = _UNHOLD + """
+local released = {}
+local old = redis.call('ZRANGEBYSCORE', KEYS[5], '-inf', '(' .. ARGV[2], 'LIMIT', 0, ARGV[3])
+for _, uid in ipairs(old) do
+    redis.call('ZREM', KEYS[5], uid)
+    local partner = redis.call('HGET', KEYS[1], uid)
+    if partner and redis.call('HGET', KEYS[1], partner) == uid then
+        redis.call('HDEL', KEYS[1], uid, partner)
+        redis.call('ZREM', KEYS[5], partner)
+        for _, u in ipairs({uid, partner}) do
+            if unhold(KEYS[2], KEYS[3], KEYS[4], ARGV[1], u, true) == 0 then
+                table.insert(released, u)
+            end
+        end
+    end
+end
+return {#old, released}
+"""
+
+# KEYS: waiting, counts, chats    ARGV: user1_id, user2_id
+_START_CHAT = _DROP + """
+drop(KEYS[1], KEYS[2], ARGV[1])
+drop(KEYS[1], KEYS[2], ARGV[2])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[2], ARGV[2], ARGV[1])
+return 1
+"""
+
+# KEYS: chats    ARGV: user_id
+_END_CHAT = """
+local partner = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[1], ARGV[1])
+if partner and redis.call('HGET', KEYS[1], partner) == ARGV[1] then
+    redis.call('HDEL', KEYS[1], partner)
+end
+return partner
+"""
+
+
+class RedisBackend(StateBackend):
+    """
+    وضعیت مشترک بین چند پروسه، روی هر سروری که پروتکل Redis را بفهمد
+
+    ``client`` can be any redis.asyncio-compatible client (for example a
+    fakeredis one in local runs); by default one is built from REDIS_URL.
+    """
+
+    def __init__(self, client=None, prefix: str = REDIS_PREFIX):
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("STATE_BACKEND=redis needs the 'redis' package")
+            client = aioredis.from_url(REDIS_URL, decode_responses=True)
+
+        self._redis = client
+        self._prefix = prefix
+
+        self._waiting = f"{prefix}waiting"
+        self._counts = f"{prefix}waiting_count"
+        self._chats = f"{prefix}chats"
+        self._pairing = f"{prefix}pairing"
+        self._pairing_since = f"{prefix}pairing_since"
+        self._held = f"{prefix}held"
+
+        self._add = client.register_script(_ADD)
+        self._cancel = client.register_script(_CANCEL)
+        self._match_or_wait = client.register_script(_MATCH_OR_WAIT)
+        self._reserve = client.register_script(_RESERVE)
+        self._confirm = client.register_script(_CONFIRM)
+        self._release = client.register_script(_RELEASE)
+        self._release_stale = client.register_script(_RELEASE_STALE)
+        self._start_chat = client.register_script(_START_CHAT)
+        self._end_chat = client.register_script(_END_CHAT)
+        self._expire = client.register_script(_EXPIRE)
+        self._position = client.register_script(_POSITION)
+
+    def _bucket(self, gender: str, target_gender: str) -> str:
+        return f"{self._prefix}wait:{gender}:{target_gender}"
+
+    @staticmethod
+    def _entry(user_data: dict) -> tuple[str, str]:
+        token = uuid.uuid4().hex
+        return json.dumps({**user_data, "token": token}, ensure_ascii=False), token
+
+    @staticmethod
+    def _user_data(entry: str) -> dict:
+        user_data = json.loads(entry)
+        user_data.pop("token", None)
+        return user_data
+
+    async def is_in_chat(self, user_id: int) -> bool:
+        return bool(await self._redis.hexists(self._chats, user_id))
+
+    async def is_busy(self, user_id: int) -> bool:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hexists(self._chats, user_id)
+            pipe.hexists(self._pairing, user_id)
+            return any(await pipe.execute())
+
+    async def get_partner(self, user_id: int) -> int | None:
+        partner = await self._redis.hget(self._chats, user_id)
+        return int(partner) if partner is not None else None
+
+    async def is_waiting(self, user_id: int) -> bool:
+        return bool(await self._redis.hexists(self._waiting, user_id))
+
+    async def add_to_waiting(self, user_data: dict):
+        entry, token = self._entry(user_data)
+        gender, target_gender = user_data["gender"], user_data["target_gender"]
+
+        await self._add(
+            keys=[self._bucket(gender, target_gender), self._waiting, self._counts],
+            args=[user_data["id"], entry, token, f"{gender}:{target_gender}", time.time()]
+        )
+
+    async def cancel_waiting(self, user_id: int) -> bool:
+        return bool(await self._cancel(keys=[self._waiting, self._counts], args=[user_id]))
+
+    async def match_or_wait(self, user_data: dict) -> dict | None:
+        entry, token = self._entry(user_data)
+        gender, target_gender = user_data["gender"], user_data["target_gender"]
+
+        match = await self._match_or_wait(
+            keys=[
+                self._bucket(target_gender, gender),
+                self._bucket(gender, target_gender),
+                self._waiting,
+                self._counts,
+                self._chats,
+                self._pairing,
+                self._held,
+                self._pairing_since,
+            ],
+            args=[user_data["id"], entry, token, f"{gender}:{target_gender}", time.time()]
+        )
+        if match == 0:
+            return False
+        return self._user_data(match) if match else None
+
+    async def reserve(self, user1_id: int, user2_id: int) -> bool:
+        return bool(await self._reserve(
+            keys=[self._waiting, self._counts, self._chats, self._pairing, self._pairing_since],
+            args=[user1_id, user2_id, time.time()]
+        ))
+
+    async def confirm_pair(self, user1_id: int, user2_id: int) -> bool:
+        return bool(await self._confirm(
+            keys=[self._pairing, self._held, self._chats, self._pairing_since],
+            args=[user1_id, user2_id]
+        ))
+
+    async def release_pair(self, user1_id: int, user2_id: int, requeue: tuple = ()) -> bool:
+        return bool(await self._release(
+            keys=[self._pairing, self._held, self._waiting, self._counts, self._pairing_since],
+            args=[
+                f"{self._prefix}wait:",
+                user1_id, int(user1_id in requeue),
+                user2_id, int(user2_id in requeue),
+            ]
+        ))
+
+    async def release_stale_pairs(self, before: float) -> list[int]:
+        released = []
+        while True:
+            scanned, batch = await self._release_stale(
+                keys=[self._pairing, self._held, self._waiting, self._counts, self._pairing_since],
+                args=[f"{self._prefix}wait:", before, 500]
+            )
+            released.extend(int(user_id) for user_id in batch)
+            if scanned < 500:
+                return released
+
+    async def start_chat(self, user1_id: int, user2_id: int):
+        await self._start_chat(
+            keys=[self._waiting, self._counts, self._chats],
+            args=[user1_id, user2_id]
+        )
+
+    async def end_chat(self, user_id: int) -> int | None:
+        partner = await self._end_chat(keys=[self._chats], args=[user_id])
+        return int(partner) if partner is not None else None
+
+    async def expire_waiting(self, before: float) -> list[int]:
+        expired = []
+        # Bounded batches keep each script call short on the server
+        while True:
+            batch = await self._expire(keys=[self._waiting, self._counts], args=[before, 500])
+            expired.extend(int(user_id) for user_id in batch)
+            if len(batch) < 500:
+                return expired
+
+    async def waiting_position(self, user_id: int) -> int | None:
+        position = await self._position(keys=[self._waiting], args=[user_id])
+        return int(position) if position is not None else None
+
+    async def waiting_sizes(self) -> dict[tuple[str, str], int]:
+        counts = await self._redis.hgetall(self._counts)
+        return {
+            tuple(field.split(":", 1)): int(value)
+            for field, value in counts.items()
+        }
+
+    async def active_chat_count(self) -> int:
+        return await self._redis.hlen(self._chats) // 2
+
+    async def close(self):
+        await self._redis.aclose()
@@ -1,32 +1,38 @@
-from app.database import get_db
+from app.database import write_db
+from app.services.coins import LedgerWrite
 
 REFERRAL_REWARD = 20
 
-async def handle_referral(inviter_id: int, invited_id: int):
-    if inviter_id == invited_id:
+async def handle_referral(inviter_telegram_id: int, invited_telegram_id: int):
+    if inviter_telegram_id == invited_telegram_id:
         return
 
-    db = await get_db()
-
-    cursor = await db.execute(
-        "SELECT id FROM referrals WHERE invited_id = ?",
-        (invited_id,)
-    )
-    exists = await cursor.fetchone()
-
-    if exists:
-        await db.close()
-        return
-
-    await db.execute(
-        "INSERT INTO referrals (inviter_id, invited_id) VALUES (?, ?)",
-        (inviter_id, invited_id)
-    )
-
-    await db.execute(
-        "UPDATE users SET coins = coins + ? WHERE id = ?",
-        (REFERRAL_REWARD, inviter_id)
-    )
-
-    await db.commit()
-    await db.close()
+    async with LedgerWrite() as ledger, write_db() as db:
+        cursor = await db.execute(
+            "SELECT 1 FROM users WHERE telegram_id = ?",
+            (inviter_telegram_id,)
+        )
+        inviter = await cursor.fetchone()
+
+        if not inviter:
+            return
+
+        # invited_telegram_id is UNIQUE: each user can be invited only once
+        cursor = await db.execute(
+            """
+            INSERT OR IGNORE INTO referrals (inviter_telegram_id, invited_telegram_id)
+            VALUES (?, ?)
+            """,
+            (inviter_telegram_id, invited_telegram_id)
+        )
+
+        if cursor.rowcount != 1:
+            return
+
+        await ledger.add(
+            db,
+            inviter_telegram_id,
+            REFERRAL_REWARD,
+            "referral",
+            str(invited_telegram_id)
+        )
@@ -0,0 +1,97 @@
+import time
+from collections import deque
+from datetime import datetime
+
+from app.config import REPORT_WINDOW, REPORT_BAN_THRESHOLD
+from app.database import read_db, write_db
+from app.services import sharding
+from app.services.bans import ban_user
+
+# reported_id -> {reporter_id: time of their latest report in the window}
+_windows: dict[int, dict[int, float]] = {}
+
+# (time, reported_id, reporter_id) in arrival order; expired from the
+# left so each report is added and removed exactly once
+_events: deque[tuple[float, int, int]] = deque()
+
+
+def _expire(now: float):
+    cutoff = now - REPORT_WINDOW
+    while _events and _events[0][0] <= cutoff:
+        at, reported_id, reporter_id = _events.popleft()
+        reporters = _windows.get(reported_id)
+        # A newer report from the same reporter keeps the entry alive
+        if reporters is None or reporters.get(reporter_id) != at:
+            continue
+        del reporters[reporter_id]
+        if not reporters:
+            del _windows[reported_id]
+
+
+def _note(reported_id: int, reporter_id: int, at: float) -> int:
+    """ثبت ریپورت در پنجره؛ تعداد ریپورت‌کننده‌های متمایز را برمی‌گرداند"""
+    _events.append((at, reported_id, reporter_id))
+    reporters = _windows.setdefault(reported_id, {})
+    reporters[reporter_id] = at
+    return len(reporters)
+
+
+async def load():
+    """ساخت دوباره‌ی پنجره از جدول reports هنگام شروع"""
+    _windows.clear()
+    _events.clear()
+
+    async with read_db() as db:
+        # Reports from before a user's last ban already led to that ban
+        async with db.execute(
+            """
+            SELECT r.reported_id, r.reporter_id,
+                   CAST(strftime('%s', MAX(r.created_at)) AS REAL) AS at
+            FROM reports r
+            JOIN users u ON u.telegram_id = r.reported_id
+            WHERE r.created_at > datetime('now', ?)
+              AND (u.banned_at IS NULL OR r.created_at > u.banned_at)
+            GROUP BY r.reported_id, r.reporter_id
+            ORDER BY at
+            """,
+            (f"-{REPORT_WINDOW} seconds",)
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+    for reported_id, reporter_id, at in rows:
+        _note(reported_id, reporter_id, at)
+    _expire(time.time())
+
+
+async def add_report(reporter_id: int, reported_id: int, forward: bool = True) -> datetime | None:
+    """
+    ثبت ریپورت و بن خودکار در صورت رسیدن به آستانه
+
+    Returns when the ban ends if this report banned the user. When
+    running as a shard, the report is counted by the shard that owns the
+    reported user, which holds their window and checks their bans.
+    """
+    if forward and sharding.forwards(reported_id):
+        until = await sharding.forward(reported_id, "report", {
+            "reporter_id": reporter_id,
+            "reported_id": reported_id,
+        })
+        return datetime.fromisoformat(until) if until else None
+
+    async with write_db() as db:
+        await db.execute(
+            """
+            INSERT INTO reports (reporter_id, reported_id)
+            VALUES (?, ?)
+            """,
+            (reporter_id, reported_id)
+        )
+
+    now = time.time()
+    _expire(now)
+    if _note(reported_id, reporter_id, now) < REPORT_BAN_THRESHOLD:
+        return None
+
+    # Start a fresh window; the reports so far are used up by this ban
+    _windows.pop(reported_id, None)
+    return await ban_user(reported_id)
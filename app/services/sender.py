@@ -0,0 +1,284 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+from itertools import count
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError
+)
+from aiogram.methods import TelegramMethod, SendMessage
+
+from app.config import (
+    OUTBOX_GLOBAL_RATE,
+    OUTBOX_CHAT_RATE,
+    OUTBOX_CHAT_BURST,
+    OUTBOX_CONCURRENCY
+)
+from app.services import sharding
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes: lower goes first
+RELAY = 0
+NOTIFY = 1
+
+MAX_NETWORK_RETRIES = 3
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """ثانیه‌های لازم تا آزاد شدن یک توکن (0 یعنی همین حالا)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0)
+
+
+class _Job:
+    __slots__ = ("bot", "method", "priority", "future", "attempts")
+
+    def __init__(self, bot: Bot, method: TelegramMethod, priority: int, future: asyncio.Future):
+        self.bot = bot
+        self.method = method
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ("chat_id", "jobs", "bucket", "busy", "scheduled", "blocked_until")
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.jobs: deque[_Job] = deque()
+        self.bucket = TokenBucket(OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
+        self.busy = False
+        self.scheduled = False
+        self.blocked_until = 0.0
+
+
+def _consume_exception(future: asyncio.Future):
+    # Callers are free to never await their send; don't warn about it
+    if not future.cancelled():
+        future.exception()
+
+
+class Outbox:
+    """
+    صف ارسال پیام‌ها با رعایت محدودیت‌های تلگرام
+
+    - a global token bucket (~30 msg/s) and one per chat (~1 msg/s)
+    - priority lanes, so chat relays go out before notifications
+    - at most one request in flight per chat, so a chat's messages
+      arrive in the order they were queued
+    - automatic back-off on RetryAfter and retries on network errors
+    """
+
+    def __init__(self):
+        self._chats: dict[int, _Chat] = {}
+        self._lanes = (deque(), deque())
+        self._delayed: list[tuple[float, int, int]] = []
+        self._seq = count()
+        self._global = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+        self._slots = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._in_flight: set[asyncio.Task] = set()
+
+        self.stats = {
+            "queued": 0,
+            "sent": 0,
+            "failed": 0,
+            "retried": 0,
+            "retry_after": 0,
+        }
+
+    # =========================
+    # API
+    # =========================
+    def send(self, bot: Bot, method: TelegramMethod, priority: int = NOTIFY) -> asyncio.Future:
+        """
+        اضافه کردن یک درخواست به صف؛ منتظر ارسال نمی‌ماند
+
+        The returned future resolves with the API result (or error) and
+        may simply be ignored. When running as a shard, a chat owned by
+        another shard is handed to that shard's outbox instead, so that
+        one outbox paces each chat.
+        """
+        if sharding.forwards(method.chat_id):
+            return sharding.forward_send(method, priority)
+        return self.enqueue(bot, method, priority)
+
+    def enqueue(self, bot: Bot, method: TelegramMethod, priority: int = NOTIFY) -> asyncio.Future:
+        """اضافه کردن به صف همین پروسه"""
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+
+        chat_id = method.chat_id
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(chat_id)
+
+        chat.jobs.append(_Job(bot, method, priority, future))
+        self.stats["queued"] += 1
+        self._schedule(chat)
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    def send_message(self, bot: Bot, chat_id: int, text: str, priority: int = NOTIFY, **kwargs) -> asyncio.Future:
+        return self.send(bot, SendMessage(chat_id=chat_id, text=text, **kwargs), priority)
+
+    def depth(self) -> int:
+        return sum(len(chat.jobs) for chat in self._chats.values())
+
+    async def close(self, timeout: float = 10):
+        """ارسال باقی‌مانده صف و توقف"""
+        deadline = time.monotonic() + timeout
+        while (self.depth() or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # =========================
+    # Scheduling
+    # =========================
+    def _schedule(self, chat: _Chat):
+        if chat.busy or chat.scheduled or not chat.jobs:
+            return
+
+        now = time.monotonic()
+        ready_at = max(now + chat.bucket.delay(now), chat.blocked_until)
+
+        chat.scheduled = True
+        if ready_at <= now:
+            self._lanes[chat.jobs[0].priority].append(chat.chat_id)
+        else:
+            heapq.heappush(self._delayed, (ready_at, next(self._seq), chat.chat_id))
+        self._wakeup.set()
+
+    def _next_chat(self, now: float) -> _Chat | None:
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._delayed)
+            chat = self._chats.get(chat_id)
+            if chat and chat.jobs:
+                self._lanes[chat.jobs[0].priority].append(chat_id)
+
+        for lane in self._lanes:
+            while lane:
+                chat = self._chats.get(lane.popleft())
+                if chat and chat.jobs and not chat.busy:
+                    return chat
+        return None
+
+    def _sweep(self, now: float):
+        # Forget idle chats whose bucket has fully refilled
+        for chat_id in [
+            chat.chat_id for chat in self._chats.values()
+            if not (chat.jobs or chat.busy or chat.scheduled)
+            and chat.blocked_until <= now
+            and chat.bucket.delay(now) == 0
+            and chat.bucket.tokens >= chat.bucket.capacity
+        ]:
+            del self._chats[chat_id]
+
+    async def _run(self):
+        last_sweep = time.monotonic()
+
+        while True:
+            now = time.monotonic()
+            if now - last_sweep > 60:
+                self._sweep(now)
+                last_sweep = now
+
+            chat = self._next_chat(now)
+
+            if chat is None:
+                self._wakeup.clear()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            wait = self._global.delay(now)
+            if wait:
+                await asyncio.sleep(wait)
+
+            await self._slots.acquire()
+
+            now = time.monotonic()
+            self._global.take(now)
+            chat.bucket.take(now)
+            chat.scheduled = False
+            chat.busy = True
+
+            task = asyncio.create_task(self._deliver(chat, chat.jobs[0]))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _deliver(self, chat: _Chat, job: _Job):
+        try:
+            result = await job.bot(job.method)
+        except TelegramRetryAfter as e:
+            self.stats["retry_after"] += 1
+            chat.blocked_until = time.monotonic() + e.retry_after
+            self._global.drain()
+        except (TelegramNetworkError, TelegramServerError) as e:
+            job.attempts += 1
+            if job.attempts >= MAX_NETWORK_RETRIES:
+                self._finish(chat, job, error=e)
+            else:
+                self.stats["retried"] += 1
+                chat.blocked_until = time.monotonic() + 2 ** job.attempts
+        except Exception as e:
+            self._finish(chat, job, error=e)
+        else:
+            self._finish(chat, job, result=result)
+        finally:
+            self._slots.release()
+            chat.busy = False
+            self._schedule(chat)
+
+    def _finish(self, chat: _Chat, job: _Job, result=None, error: Exception | None = None):
+        chat.jobs.popleft()
+
+        if error is None:
+            self.stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        else:
+            self.stats["failed"] += 1
+            logger.warning("Send to %s failed: %s", chat.chat_id, error)
+            if not job.future.done():
+                job.future.set_exception(error)
+
+
+outbox = Outbox()
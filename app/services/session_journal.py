@@ -0,0 +1,187 @@
+import asyncio
+import json
+import time
+from itertools import count
+
+from app.config import SESSION_FLUSH_INTERVAL
+from app.database import read_db, write_db
+from app.services import matcher
+
+# user_id -> latest state not yet written to disk:
+#   ("chat", partner_id) | ("wait", user_data, seq, enqueued_at) | ("none",)
+# Only the last change per user matters, so repeated changes between two
+# flushes collapse into a single row write.
+_pending: dict[int, tuple] = {}
+# The same for the special-search pool, which is kept apart because a
+# user can wait in both:
+#   ("wait", user_data, search_filter, enqueued_at) | ("none",)
+_special: dict[int, tuple] = {}
+
+_seq = count()
+_flush_task: asyncio.Task | None = None
+
+
+# =========================
+# ثبت تغییرات (بدون I/O)
+# =========================
+def record_chat(user1_id: int, user2_id: int):
+    _pending[user1_id] = ("chat", user2_id)
+    _pending[user2_id] = ("chat", user1_id)
+
+
+def record_waiting(user_data: dict):
+    _pending[user_data["id"]] = ("wait", user_data, next(_seq), time.time())
+
+
+def record_gone(*user_ids: int):
+    for user_id in user_ids:
+        _pending[user_id] = ("none",)
+
+
+def record_special_waiting(user_data: dict, search_filter: dict, enqueued_at: float):
+    _special[user_data["id"]] = ("wait", user_data, search_filter, enqueued_at)
+
+
+def record_special_gone(*user_ids: int):
+    for user_id in user_ids:
+        _special[user_id] = ("none",)
+
+
+# =========================
+# نوشتن دسته‌ای روی دیتابیس
+# =========================
+async def flush():
+    if not _pending and not _special:
+        return
+
+    batch = dict(_pending)
+    _pending.clear()
+    special = dict(_special)
+    _special.clear()
+
+    user_ids = [(user_id,) for user_id in batch]
+    chats = []
+    waiting = []
+    now = time.time()
+
+    for user_id, state in batch.items():
+        if state[0] == "chat":
+            chats.append((user_id, state[1], now))
+        elif state[0] == "wait":
+            user_data = state[1]
+            waiting.append((user_id, user_data["gender"], user_data["target_gender"], state[2], state[3]))
+
+    special_waiting = [
+        (user_id, json.dumps(state[1], ensure_ascii=False), json.dumps(state[2]), state[3])
+        for user_id, state in special.items()
+        if state[0] == "wait"
+    ]
+
+    try:
+        async with write_db() as db:
+            await db.executemany("DELETE FROM chat_sessions WHERE user_id = ?", user_ids)
+            await db.executemany("DELETE FROM waiting_queue WHERE user_id = ?", user_ids)
+            await db.executemany(
+                "INSERT INTO chat_sessions (user_id, partner_id, started_at) VALUES (?, ?, ?)",
+                chats
+            )
+            await db.executemany(
+                """
+                INSERT INTO waiting_queue (user_id, gender, target_gender, seq, enqueued_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                waiting
+            )
+            await db.executemany(
+                "DELETE FROM special_waiting WHERE user_id = ?",
+                [(user_id,) for user_id in special]
+            )
+            await db.executemany(
+                """
+                INSERT INTO special_waiting (user_id, user_data, search_filter, enqueued_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                special_waiting
+            )
+    except Exception:
+        # Keep newer changes that arrived meanwhile, retry the rest next time
+        for user_id, state in batch.items():
+            _pending.setdefault(user_id, state)
+        for user_id, state in special.items():
+            _special.setdefault(user_id, state)
+        raise
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+        try:
+            await flush()
+        except Exception as e:
+            print(f"خطا در ذخیره چت‌ها: {e}")
+
+
+# =========================
+# بازیابی بعد از ری‌استارت
+# =========================
+async def restore():
+    """ساخت دوباره صف انتظار و چت‌های فعال از دیتابیس (یک خواندن)"""
+    async with read_db() as db:
+        async with db.execute("SELECT user_id, partner_id FROM chat_sessions") as cursor:
+            chats = await cursor.fetchall()
+        async with db.execute(
+            "SELECT user_id, gender, target_gender, seq, enqueued_at FROM waiting_queue ORDER BY seq"
+        ) as cursor:
+            waiting = await cursor.fetchall()
+
+    for user_id, partner_id in chats:
+        matcher.active_chats[user_id] = partner_id
+
+    # The original enqueue time is kept, so downtime counts towards expiry
+    restored = 0
+    for user_id, gender, target_gender, _, enqueued_at in waiting:
+        if user_id not in matcher.active_chats:
+            matcher.waiting_users.add({
+                "id": user_id,
+                "gender": gender,
+                "target_gender": target_gender
+            }, enqueued_at)
+            restored += 1
+
+    # Keep new entries ordered after the restored ones
+    global _seq
+    _seq = count(waiting[-1]["seq"] + 1 if waiting else 0)
+
+    return len(chats) // 2, restored
+
+
+async def load_special() -> list[tuple[dict, dict, float]]:
+    """ردیف‌های صف جستجوی ویژه: (user_data، فیلتر، زمان ورود)"""
+    async with read_db() as db:
+        async with db.execute(
+            "SELECT user_data, search_filter, enqueued_at FROM special_waiting ORDER BY enqueued_at"
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+    return [
+        (json.loads(user_data), json.loads(search_filter), enqueued_at)
+        for user_data, search_filter, enqueued_at in rows
+    ]
+
+
+async def start():
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    await flush()
@@ -0,0 +1,97 @@
+from app.database import read_db, write_db
+from app.services.payments import verify_payment, GatewayError
+from app.services.coins import LedgerWrite
+
+# Outcomes of settle_payment()
+SETTLED = "success"
+REJECTED = "failed"
+ALREADY_HANDLED = "handled"
+NOT_FOUND = "not_found"
+UNKNOWN = "unknown"
+
+
+# =========================
+# تسویه پرداخت
+# =========================
+async def claim_payment(authority: str):
+    """
+    رزرو پرداخت برای تایید (pending -> verifying)
+
+    The conditional UPDATE lets exactly one caller win, across every
+    process sharing the database; the others get None back.
+    """
+    async with write_db() as db:
+        cursor = await db.execute(
+            """
+            UPDATE payments SET status = 'verifying', claimed_at = CURRENT_TIMESTAMP
+            WHERE authority = ? AND status = 'pending'
+            """,
+            (authority,)
+        )
+        if cursor.rowcount != 1:
+            return None
+
+        async with db.execute(
+            "SELECT user_id, amount, coins FROM payments WHERE authority = ?",
+            (authority,)
+        ) as cursor:
+            return await cursor.fetchone()
+
+
+async def release_payment(authority: str):
+    """برگرداندن پرداخت به pending وقتی نتیجه درگاه معلوم نشد"""
+    async with write_db() as db:
+        await db.execute(
+            "UPDATE payments SET status = 'pending' WHERE authority = ? AND status = 'verifying'",
+            (authority,)
+        )
+
+
+async def finish_payment(authority: str, user_id: int, coins: int, success: bool) -> bool:
+    """ثبت نتیجه و واریز سکه در یک تراکنش"""
+    async with LedgerWrite() as ledger, write_db() as db:
+        cursor = await db.execute(
+            "UPDATE payments SET status = ? WHERE authority = ? AND status = 'verifying'",
+            (SETTLED if success else REJECTED, authority)
+        )
+        if cursor.rowcount != 1:
+            return False
+
+        if success:
+            await ledger.add(db, user_id, coins, "payment", authority)
+
+    return True
+
+
+async def settle_payment(authority: str) -> str:
+    """
+    تایید پرداخت و واریز سکه؛ هر پرداخت فقط یک بار تسویه می‌شود
+
+    Safe to call any number of times and from several workers at once:
+    only the caller that claims the row talks to the gateway, and the
+    status change and the credit are committed together.
+    """
+    payment = await claim_payment(authority)
+
+    if payment is None:
+        async with read_db() as db:
+            async with db.execute(
+                "SELECT status FROM payments WHERE authority = ?",
+                (authority,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return ALREADY_HANDLED if row else NOT_FOUND
+
+    user_id, amount, coins = payment
+
+    try:
+        success = await verify_payment(authority, amount)
+    except GatewayError:
+        await release_payment(authority)
+        return UNKNOWN
+    except BaseException:
+        await release_payment(authority)
+        raise
+
+    await finish_payment(authority, user_id, coins, success)
+    return SETTLED if success else REJECTED
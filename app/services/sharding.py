@@ -0,0 +1,321 @@
+"""
+تقسیم کاربران بین چند پروسه (shard)
+
+The front door (app.front_door) receives the webhook and hands each
+update to the worker that owns its user, picked by consistent hashing
+on the user id, so a user's updates stay in order on one worker.
+Workers also call each other over the same Unix sockets:
+
+- a message for a chat is queued in the outbox of the chat's owner, so
+  a single process paces and orders everything a chat receives (a
+  relay to a partner on another shard goes through here);
+- a report is counted by the shard that owns the reported user;
+- coins are taken from (or given back to) a user by the shard that owns
+  them, the only one whose cached balance is up to date.
+
+Special search keeps its pool in memory, so it all runs on one shard,
+SPECIAL_SEARCH_SHARD: the others hand it the searches and cancellations.
+
+Frames are JSON lines. A request carries an id and a ``kind``; its reply
+carries the same id with ``result`` or ``error``, in any order.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from bisect import bisect_left
+from contextlib import suppress
+from itertools import count
+
+import aiogram.exceptions
+import aiogram.methods
+from aiogram.methods import TelegramMethod
+
+from app.config import SHARDS, SHARD_NAME, SHARD_SOCKET_DIR, SHARD_VNODES
+
+logger = logging.getLogger(__name__)
+
+# Longest accepted frame; updates and forwarded messages are far smaller
+FRAME_LIMIT = 1 << 20
+
+
+class ShardError(Exception):
+    def __init__(self, message: str, error_type: str | None = None):
+        super().__init__(message)
+        # Class name of the error raised on the other shard
+        self.error_type = error_type
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    حلقه‌ی consistent hashing با نقاط مجازی
+
+    Every shard sits at ``vnodes`` points of a 64-bit ring and a key
+    belongs to the first point at or after its hash. Adding a shard to
+    N others moves about 1/(N+1) of the keys, all of them to the new
+    shard; nobody else changes owner.
+    """
+
+    def __init__(self, shards: list[str], vnodes: int = SHARD_VNODES):
+        points = sorted((_hash(f"{shard}#{i}"), shard) for shard in shards for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def owner(self, key: int) -> str:
+        i = bisect_left(self._points, _hash(str(key)))
+        return self._shards[i % len(self._shards)]
+
+
+ring = HashRing(SHARDS) if SHARDS else None
+SPECIAL_SEARCH_SHARD = SHARDS[0] if SHARDS else None
+
+
+def socket_path(shard: str) -> str:
+    return os.path.join(SHARD_SOCKET_DIR, f"{shard}.sock")
+
+
+def forwards(user_id: int) -> bool:
+    """آیا کار این کاربر (یا چت او) مال shard دیگری است"""
+    return bool(SHARD_NAME) and ring is not None and ring.owner(user_id) != SHARD_NAME
+
+
+def forwards_special_search() -> bool:
+    """آیا صف جستجوی ویژه روی shard دیگری است"""
+    return bool(SHARD_NAME) and SPECIAL_SEARCH_SHARD is not None and SPECIAL_SEARCH_SHARD != SHARD_NAME
+
+
+# =========================
+# فریم‌ها
+# =========================
+async def read_frame(reader: asyncio.StreamReader) -> dict | None:
+    line = await reader.readline()
+    return json.loads(line) if line else None
+
+
+def write_frame(writer: asyncio.StreamWriter, frame: dict):
+    writer.write(json.dumps(frame, ensure_ascii=False, separators=(",", ":")).encode() + b"\n")
+
+
+def _consume_exception(future: asyncio.Future):
+    if not future.cancelled():
+        future.exception()
+
+
+class Peer:
+    """
+    اتصال به یک shard دیگر
+
+    Requests are written in the order they are made, also while the
+    connection is being opened, and the peer handles them in that order.
+    If the connection drops, whatever is still waiting for a reply fails
+    with ConnectionError and the next request reconnects.
+    """
+
+    def __init__(self, shard: str):
+        self.shard = shard
+        self._ids = count()
+        self._pending: dict[int, asyncio.Future] = {}
+        self._backlog: list[dict] = []
+        self._writer: asyncio.StreamWriter | None = None
+        self._connecting: asyncio.Task | None = None
+        self._reading: asyncio.Task | None = None
+
+    def request(self, kind: str, payload: dict) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+
+        frame = {"id": next(self._ids), "kind": kind, **payload}
+        self._pending[frame["id"]] = future
+
+        if self._writer is not None:
+            write_frame(self._writer, frame)
+        else:
+            self._backlog.append(frame)
+            if self._connecting is None:
+                self._connecting = asyncio.create_task(self._connect())
+        return future
+
+    async def _connect(self):
+        try:
+            reader, writer = await asyncio.open_unix_connection(socket_path(self.shard), limit=FRAME_LIMIT)
+        except OSError as e:
+            self._fail(ConnectionError(f"shard {self.shard} unreachable: {e}"))
+            return
+        finally:
+            self._connecting = None
+
+        self._writer = writer
+        for frame in self._backlog:
+            write_frame(writer, frame)
+        self._backlog.clear()
+        self._reading = asyncio.create_task(self._read(reader))
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while (frame := await read_frame(reader)) is not None:
+                future = self._pending.pop(frame["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in frame:
+                    future.set_exception(ShardError(frame["error"], frame.get("error_type")))
+                else:
+                    future.set_result(frame.get("result"))
+        except (OSError, ValueError) as e:
+            logger.warning("Connection to shard %s broken: %s", self.shard, e)
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._fail(ConnectionError(f"shard {self.shard} closed the connection"))
+
+    def _fail(self, error: Exception):
+        pending, self._pending = self._pending, {}
+        self._backlog.clear()
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        for task in (self._connecting, self._reading):
+            if task is not None:
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+
+
+_peers: dict[str, Peer] = {}
+
+
+def peer(shard: str) -> Peer:
+    connection = _peers.get(shard)
+    if connection is None:
+        connection = _peers[shard] = Peer(shard)
+    return connection
+
+
+def forward(user_id: int, kind: str, payload: dict) -> asyncio.Future:
+    """ارسال یک درخواست به shard صاحب این کاربر"""
+    return peer(ring.owner(user_id)).request(kind, payload)
+
+
+async def close():
+    for connection in _peers.values():
+        await connection.close()
+    _peers.clear()
+
+
+# =========================
+# پیام‌های چت‌های shardهای دیگر
+# =========================
+def forward_send(method: TelegramMethod, priority: int) -> asyncio.Future:
+    """
+    سپردن یک پیام به outbox صاحب چت
+
+    The returned future resolves with None once the owner has sent it,
+    or fails with the same Telegram error the owner got.
+    """
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(_consume_exception)
+
+    reply = forward(method.chat_id, "send", {
+        "method": type(method).__name__,
+        "data": method.model_dump(mode="json", exclude_defaults=True),
+        "priority": priority,
+    })
+
+    def settle(reply: asyncio.Future):
+        if future.done():
+            return
+        if reply.exception() is None:
+            future.set_result(None)
+        else:
+            future.set_exception(_telegram_error(reply, method))
+
+    reply.add_done_callback(settle)
+    return future
+
+
+def _telegram_error(reply: asyncio.Future, method: TelegramMethod) -> Exception:
+    # Handlers check for Telegram's own errors (a blocked bot, say)
+    error = reply.exception()
+    cls = getattr(aiogram.exceptions, getattr(error, "error_type", None) or "", None)
+    if isinstance(cls, type) and issubclass(cls, aiogram.exceptions.TelegramAPIError):
+        try:
+            return cls(method=method, message=str(error))
+        except TypeError:
+            pass
+    return error
+
+
+def load_method(frame: dict) -> TelegramMethod:
+    cls = getattr(aiogram.methods, frame["method"], None)
+    if not (isinstance(cls, type) and issubclass(cls, TelegramMethod)):
+        raise ShardError(f"unknown method {frame['method']}")
+    return cls.model_validate(frame["data"])
+
+
+# =========================
+# سرور هر shard
+# =========================
+async def serve(shard: str, handlers: dict) -> asyncio.AbstractServer:
+    """
+    گوش دادن روی سوکت این shard
+
+    ``handlers`` maps a frame kind to a coroutine function. Frames of one
+    connection are handled one after another, in order; a handler that
+    returns a Future is answered when the Future is done, without
+    holding up the frames behind it.
+    """
+    os.makedirs(SHARD_SOCKET_DIR, exist_ok=True)
+    path = socket_path(shard)
+    # Left behind by a previous run of this shard
+    with suppress(FileNotFoundError):
+        os.unlink(path)
+
+    async def connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while (frame := await read_frame(reader)) is not None:
+                try:
+                    result = await handlers[frame["kind"]](frame)
+                except Exception as e:
+                    _reply(writer, frame["id"], error=e)
+                    continue
+
+                if isinstance(result, asyncio.Future):
+                    result.add_done_callback(
+                        lambda done, frame_id=frame["id"]: _reply_future(writer, frame_id, done)
+                    )
+                else:
+                    _reply(writer, frame["id"], result)
+        except (OSError, ValueError) as e:
+            logger.warning("Shard connection broken: %s", e)
+        finally:
+            writer.close()
+
+    return await asyncio.start_unix_server(connection, path, limit=FRAME_LIMIT)
+
+
+def _reply(writer: asyncio.StreamWriter, frame_id: int, result=None, error: Exception | None = None):
+    if writer.is_closing():
+        return
+    if error is None:
+        write_frame(writer, {"id": frame_id, "result": result})
+    else:
+        write_frame(writer, {"id": frame_id, "error": str(error), "error_type": type(error).__name__})
+
+
+def _reply_future(writer: asyncio.StreamWriter, frame_id: int, done: asyncio.Future):
+    if done.cancelled():
+        _reply(writer, frame_id, error=ShardError("cancelled"))
+    elif done.exception() is not None:
+        _reply(writer, frame_id, error=done.exception())
+    else:
+        result = done.result()
+        _reply(writer, frame_id, result if isinstance(result, (str, int, float, bool, type(None))) else None)
@@ -0,0 +1,219 @@
+from app.config import STATE_BACKEND
+from app.services import matcher, session_journal
+
+
+class StateBackend:
+    """
+    محل نگهداری صف انتظار و چت‌های فعال
+
+    Handlers only talk to this interface, so the queue and session state
+    can live in this process (``memory``) or in a shared store
+    (``redis``) used by several bot processes at once.
+    """
+
+    async def is_in_chat(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    async def is_busy(self, user_id: int) -> bool:
+        """در چت است یا همین حالا برای یک چت رزرو شده"""
+        raise NotImplementedError
+
+    async def get_partner(self, user_id: int) -> int | None:
+        raise NotImplementedError
+
+    async def is_waiting(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    async def add_to_waiting(self, user_data: dict):
+        raise NotImplementedError
+
+    async def cancel_waiting(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    async def match_or_wait(self, user_data: dict) -> dict | None | bool:
+        """
+        پیدا کردن مخاطب و رزرو هر دو نفر در یک قدم اتمیک
+
+        Returns the partner's user_data with both users reserved for a new
+        chat, None after putting the user in the waiting queue, or False,
+        without queueing, if they are already in a chat or being paired.
+        The pairing is then finished with confirm_pair or undone with
+        release_pair. Nobody can be reserved twice, even with several
+        processes calling this at once.
+        """
+        raise NotImplementedError
+
+    async def reserve(self, user1_id: int, user2_id: int) -> bool:
+        """رزرو دو کاربری که جای دیگری با هم جور شده‌اند؛ اگر یکی مشغول باشد False"""
+        raise NotImplementedError
+
+    async def confirm_pair(self, user1_id: int, user2_id: int) -> bool:
+        """شروع چت برای یک جفت رزروشده"""
+        raise NotImplementedError
+
+    async def release_pair(self, user1_id: int, user2_id: int, requeue: tuple = ()) -> bool:
+        """
+        لغو رزرو
+
+        Users in ``requeue`` who were taken from the waiting queue by
+        match_or_wait go back to the head of it, with their original
+        enqueue time.
+        """
+        raise NotImplementedError
+
+    async def release_stale_pairs(self, before: float) -> list[int]:
+        """
+        لغو رزروهایی که قبل از ``before`` (unix time) انجام شده‌اند
+
+        A process that dies between reserving a pair and confirming or
+        releasing it leaves both users reserved, and they could never
+        search again. Users taken from the waiting queue go back to it;
+        the others are returned so they can be told.
+        """
+        raise NotImplementedError
+
+    async def start_chat(self, user1_id: int, user2_id: int):
+        raise NotImplementedError
+
+    async def end_chat(self, user_id: int) -> int | None:
+        raise NotImplementedError
+
+    async def expire_waiting(self, before: float) -> list[int]:
+        """
+        حذف کاربرانی که قبل از ``before`` (unix time) وارد صف شده‌اند
+
+        Returns the removed user ids. The cost depends on how many entries
+        expire, not on how many are waiting.
+        """
+        raise NotImplementedError
+
+    async def waiting_position(self, user_id: int) -> int | None:
+        """جایگاه کاربر در صف خودش (۱ یعنی نفر اول) یا None اگر در صف نیست"""
+        raise NotImplementedError
+
+    async def waiting_sizes(self) -> dict[tuple[str, str], int]:
+        raise NotImplementedError
+
+    async def active_chat_count(self) -> int:
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """
+    وضعیت داخل همین پروسه (app.services.matcher)
+
+    Every change is also handed to session_journal, which writes it to
+    SQLite in the background and restores it on the next start.
+    """
+
+    async def start(self):
+        chats, waiting = await session_journal.restore()
+        print(f"♻️ {chats} چت فعال و {waiting} کاربر در صف بازیابی شد.")
+        await session_journal.start()
+
+    async def close(self):
+        await session_journal.stop()
+
+    async def is_in_chat(self, user_id: int) -> bool:
+        return matcher.is_in_chat(user_id)
+
+    async def is_busy(self, user_id: int) -> bool:
+        return matcher.is_busy(user_id)
+
+    async def get_partner(self, user_id: int) -> int | None:
+        return matcher.active_chats.get(user_id)
+
+    async def is_waiting(self, user_id: int) -> bool:
+        return matcher.is_waiting(user_id)
+
+    async def add_to_waiting(self, user_data: dict):
+        matcher.add_to_waiting(user_data)
+        session_journal.record_waiting(user_data)
+
+    async def cancel_waiting(self, user_id: int) -> bool:
+        if matcher.cancel_waiting(user_id):
+            session_journal.record_gone(user_id)
+            return True
+        return False
+
+    async def match_or_wait(self, user_data: dict) -> dict | None:
+        # No await in between, so this is atomic on the event loop
+        if matcher.is_busy(user_data["id"]):
+            return False
+
+        match = matcher.reserve_match(user_data)
+        if match is None:
+            matcher.add_to_waiting(user_data)
+            session_journal.record_waiting(user_data)
+        return match
+
+    async def reserve(self, user1_id: int, user2_id: int) -> bool:
+        return matcher.reserve(user1_id, user2_id)
+
+    # The journal only learns about a pairing once it ends: until then a
+    # partner taken from the queue is still written down as waiting, which
+    # is also what a restart should bring back
+    async def confirm_pair(self, user1_id: int, user2_id: int) -> bool:
+        if not matcher.confirm_pair(user1_id, user2_id):
+            return False
+        session_journal.record_chat(user1_id, user2_id)
+        return True
+
+    async def release_pair(self, user1_id: int, user2_id: int, requeue: tuple = ()) -> bool:
+        if not matcher.release_pair(user1_id, user2_id, requeue):
+            return False
+        gone = [user_id for user_id in (user1_id, user2_id) if user_id not in requeue]
+        if gone:
+            session_journal.record_gone(*gone)
+        return True
+
+    async def release_stale_pairs(self, before: float) -> list[int]:
+        released = matcher.release_stale_pairs(before)
+        if released:
+            session_journal.record_gone(*released)
+        return released
+
+    async def start_chat(self, user1_id: int, user2_id: int):
+        matcher.start_chat(user1_id, user2_id)
+        session_journal.record_chat(user1_id, user2_id)
+
+    async def end_chat(self, user_id: int) -> int | None:
+        partner = matcher.end_chat(user_id)
+        if partner:
+            session_journal.record_gone(user_id, partner)
+        return partner
+
+    async def expire_waiting(self, before: float) -> list[int]:
+        expired = [user_data["id"] for user_data in matcher.expire_waiting(before)]
+        if expired:
+            session_journal.record_gone(*expired)
+        return expired
+
+    async def waiting_position(self, user_id: int) -> int | None:
+        return matcher.waiting_position(user_id)
+
+    async def waiting_sizes(self) -> dict[tuple[str, str], int]:
+        return matcher.waiting_users.bucket_sizes()
+
+    async def active_chat_count(self) -> int:
+        return len(matcher.active_chats) // 2
+
+
+def create_backend(name: str) -> StateBackend:
+    if name == "memory":
+        return MemoryBackend()
+
+    if name == "redis":
+        from app.services.redis_state import RedisBackend
+        return RedisBackend()
+
+    raise ValueError(f"Unknown STATE_BACKEND: {name}")
+
+
+backend = create_backend(STATE_BACKEND)
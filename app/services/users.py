@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from app.config import USER_CACHE_SIZE, USER_CACHE_TTL
+from app.database import read_db
+
+
+class UserSnapshot(NamedTuple):
+    id: int
+    telegram_id: int
+    name: str
+    gender: str
+    province: str
+    city: str
+    age: int
+    profile_pic: str | None
+    coins: int
+    banned_until: str | None
+
+
+_SELECT_USER = """
+    SELECT id, telegram_id, name, gender, province, city, age,
+           profile_pic, coins, banned_until
+    FROM users
+    WHERE telegram_id = ?
+"""
+
+# telegram_id -> (expires_at, snapshot or None for unregistered users)
+_cache: OrderedDict[int, tuple[float, UserSnapshot | None]] = OrderedDict()
+
+# Bumped on every invalidation so a read that raced with a write
+# does not put the stale row back into the cache.
+_epoch = 0
+
+
+async def get_user(telegram_id: int) -> UserSnapshot | None:
+    """خواندن اطلاعات کاربر از کش (یا دیتابیس در صورت نبود در کش)"""
+    now = time.monotonic()
+
+    entry = _cache.get(telegram_id)
+    if entry is not None and entry[0] > now:
+        _cache.move_to_end(telegram_id)
+        return entry[1]
+
+    epoch = _epoch
+
+    async with read_db() as db:
+        async with db.execute(_SELECT_USER, (telegram_id,)) as cursor:
+            row = await cursor.fetchone()
+
+    user = UserSnapshot(*row) if row else None
+
+    if epoch == _epoch:
+        _cache[telegram_id] = (now + USER_CACHE_TTL, user)
+        _cache.move_to_end(telegram_id)
+        while len(_cache) > USER_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return user
+
+
+def invalidate_user(*telegram_ids: int):
+    """حذف کاربر از کش؛ بعد از هر تغییر در ردیف users صدا زده شود"""
+    global _epoch
+    _epoch += 1
+    for telegram_id in telegram_ids:
+        _cache.pop(telegram_id, None)
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from app import metrics
+from app.config import (
+    SHARDS,
+    SHARD_NAME,
+    STATE_BACKEND,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE
+)
+from app.handlers import special_search
+from app.services import coins, reports, sharding
+from app.services.filtered_matcher import SearchFilter, leave_filtered_waiting
+from app.services.sender import outbox
+from app.webhook_server import UpdateQueue
+
+logger = logging.getLogger(__name__)
+
+
+async def _report(reporter_id: int, reported_id: int) -> str | None:
+    until = await reports.add_report(reporter_id, reported_id, forward=False)
+    return until.isoformat(sep=" ") if until else None
+
+
+async def run_shard(bot: Bot, dp: Dispatcher):
+    """
+    اجرای ربات به عنوان یک shard پشت app.front_door
+
+    Updates come from the front door over this shard's Unix socket and
+    go through the same per-user worker queues as in webhook mode. The
+    socket also takes messages, reports and coin debits that other shards
+    hand over for users owned by this one, and on the first shard every
+    special search.
+    """
+    if SHARD_NAME not in SHARDS:
+        raise RuntimeError(f"SHARD_NAME={SHARD_NAME!r} is not listed in SHARDS")
+    # Chats and the waiting queue have to be visible to every shard
+    if len(SHARDS) > 1 and STATE_BACKEND != "redis":
+        raise RuntimeError("Running more than one shard needs STATE_BACKEND=redis")
+
+    updates = UpdateQueue(bot, dp, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+    updates.start()
+
+    @metrics.collector
+    async def collect_queue():
+        metrics.webhook_queue_depth.set(updates.depth())
+
+    # The answer tells the front door whether to accept the update or
+    # have Telegram retry it later
+    async def handle_update(frame: dict) -> bool:
+        update = Update.model_validate(frame["update"], context={"bot": bot})
+        return await updates.put(update)
+
+    async def handle_send(frame: dict) -> asyncio.Future:
+        return outbox.enqueue(bot, sharding.load_method(frame), frame["priority"])
+
+    async def handle_report(frame: dict) -> asyncio.Future:
+        return asyncio.ensure_future(_report(frame["reporter_id"], frame["reported_id"]))
+
+    async def handle_debit(frame: dict) -> bool:
+        return await coins.debit_many(
+            tuple(frame["telegram_ids"]), frame["amount"], frame["reason"], frame["ref"], forward=False
+        )
+
+    async def handle_refund(frame: dict):
+        await coins.refund_many(tuple(frame["telegram_ids"]), frame["amount"], frame["ref"], forward=False)
+
+    # Only sent to sharding.SPECIAL_SEARCH_SHARD, which holds the pool
+    async def handle_special_search(frame: dict) -> asyncio.Future:
+        search_filter = SearchFilter(**frame["filter"])
+        return asyncio.ensure_future(special_search.search(bot, frame["user"], search_filter))
+
+    async def handle_special_cancel(frame: dict) -> bool:
+        return await leave_filtered_waiting(*frame["user_ids"])
+
+    server = await sharding.serve(SHARD_NAME, {
+        "update": handle_update,
+        "send": handle_send,
+        "report": handle_report,
+        "debit": handle_debit,
+        "refund": handle_refund,
+        "special_search": handle_special_search,
+        "special_cancel": handle_special_cancel,
+    })
+    logger.info("Shard %s listening on %s", SHARD_NAME, sharding.socket_path(SHARD_NAME))
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await updates.stop()
+        await sharding.close()
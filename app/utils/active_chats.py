@@ -1,4 +0,0 @@
-# key: telegram_id
-# value: partner_telegram_id
-
-active_chats: dict[int, int] = {}
@@ -1,20 +1,117 @@
-IRAN_PROVINCES = {
-    "تهران": [
-        "تهران", "ری", "شمیرانات", "اسلامشهر", "ملارد", "قدس"
-    ],
-    "اصفهان": [
-        "اصفهان", "کاشان", "نجف‌آباد", "خمینی‌شهر", "شاهین‌شهر"
-    ],
-    "فارس": [
-        "شیراز", "مرودشت", "کازرون", "لار", "جهرم"
-    ],
-    "خراسان رضوی": [
-        "مشهد", "نیشابور", "سبزوار", "تربت حیدریه"
-    ],
-    "آذربایجان شرقی": [
-        "تبریز", "مراغه", "میانه", "مرند"
-    ],
-    "مازندران": [
-        "ساری", "بابل", "آمل", "قائم‌شهر", "نوشهر"
-    ]
-}
+import os
+from functools import lru_cache
+from typing import NamedTuple
+
+# One line per province: "province|city|city|..." (see the file header)
+_DATA_FILE = os.path.join(os.path.dirname(__file__), "iran_locations.txt")
+
+# Typed input is compared in a normalized form: Arabic letters folded to
+# their Persian forms, alef variants merged, and ZWNJ, diacritics,
+# tatweel, spaces and dashes dropped.
+_NORMALIZE = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی",
+    "ك": "ک",
+    "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ؤ": "و",
+    "‌": None, "‍": None, "‎": None, "‏": None,
+    "ـ": None,
+    **{chr(c): None for c in range(0x064B, 0x0653)},
+    " ": None, "-": None, "_": None,
+})
+
+FUZZY_CUTOFF = 0.8
+
+
+def normalize(text: str) -> str:
+    return text.strip().translate(_NORMALIZE)
+
+
+class _Index(NamedTuple):
+    provinces: dict[str, tuple[str, ...]]
+    city_sets: dict[str, frozenset[str]]
+    province_keys: dict[str, str]
+    city_keys: dict[str, dict[str, str]]
+
+
+@lru_cache(maxsize=None)
+def _index() -> _Index:
+    provinces = {}
+    with open(_DATA_FILE, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            province, *cities = line.rstrip("\n").split("|")
+            provinces[province] = tuple(cities)
+
+    return _Index(
+        provinces=provinces,
+        city_sets={p: frozenset(cities) for p, cities in provinces.items()},
+        province_keys={normalize(p): p for p in provinces},
+        city_keys={
+            p: {normalize(c): c for c in cities}
+            for p, cities in provinces.items()
+        }
+    )
+
+
+def __getattr__(name: str):
+    # The data file is only read the first time one of these is used;
+    # the value is then stored as a real module global, so later lookups
+    # never come back here
+    if name == "IRAN_PROVINCES":
+        value = {p: list(cities) for p, cities in _index().provinces.items()}
+    elif name == "PROVINCES":
+        value = frozenset(_index().provinces)
+    elif name == "CITIES":
+        value = _index().city_sets
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+# =========================
+# جستجو
+# =========================
+def provinces() -> tuple[str, ...]:
+    return tuple(_index().provinces)
+
+
+def province_cities(province: str) -> tuple[str, ...]:
+    return _index().provinces.get(province, ())
+
+
+def _lookup(keys: dict[str, str], text: str) -> str | None:
+    key = normalize(text)
+    if not key:
+        return None
+
+    if key in keys:
+        return keys[key]
+
+    # Only needed for near misses; keeps module import cheap
+    import difflib
+
+    close = difflib.get_close_matches(key, keys, n=1, cutoff=FUZZY_CUTOFF)
+    return keys[close[0]] if close else None
+
+
+def find_province(text: str) -> str | None:
+    """نام رسمی استان از روی متن کاربر (با تحمل غلط املایی جزئی)"""
+    text = text.strip()
+    if text.startswith("استان "):
+        text = text[len("استان "):]
+    return _lookup(_index().province_keys, text)
+
+
+def find_city(province: str, text: str) -> str | None:
+    """نام رسمی شهر در یک استان از روی متن کاربر"""
+    keys = _index().city_keys.get(province)
+    if not keys:
+        return None
+    return _lookup(keys, text)
+
+
+def is_valid_city(province: str, city: str) -> bool:
+    return city in _index().city_sets.get(province, ())
@@ -0,0 +1,173 @@
+import asyncio
+import hmac
+import logging
+import time
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from app import metrics
+from app.config import (
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_QUEUE_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueue:
+    """
+    صف محدود آپدیت‌ها + چند worker برای پردازش
+
+    Updates are spread over one bounded queue per worker by user id, so a
+    user's updates are still handled one at a time and in order (their
+    FSM steps depend on it) while different users run in parallel.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, workers: int, size: int):
+        self.bot = bot
+        self.dp = dp
+        self.queues = [asyncio.Queue(maxsize=max(size // workers, 1)) for _ in range(workers)]
+        self.tasks: list[asyncio.Task] = []
+
+        self.stats = {
+            "received": 0,
+            "rejected_unauthorized": 0,
+            "rejected_full": 0,
+            "processed": 0,
+            "failed": 0,
+            "in_flight": 0,
+            "max_depth": 0,
+            "wait_seconds_total": 0.0,
+            "handle_seconds_total": 0.0,
+        }
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def _queue_for(self, update: Update) -> asyncio.Queue:
+        user = getattr(update.event, "from_user", None)
+        key = user.id if user else update.update_id
+        return self.queues[key % len(self.queues)]
+
+    async def put(self, update: Update) -> bool:
+        """اضافه کردن آپدیت؛ اگر صف پر بماند False برمی‌گرداند"""
+        queue = self._queue_for(update)
+        try:
+            await asyncio.wait_for(
+                queue.put((time.monotonic(), update)),
+                timeout=WEBHOOK_QUEUE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            self.stats["rejected_full"] += 1
+            return False
+
+        self.stats["received"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.depth())
+        return True
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            enqueued_at, update = await queue.get()
+            started = time.monotonic()
+            self.stats["wait_seconds_total"] += started - enqueued_at
+            self.stats["in_flight"] += 1
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.exception("Update %s failed: %s", update.update_id, e)
+            finally:
+                self.stats["in_flight"] -= 1
+                self.stats["handle_seconds_total"] += time.monotonic() - started
+                queue.task_done()
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+
+    async def stop(self, timeout: float = 10):
+        """تمام کردن آپدیت‌های باقی‌مانده و خاموش کردن workerها"""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self.queues)),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Stopping with %s updates still queued", self.depth())
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def snapshot(self) -> dict:
+        stats = dict(self.stats)
+        stats["depth"] = self.depth()
+        stats["capacity"] = sum(queue.maxsize for queue in self.queues)
+        stats["workers"] = len(self.queues)
+        return stats
+
+
+def create_app(updates: UpdateQueue) -> web.Application:
+    async def handle_update(request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if WEBHOOK_SECRET and not hmac.compare_digest(token, WEBHOOK_SECRET):
+            updates.stats["rejected_unauthorized"] += 1
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": updates.bot})
+        except ValueError:
+            return web.Response(status=400)
+
+        # A non-2xx answer makes Telegram keep the update and retry later,
+        # which is exactly the backpressure we want when the queue is full
+        if not await updates.put(update):
+            return web.Response(status=503)
+
+        return web.Response()
+
+    async def handle_stats(request: web.Request) -> web.Response:
+        return web.json_response(updates.snapshot())
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get(f"{WEBHOOK_PATH}/stats", handle_stats)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """اجرای ربات در حالت وبهوک"""
+    updates = UpdateQueue(bot, dp, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+    updates.start()
+
+    @metrics.collector
+    async def collect_queue():
+        metrics.webhook_queue_depth.set(updates.depth())
+
+    runner = web.AppRunner(create_app(updates))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    # Pending updates are kept: Telegram delivers whatever queued up while
+    # we were down as soon as the new webhook is in place
+    await bot.set_webhook(
+        url=f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False
+    )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await updates.stop()
@@ -0,0 +1,362 @@
+"""
+تست بار کامل ربات با یک Bot API جعلی
+
+Starts a local stand-in for the Telegram Bot API (and the Zarinpal
+request endpoint), builds the real Dispatcher from app.bot against a
+throw-away database, and feeds it synthetic updates for N users in
+phases: registration, matching, chat relays, profile views, ending the
+chat, and buying coins. Each user's updates are handled in order, while
+different users run concurrently, as in the webhook worker queue.
+
+Reports throughput per phase, p50/p99 latency per handler, and
+SQLite statements per update. The same seed gives the same stream, so
+results can be saved and compared between runs:
+
+    python bench/loadtest.py --users 200 --save base.json
+    python bench/loadtest.py --users 200 --baseline base.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = ("register", "match", "relay", "profile", "end", "payment")
+
+# Handler that took the update being fed in this task
+_current: ContextVar[dict] = ContextVar("current")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# =========================
+# Bot API جعلی
+# =========================
+async def run_fake_api(port: int, calls: dict) -> web.AppRunner:
+    message_ids = iter(range(1, 1 << 62))
+
+    def message(chat_id) -> dict:
+        return {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"}
+        }
+
+    async def bot_method(request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        form = await request.post()
+        calls[method] += 1
+
+        if method in ("sendmessage", "sendphoto"):
+            result = message(form["chat_id"])
+        elif method == "copymessage":
+            result = {"message_id": next(message_ids)}
+        elif method == "copymessages":
+            result = [{"message_id": next(message_ids)} for _ in json.loads(form["message_ids"])]
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def zarinpal_request(request: web.Request) -> web.Response:
+        calls["zarinpal"] += 1
+        return web.json_response({"data": {"code": 100, "authority": f"A{calls['zarinpal']:010d}"}})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", bot_method)
+    app.router.add_post("/pg/v4/payment/request.json", zarinpal_request)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+# =========================
+# آپدیت‌های مصنوعی
+# =========================
+def user_scripts(users: int, relays: int, seed: int) -> dict[str, list[list[dict]]]:
+    """برای هر فاز، لیست پیام‌های هر کاربر (به ترتیب)"""
+    from app.utils.iran_locations import provinces, province_cities
+    from app.handlers.payments import PACKAGES
+
+    rng = random.Random(seed)
+    packages = list(PACKAGES)
+    scripts = {phase: [] for phase in PHASES}
+
+    for i in range(users):
+        uid = 100000 + i
+        gender, target = ("پسر", "دختر") if i % 2 == 0 else ("دختر", "پسر")
+        province = rng.choice(provinces())
+        city = rng.choice(province_cities(province))
+
+        scripts["register"].append([
+            {"text": "/start"},
+            {"text": f"user{uid}"},
+            {"text": gender},
+            {"text": province},
+            {"text": city},
+            {"text": str(rng.randint(18, 40))},
+            {"photo": f"P{uid}"},
+        ])
+        scripts["match"].append([{"text": "🔍 اتصال ناشناس"}, {"text": target}])
+        scripts["relay"].append([
+            {"photo": f"R{uid}-{n}"} if rng.random() < 0.1 else {"text": f"msg {n} from {uid}"}
+            for n in range(relays)
+        ])
+        scripts["profile"].append([{"text": "👤 مشاهده پروفایل"}, {"text": "👤 پروفایل من"}])
+        scripts["end"].append([{"text": "❌ اتمام چت"}])
+        scripts["payment"].append([{"text": "💳 خرید سکه"}, {"text": rng.choice(packages)}])
+
+    return scripts
+
+
+def make_update(update_id: int, uid: int, content: dict) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": uid, "type": "private"},
+        "from": {"id": uid, "is_bot": False, "first_name": "load"}
+    }
+    if "photo" in content:
+        photo = content["photo"]
+        message["photo"] = [{"file_id": photo, "file_unique_id": photo, "width": 1, "height": 1}]
+    else:
+        message["text"] = content["text"]
+    return {"update_id": update_id, "message": message}
+
+
+# =========================
+# اندازه‌گیری
+# =========================
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.background_statements = 0
+
+    def count_statements(self, db):
+        """شمارش دستورهای SQL؛ هر دستور به آپدیتی که آن را اجرا کرده نسبت داده می‌شود"""
+        def counted(method):
+            def call(sql, *args, **kwargs):
+                info = _current.get(None)
+                if info is None:
+                    # Write-behind flushes and other background loops
+                    self.background_statements += 1
+                else:
+                    info["statements"] += 1
+                return method(sql, *args, **kwargs)
+            return call
+
+        db.execute = counted(db.execute)
+        db.executemany = counted(db.executemany)
+
+    async def middleware(self, handler, event, data):
+        callback = data["handler"].callback
+        _current.get()["handler"] = f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__name__}"
+        return await handler(event, data)
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+async def run_phase(bot, dp, recorder: Recorder, scripts: list[list[dict]], concurrency: int, ids) -> dict:
+    from aiogram.types import Update
+    from app.services.sender import outbox
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    statements = 0
+
+    async def play(uid: int, steps: list[dict]):
+        nonlocal statements
+        async with semaphore:
+            for content in steps:
+                update = Update.model_validate(make_update(next(ids), uid, content), context={"bot": bot})
+                info = {"handler": "unhandled", "statements": 0}
+                token = _current.set(info)
+                started = time.perf_counter()
+                await dp.feed_update(bot, update)
+                recorder.latencies[info["handler"]].append(time.perf_counter() - started)
+                _current.reset(token)
+                statements += info["statements"]
+
+    updates = sum(len(steps) for steps in scripts)
+    started = time.perf_counter()
+
+    await asyncio.gather(*(play(100000 + i, steps) for i, steps in enumerate(scripts)))
+    elapsed = time.perf_counter() - started
+
+    # Let queued replies go out before the next phase starts
+    while outbox.depth():
+        await asyncio.sleep(0.01)
+
+    return {
+        "updates": updates,
+        "seconds": elapsed,
+        "updates_per_second": updates / elapsed if elapsed else 0.0,
+        "statements_per_update": statements / updates if updates else 0.0,
+    }
+
+
+async def main(args) -> int:
+    calls = defaultdict(int)
+    runner = await run_fake_api(args.port, calls)
+
+    from aiogram.client.telegram import TelegramAPIServer
+    from app import bot as app_bot
+    from app import database
+    from app.services.bot_session import CachedMarkupSession
+
+    bot = app_bot.create_bot(CachedMarkupSession(
+        api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.port}")
+    ))
+    dp = app_bot.create_dispatcher()
+
+    # Per-update INFO logs would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+
+    recorder = Recorder()
+    dp.message.middleware(recorder.middleware)
+    dp.callback_query.middleware(recorder.middleware)
+
+    await app_bot.start_services(bot)
+    for db in [database._writer, *database._all_readers]:
+        recorder.count_statements(db)
+
+    scripts = user_scripts(args.users, args.relays, args.seed)
+    ids = iter(range(1, 1 << 62))
+    results = {
+        "users": args.users, "relays": args.relays,
+        "concurrency": args.concurrency, "seed": args.seed, "phases": {}
+    }
+
+    try:
+        for phase in PHASES:
+            results["phases"][phase] = await run_phase(
+                bot, dp, recorder, scripts[phase], args.concurrency, ids
+            )
+    finally:
+        await app_bot.stop_services(dp)
+        await bot.session.close()
+        await runner.cleanup()
+
+    results["handlers"] = {
+        name: {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+        }
+        for name, values in sorted(recorder.latencies.items())
+    }
+    results["api_calls"] = dict(sorted(calls.items()))
+    results["background_statements"] = recorder.background_statements
+
+    report(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            return compare(json.load(f), results, args.tolerance)
+    return 0
+
+
+def report(results: dict):
+    print(f"\n{'phase':<10} {'updates':>8} {'upd/s':>10} {'stmts/upd':>10}")
+    for phase, r in results["phases"].items():
+        print(f"{phase:<10} {r['updates']:>8} {r['updates_per_second']:>10.0f} {r['statements_per_update']:>10.2f}")
+
+    print(f"\n{'handler':<40} {'count':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, r in results["handlers"].items():
+        print(f"{name:<40} {r['count']:>7} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+    print("\nBot API calls:", ", ".join(f"{k}={v}" for k, v in results["api_calls"].items()))
+    print("Background SQL statements:", results["background_statements"])
+
+
+def compare(base: dict, new: dict, tolerance: float) -> int:
+    """مقایسه با اجرای قبلی؛ کد خروج 1 در صورت افت عملکرد"""
+    settings = ("users", "relays", "concurrency", "seed")
+    if any(base.get(key) != new[key] for key in settings):
+        print("⚠️ baseline was recorded with different --users/--relays/--concurrency/--seed")
+
+    regressions = []
+    for phase, r in new["phases"].items():
+        old = base["phases"].get(phase)
+        if not old:
+            continue
+        if r["updates_per_second"] < old["updates_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{phase}: {old['updates_per_second']:.0f} -> {r['updates_per_second']:.0f} upd/s"
+            )
+        # Nearly deterministic: only cache reloads after a background flush
+        # invalidated a user depend on timing
+        if r["statements_per_update"] > old["statements_per_update"] * 1.1 + 0.05:
+            regressions.append(
+                f"{phase}: {old['statements_per_update']:.2f} -> {r['statements_per_update']:.2f} statements/update"
+            )
+
+    # p99 is too noisy on a shared machine to gate on; p50 is stable
+    for name, r in new["handlers"].items():
+        old = base["handlers"].get(name)
+        if old and r["p50_ms"] > old["p50_ms"] * (1 + tolerance) and r["p50_ms"] - old["p50_ms"] > 1:
+            regressions.append(f"{name}: p50 {old['p50_ms']:.2f} -> {r['p50_ms']:.2f} ms")
+
+    if regressions:
+        print("\n❌ regressions against baseline:")
+        for line in regressions:
+            print("   ", line)
+        return 1
+
+    print("\n✅ no regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--relays", type=int, default=20, help="messages each user sends in chat")
+    parser.add_argument("--concurrency", type=int, default=50, help="users in flight at once")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    args = parser.parse_args()
+    args.port = args.port or free_port()
+    if args.save:
+        args.save = os.path.abspath(args.save)
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+
+    # Must be set before app.config is imported
+    os.environ.setdefault("BOT_TOKEN", "42:LOADTEST")
+    os.environ["ZARINPAL_REQUEST_URL"] = f"http://127.0.0.1:{args.port}/pg/v4/payment/request.json"
+    os.environ["STATE_BACKEND"] = "memory"
+    # The fake API has no flood limits; measure the bot, not the throttle
+    os.environ["OUTBOX_GLOBAL_RATE"] = "1000000"
+    os.environ["OUTBOX_CHAT_RATE"] = "1000000"
+    os.environ["OUTBOX_CHAT_BURST"] = "1000000"
+
+    # The database file is relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="loadtest-"))
+    sys.path.insert(0, ROOT)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,269 @@
+"""
+تست فشار جفت‌شدن همزمان
+
+Seeds N registered users and, in every round, feeds a "target gender"
+update for each of them through the real Dispatcher, all at once. Some
+users tap twice, and some lose coins while they wait. After each round
+it checks that:
+
+- nobody was paired twice, and every chat is symmetric;
+- nobody is in a chat and in the waiting queue at the same time;
+- no reservation was left behind;
+- every user paid exactly CHAT_COST per chat and no balance went negative.
+
+Exits with code 1 on the first broken invariant.
+
+    python bench/match_stress.py --users 2000 --rounds 5
+    python bench/match_stress.py --backend redis --fakeredis
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GENDERS = ("پسر", "دختر")
+
+
+def fake_session():
+    """سشن ربات بدون شبکه؛ هر درخواست فوراً جواب می‌گیرد"""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage
+    from aiogram.types import Message
+
+    message_ids = itertools.count(1)
+
+    class FakeSession(BaseSession):
+        async def make_request(self, bot, method, timeout=None):
+            if isinstance(method, SendMessage):
+                return Message(
+                    message_id=next(message_ids), date=int(time.time()),
+                    chat={"id": method.chat_id, "type": "private"}, text=method.text
+                )
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+
+async def seed(users: list[int], coins: dict[int, int], genders: dict[int, str]):
+    from app.database import write_db
+
+    async with write_db() as db:
+        await db.executemany(
+            """
+            INSERT INTO users (telegram_id, name, gender, province, city, age, coins)
+            VALUES (?, ?, ?, 'تهران', 'تهران', 25, ?)
+            """,
+            [(uid, f"user{uid}", genders[uid], coins[uid]) for uid in users]
+        )
+        await db.executemany(
+            """
+            INSERT INTO coin_ledger (telegram_id, delta, reason, source, created_at)
+            VALUES (?, ?, 'opening', 'stress', ?)
+            """,
+            [(uid, coins[uid], time.time()) for uid in users]
+        )
+
+
+def update(uid: int, text: str, ids):
+    from aiogram.types import Update
+
+    return Update.model_validate({
+        "update_id": next(ids),
+        "message": {
+            "message_id": next(ids), "date": int(time.time()), "text": text,
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": "u"}
+        }
+    })
+
+
+async def leftover_reservations(backend) -> int:
+    from app.services import matcher
+
+    if hasattr(backend, "_pairing"):
+        return await backend._redis.hlen(backend._pairing)
+    return len(matcher.pairing)
+
+
+async def check(backend, users: list[int], pairs: list[tuple[int, int]]) -> list[str]:
+    """نقض‌های invariantها در پایان یک دور"""
+    errors = []
+
+    seen = Counter(uid for pair in pairs for uid in pair)
+    for uid, times in seen.items():
+        if times > 1:
+            errors.append(f"user {uid} was paired {times} times")
+
+    expected = {}
+    for a, b in pairs:
+        expected[a], expected[b] = b, a
+
+    for uid in users:
+        partner = await backend.get_partner(uid)
+        if partner != expected.get(uid):
+            errors.append(f"user {uid} chats with {partner}, expected {expected.get(uid)}")
+        if partner is not None:
+            if await backend.get_partner(partner) != uid:
+                errors.append(f"chat {uid} -> {partner} is not symmetric")
+            if await backend.is_waiting(uid):
+                errors.append(f"user {uid} is in a chat and waiting")
+
+    left = await leftover_reservations(backend)
+    if left:
+        errors.append(f"{left} reservations left behind")
+    return errors
+
+
+async def main(args) -> int:
+    from app import bot as app_bot
+    from app.handlers.match import CHAT_COST
+    from app.services import coins
+    from app.services.state import backend
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+
+    bot = app_bot.create_bot(fake_session())
+    dp = app_bot.create_dispatcher()
+    await app_bot.start_services(bot)
+
+    users = [200000 + i for i in range(args.users)]
+    genders = {uid: rng.choice(GENDERS) for uid in users}
+    # Some users can afford a single chat, so debits fail mid-pairing
+    balance = {
+        uid: CHAT_COST if rng.random() < 0.2 else CHAT_COST * (args.rounds + 1)
+        for uid in users
+    }
+    await seed(users, balance, genders)
+
+    # Every confirmed pairing and every released one
+    pairs: list[tuple[int, int]] = []
+    released = Counter()
+
+    confirm_pair, release_pair = backend.confirm_pair, backend.release_pair
+
+    async def confirm(user1_id, user2_id):
+        ok = await confirm_pair(user1_id, user2_id)
+        if ok:
+            pairs.append((user1_id, user2_id))
+        return ok
+
+    async def release(user1_id, user2_id, requeue=()):
+        ok = await release_pair(user1_id, user2_id, requeue)
+        if ok:
+            released["requeued" if requeue else "dropped"] += 1
+        return ok
+
+    backend.confirm_pair, backend.release_pair = confirm, release
+
+    ids = itertools.count(1)
+    chats = Counter()
+    spent = Counter()
+    failed = False
+
+    async def spend(uid: int):
+        # Coins spent elsewhere while the user waits, so that their
+        # partner's pairing finds them short
+        for _ in range(500):
+            if await backend.is_waiting(uid):
+                if await coins.debit(uid, CHAT_COST, "stress"):
+                    spent[uid] += CHAT_COST
+                return
+            await asyncio.sleep(0.01)
+
+    try:
+        for round_no in range(1, args.rounds + 1):
+            pairs.clear()
+            requests = []
+            for uid in users:
+                text = rng.choice(GENDERS)
+                taps = 2 if rng.random() < args.double_taps else 1
+                requests += [dp.feed_update(bot, update(uid, text, ids)) for _ in range(taps)]
+            drains = [spend(uid) for uid in rng.sample(users, len(users) // 20)]
+            rng.shuffle(requests)
+
+            started = time.perf_counter()
+            await asyncio.gather(*requests, *drains)
+            elapsed = time.perf_counter() - started
+
+            errors = await check(backend, users, pairs)
+            for a, b in pairs:
+                chats[a] += 1
+                chats[b] += 1
+
+            print(
+                f"round {round_no}: {len(requests)} requests in {elapsed:.2f}s "
+                f"({len(requests) / elapsed:.0f}/s), {len(pairs)} chats, "
+                f"{released['requeued']} partners requeued, {released['dropped']} pairings dropped"
+            )
+            released.clear()
+
+            if errors:
+                for error in errors[:20]:
+                    print(f"❌ {error}")
+                failed = True
+                break
+
+            for uid in users:
+                await backend.end_chat(uid)
+                await backend.cancel_waiting(uid)
+
+        if not failed:
+            for uid in users:
+                expected = balance[uid] - CHAT_COST * chats[uid] - spent[uid]
+                actual = await coins.get_balance(uid)
+                if actual != expected or actual < 0:
+                    print(f"❌ user {uid} has {actual} coins, expected {expected}")
+                    failed = True
+                    break
+    finally:
+        await app_bot.stop_services(dp)
+        await bot.session.close()
+
+    if failed:
+        return 1
+    print(f"✅ {sum(chats.values()) // 2} chats, nobody paired twice, every chat paid for exactly once")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--double-taps", type=float, default=0.2, help="share of users who tap twice")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend", choices=("memory", "redis"), default="memory")
+    parser.add_argument("--fakeredis", action="store_true", help="use an in-process fakeredis server")
+    args = parser.parse_args()
+
+    # Must be set before app.config is imported
+    os.environ.setdefault("BOT_TOKEN", "42:STRESS")
+    os.environ["STATE_BACKEND"] = args.backend
+    os.environ["OUTBOX_GLOBAL_RATE"] = "1000000"
+    os.environ["OUTBOX_CHAT_RATE"] = "1000000"
+    os.environ["OUTBOX_CHAT_BURST"] = "1000000"
+    os.environ["REDIS_PREFIX"] = f"stress:{os.getpid()}:"
+
+    if args.fakeredis:
+        import fakeredis
+        from redis import asyncio as aioredis
+        aioredis.from_url = lambda url, **kwargs: fakeredis.aioredis.FakeRedis(**kwargs)
+
+    # The database file is relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="match-stress-"))
+    sys.path.insert(0, ROOT)
+    sys.exit(asyncio.run(main(args)))
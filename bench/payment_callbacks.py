@@ -0,0 +1,153 @@
+"""
+تست بار: ارسال هم‌زمان callbackهای تکراری پرداخت
+
+Starts a fake Zarinpal gateway, runs webhook.payment_api under uvicorn with
+several worker processes against a throw-away database, then fires every
+callback many times in parallel. Each payment must be verified with the
+gateway once and credited exactly once.
+
+    python bench/payment_callbacks.py --payments 200 --duplicates 5 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COINS = 50
+
+
+async def run_gateway(port: int, hits: dict) -> web.AppRunner:
+    verified = set()
+
+    async def verify(request: web.Request) -> web.Response:
+        data = await request.json()
+        hits[data["authority"]] = hits.get(data["authority"], 0) + 1
+        await asyncio.sleep(0.05)
+        code = 101 if data["authority"] in verified else 100
+        verified.add(data["authority"])
+        return web.json_response({"data": {"code": code, "ref_id": 1}})
+
+    app = web.Application()
+    app.router.add_post("/verify", verify)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def prepare_db(payments: int):
+    from app.database import init_db, write_db, close_db
+
+    await init_db()
+    async with write_db() as db:
+        await db.executemany(
+            "INSERT INTO users (telegram_id, name, coins) VALUES (?, ?, 0)",
+            [(1000 + i, f"user{i}") for i in range(payments)]
+        )
+        await db.executemany(
+            "INSERT INTO payments (user_id, amount, coins, authority) VALUES (?, ?, ?, ?)",
+            [(1000 + i, 25000, COINS, f"A{i}") for i in range(payments)]
+        )
+    await close_db()
+
+
+async def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url):
+                    return
+            except OSError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("payment API did not start")
+
+
+async def fire(port: int, payments: int, duplicates: int) -> dict:
+    results: dict[str, int] = {}
+    url = f"http://127.0.0.1:{port}/payment/callback"
+
+    async with ClientSession() as session:
+        async def one(authority: str):
+            async with session.get(url, params={"Authority": authority, "Status": "OK"}) as resp:
+                message = (await resp.json())["message"]
+                results[message] = results.get(message, 0) + 1
+
+        requests = [f"A{i}" for i in range(payments) for _ in range(duplicates)]
+        await asyncio.gather(*(one(authority) for authority in requests))
+
+    return results
+
+
+async def main(args):
+    hits: dict[str, int] = {}
+    gateway = await run_gateway(args.gateway_port, hits)
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        ZARINPAL_VERIFY_URL=f"http://127.0.0.1:{args.gateway_port}/verify"
+    )
+    api = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "webhook.payment_api:app",
+            "--port", str(args.port), "--workers", str(args.workers),
+            "--log-level", "warning"
+        ],
+        cwd=os.getcwd(),
+        env=env
+    )
+
+    try:
+        await wait_ready(f"http://127.0.0.1:{args.port}/docs")
+
+        started = time.perf_counter()
+        results = await fire(args.port, args.payments, args.duplicates)
+        elapsed = time.perf_counter() - started
+    finally:
+        api.terminate()
+        api.wait()
+        await gateway.cleanup()
+
+    from app.database import read_db, close_db
+    async with read_db() as db:
+        async with db.execute("SELECT COUNT(*), SUM(coins) FROM users") as cursor:
+            users, coins = await cursor.fetchone()
+        async with db.execute(
+            "SELECT status, COUNT(*) FROM payments GROUP BY status"
+        ) as cursor:
+            statuses = dict(await cursor.fetchall())
+    await close_db()
+
+    total = args.payments * args.duplicates
+    print(f"{total} callbacks in {elapsed:.2f}s ({total / elapsed:.0f}/s)")
+    print("responses:", results)
+    print("payment statuses:", statuses)
+    print("gateway verify calls:", sum(hits.values()))
+    print(f"coins credited: {coins} (expected {args.payments * COINS})")
+
+    ok = coins == args.payments * COINS and max(hits.values(), default=0) == 1
+    print("✅ OK" if ok else "❌ double verify or double credit")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=200)
+    parser.add_argument("--duplicates", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--gateway-port", type=int, default=8766)
+    args = parser.parse_args()
+
+    # The database file is relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="payment-bench-"))
+    sys.path.insert(0, ROOT)
+    asyncio.run(prepare_db(args.payments))
+    sys.exit(asyncio.run(main(args)))
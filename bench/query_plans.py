@@ -0,0 +1,134 @@
+"""
+مقایسه query plan و زمان کوئری‌های پرتکرار قبل و بعد از ایندکس‌ها
+
+Builds a throw-away database at schema version 1, fills it with
+synthetic rows, runs the hot queries, then migrates to the latest version
+and runs them again. Every query must end up using an index.
+
+    python bench/query_plans.py --users 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERIES = {
+    "reports against a user": (
+        """
+        SELECT COUNT(DISTINCT reporter_id) FROM reports
+        WHERE reported_id = ? AND created_at > datetime('now', '-1 day')
+        """,
+        lambda n: (random.randrange(n),)
+    ),
+    "user's pending payments": (
+        "SELECT id FROM payments WHERE user_id = ? AND status = 'pending'",
+        lambda n: (random.randrange(n),)
+    ),
+    "reconcile page": (
+        """
+        SELECT id, authority FROM payments
+        WHERE status = 'pending' AND id > ? ORDER BY id LIMIT 200
+        """,
+        lambda n: (random.randrange(n),)
+    ),
+    "referrals by inviter": (
+        "SELECT COUNT(*) FROM referrals WHERE inviter_telegram_id = ?",
+        lambda n: (random.randrange(n),)
+    ),
+    "active bans": (
+        "SELECT telegram_id, banned_until FROM users WHERE banned_until > datetime('now')",
+        lambda n: ()
+    ),
+}
+
+
+async def fill(users: int):
+    from app.database import write_db
+
+    rng = random.Random(1)
+    async with write_db() as db:
+        await db.executemany(
+            "INSERT INTO users (telegram_id, name, coins, banned_until) VALUES (?, ?, 0, ?)",
+            [
+                (i, f"user{i}", "2099-01-01 00:00:00" if rng.random() < 0.001 else None)
+                for i in range(users)
+            ]
+        )
+        await db.executemany(
+            "INSERT INTO reports (reporter_id, reported_id, reason) VALUES (?, ?, 'spam')",
+            [(rng.randrange(users), rng.randrange(users)) for _ in range(users * 2)]
+        )
+        await db.executemany(
+            "INSERT INTO payments (user_id, amount, coins, authority, status) VALUES (?, 25000, 50, ?, ?)",
+            [
+                (rng.randrange(users), f"A{i}", "pending" if rng.random() < 0.02 else "success")
+                for i in range(users)
+            ]
+        )
+        await db.executemany(
+            "INSERT INTO referrals (inviter_telegram_id, invited_telegram_id) VALUES (?, ?)",
+            [(rng.randrange(users), i) for i in range(users // 2)]
+        )
+
+
+async def measure(users: int, runs: int) -> dict:
+    from app.database import read_db
+
+    results = {}
+    async with read_db() as db:
+        for name, (sql, params) in QUERIES.items():
+            async with db.execute(f"EXPLAIN QUERY PLAN {sql}", params(users)) as cursor:
+                plan = " / ".join(row[3] for row in await cursor.fetchall())
+
+            started = time.perf_counter()
+            for _ in range(runs):
+                async with db.execute(sql, params(users)) as cursor:
+                    await cursor.fetchall()
+            elapsed = (time.perf_counter() - started) / runs
+
+            results[name] = (plan, elapsed * 1000)
+    return results
+
+
+async def main(args) -> int:
+    from app.database import init_db, close_db
+
+    await init_db(target=1)
+    await fill(args.users)
+    before = await measure(args.users, args.runs)
+
+    await init_db()
+    await close_db()
+    after = await measure(args.users, args.runs)
+    await close_db()
+
+    ok = True
+    for name in QUERIES:
+        plan_before, ms_before = before[name]
+        plan_after, ms_after = after[name]
+        uses_index = "USING INDEX" in plan_after or "USING COVERING INDEX" in plan_after
+        ok = ok and uses_index
+
+        print(f"■ {name}: {ms_before:.3f} ms -> {ms_after:.3f} ms")
+        print(f"    before: {plan_before}")
+        print(f"    after:  {plan_after}")
+
+    print("✅ all hot queries use an index" if ok else "❌ some queries still scan")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    # The database file is relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="query-plans-"))
+    sys.path.insert(0, ROOT)
+    sys.exit(asyncio.run(main(args)))
@@ -1,10 +1,30 @@
 from fastapi import FastAPI, Request
-from app.database import get_db
-from app.services.payments import verify_payment
-from app.services.coins import add_coins
+from fastapi.responses import PlainTextResponse
+from app import metrics
+from app.config import RECONCILE_ENABLED
+from app.database import open_db, close_db
+from app.services import reconcile
+from app.services.payments import zarinpal
+from app.services.settlement import settle_payment, SETTLED, REJECTED, UNKNOWN
 
 app = FastAPI()
 
+metrics.collector(metrics.collect_pending_payments)
+
+
+@app.on_event("startup")
+async def startup():
+    await open_db()
+    if RECONCILE_ENABLED:
+        reconcile.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await reconcile.stop()
+    await zarinpal.close()
+    await close_db()
+
 
 @app.get("/payment/callback")
 async def payment_callback(request: Request):
@@ -14,36 +34,26 @@ async def payment_callback(request: Request):
     if status != "OK":
         return {"message": "پرداخت ناموفق بود"}
 
-    db = await get_db()
-    async with db.execute(
-        "SELECT * FROM payments WHERE authority = ? AND status = 'pending'",
-        (authority,)
-    ) as cursor:
-        payment = await cursor.fetchone()
-
-    if not payment:
-        await db.close()
-        return {"message": "پرداخت قبلاً بررسی شده"}
-
-    success = await verify_payment(authority, payment["amount"])
-
-    if not success:
-        await db.execute(
-            "UPDATE payments SET status = 'failed' WHERE authority = ?",
-            (authority,)
-        )
-        await db.commit()
-        await db.close()
+    result = await settle_payment(authority)
+
+    if result == SETTLED:
+        return {"message": "پرداخت با موفقیت انجام شد"}
+
+    if result == REJECTED:
         return {"message": "پرداخت تایید نشد"}
 
-    # موفق
-    await db.execute(
-        "UPDATE payments SET status = 'success' WHERE authority = ?",
-        (authority,)
-    )
-    await db.commit()
-    await db.close()
+    if result == UNKNOWN:
+        return {"message": "درگاه پاسخ نداد، لطفاً چند دقیقه دیگر دوباره تلاش کنید"}
+
+    return {"message": "پرداخت قبلاً بررسی شده"}
+
+
+@app.get("/payment/reconcile/stats")
+async def reconcile_stats():
+    return reconcile.stats
 
-    await add_coins(payment["user_id"], payment["coins"])
 
-    return {"message": "پرداخت با موفقیت انجام شد"}
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    # Each uvicorn worker keeps its own numbers
+    return await metrics.render()